@@ -1,29 +1,65 @@
+import logging
+import os
+import threading
+import time
+
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from decouple import config
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class AWSSession:
     """
     Class to interact wit Amazon Web Service (AWS) API through boto3 library
     """
 
-    def __init__(self):
+    def __init__(self, max_pool_connections=10):
 
         self.session = boto3.Session(
             aws_access_key_id=config('AWS_ACCESS_KEY_ID'),
             aws_secret_access_key=config('AWS_SECRET_ACCESS_KEY'))
         self.bucket_name = config('EARLY_TRANSACTION_BUCKET_NAME')
+        self.max_pool_connections = max_pool_connections
+        self.client = None
+        self.client_lock = threading.Lock()
+
+    def get_client(self):
+        # boto3 clients are thread safe, so one client (and its connection pool) is shared by every download. Sessions
+        # are not, so the client is created once under a lock even when the first calls come from download threads
+        if self.client is None:
+            with self.client_lock:
+                if self.client is None:
+                    self.client = self.session.client('s3',
+                                                      config=Config(max_pool_connections=self.max_pool_connections))
+        return self.client
 
-    def get_available_dates(self):
+    def get_available_dates(self, start_date=None, end_date=None):
         s3 = self.session.resource('s3')
         bucket = s3.Bucket(self.bucket_name)
 
+        if start_date is None:
+            objects = bucket.objects.all()
+        else:
+            # keys start with the date, so S3 can skip every key before the requested window
+            objects = bucket.objects.filter(Marker=start_date.strftime('%Y-%m-%d'))
+
         days = []
-        for obj in bucket.objects.all():
+        for obj in objects:
             date = obj.key.split('.')[0]
-            date = datetime.strptime(date, '%Y-%m-%d')
+            try:
+                date = datetime.strptime(date, '%Y-%m-%d')
+            except ValueError:
+                logger.warning('key {0} does not start with a date ... skip'.format(obj.key))
+                continue
+            if end_date is not None and date > end_date:
+                # keys are listed in lexicographical order, so the rest of them are after the window
+                break
             days.append(date)
 
         days.sort()
@@ -63,3 +99,50 @@ class AWSSession:
         s3 = self.session.resource('s3')
         bucket = s3.Bucket(self.bucket_name)
         bucket.download_file(obj_key, file_path)
+
+    def download_object_resumable(self, obj_key, file_path, object_info, retries=3, retry_delay=1):
+        """
+        Download an object whose ETag and size are object_info to file_path. Bytes are written to file_path.part,
+        which is kept when the download is interrupted, so the next attempt, or the next run, only requests the rest
+        of the object.
+        """
+        part_path = file_path + '.part'
+        for attempt in range(1, retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if offset > object_info['size']:
+                os.remove(part_path)
+                offset = 0
+            try:
+                if offset < object_info['size']:
+                    # the request fails if the object was replaced after the bytes of the part file were written
+                    response = self.get_client().get_object(Bucket=self.bucket_name, Key=obj_key,
+                                                            Range='bytes={0}-'.format(offset),
+                                                            IfMatch='"{0}"'.format(object_info['etag']))
+                    with open(part_path, 'ab') as part_file:
+                        for chunk in iter(lambda: response['Body'].read(DOWNLOAD_CHUNK_SIZE), b''):
+                            part_file.write(chunk)
+                if os.path.getsize(part_path) != object_info['size']:
+                    raise OSError('{0} has {1} bytes instead of {2}'.format(part_path, os.path.getsize(part_path),
+                                                                             object_info['size']))
+                os.replace(part_path, file_path)
+                return file_path
+            except ClientError as e:
+                error_code = e.response['Error']['Code']
+                if error_code in ('403', '404'):
+                    raise ValueError(e.response['Error'])
+                if error_code in ('412', 'PreconditionFailed', '416', 'InvalidRange') and os.path.exists(part_path):
+                    # bytes of the part file belong to another version of the object
+                    os.remove(part_path)
+                if attempt == retries:
+                    raise
+            except (BotoCoreError, OSError):
+                if attempt == retries:
+                    raise
+            logger.warning('download of {0} failed, {1} bytes are kept ... retry'.format(
+                obj_key, os.path.getsize(part_path) if os.path.exists(part_path) else 0))
+            time.sleep(retry_delay * attempt)
+
+    def get_object_info(self, obj_key):
+        response = self.get_client().head_object(Bucket=self.bucket_name, Key=obj_key)
+        # ETag is quoted, for objects uploaded in a single part it is their md5
+        return dict(etag=response['ETag'].strip('"'), size=response['ContentLength'])
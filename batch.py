@@ -0,0 +1,190 @@
+# -*- coding: utf8 -*-
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from datetime import datetime
+
+import process_data
+from instrumentation import RunReport
+from manifest import DataManifest
+from reference_data import load_metro_locations, load_metrotren_locations, load_stop_locations
+from stations import load_station_index
+
+logger = logging.getLogger(__name__)
+
+MODES = ['bus', 'metro', 'metrotren']
+
+
+def load_jobs(job_path):
+    """
+    Read a json list of jobs, each one with start_date, end_date, output_filename and optional comuna and mode.
+    """
+    with open(job_path) as job_file:
+        jobs = json.load(job_file)
+    output_filenames = set()
+    for job in jobs:
+        missing_fields = [field for field in ('start_date', 'end_date', 'output_filename') if field not in job]
+        if missing_fields:
+            raise ValueError('job {0} does not have {1}'.format(job, ', '.join(missing_fields)))
+        if job.get('mode') is not None and job['mode'] not in MODES:
+            raise ValueError('mode of job {0} must be one of {1}'.format(job['output_filename'], ', '.join(MODES)))
+        if job['output_filename'] in output_filenames:
+            raise ValueError('output_filename {0} is used by more than one job'.format(job['output_filename']))
+        output_filenames.add(job['output_filename'])
+        job['start'] = datetime.strptime(job['start_date'], '%Y-%m-%d')
+        job['end'] = datetime.strptime(job['end_date'], '%Y-%m-%d')
+    return jobs
+
+
+def get_stop_modes(inputs_path, metro_stations, reference_path=None):
+    # stops that are not metro or metrotren stations are bus stops
+    stop_modes = dict.fromkeys(load_metrotren_locations(inputs_path, reference_path), 'metrotren')
+    stop_modes.update(dict.fromkeys(set(load_metro_locations(inputs_path, reference_path)) | metro_stations, 'metro'))
+    return stop_modes
+
+
+def slice_output(output, dates, located_stops, comuna=None, mode=None, stop_modes=None):
+    """
+    Days of output in dates, as a run of those days alone would have built them: stops and metro stations with a
+    location but without transactions in those days have them with zero transactions.
+    """
+    sliced_output = dict()
+    for stop, data in output.items():
+        info = data['info']
+        if comuna is not None and info.get('area', '').lower() != comuna.lower():
+            continue
+        if mode is not None and stop_modes.get(stop, 'bus') != mode:
+            continue
+        stop_dates = dict((date, data['dates'][date]) for date in dates if date in data['dates'])
+        if not stop_dates and stop in located_stops:
+            stop_dates = dict.fromkeys(dates, 0)
+        if stop_dates:
+            sliced_output[stop] = dict(info=info, dates=stop_dates)
+    return sliced_output
+
+
+def list_days(aws_session, manifest, start_date, end_date, offline=False):
+    """
+    Days with a transaction file between start_date and end_date, from the manifest of data/ when offline.
+    """
+    if offline:
+        manifest.refresh()
+        manifest.save()
+        return manifest.get_available_dates(start_date, end_date)
+    return process_data.check_available_days(
+        aws_session, start_date, end_date, os.path.join(process_data.DATA_PATH, process_data.DATES_INDEX_FILENAME))
+
+
+def load_output(dates_in_range, aws_session, manifest, report, workers=1, download_workers=None, prefetch=None,
+                cache=None):
+    """
+    Aggregate of dates_in_range with stop, metro and metrotren locations, the stops that have a location and the mode
+    of every stop.
+    """
+    data_path = process_data.DATA_PATH
+    inputs_path = process_data.INPUTS_PATH
+    reference_path = os.path.join(data_path, process_data.REFERENCE_DATA_FILENAME)
+    # files are checked and downloaded while verified files are read
+    with report.stage('aggregation') as stage:
+        station_index = load_station_index(inputs_path, reference_path)
+        available_files = process_data.iter_available_files(dates_in_range, aws_session, data_path, download_workers,
+                                                            stage, manifest, prefetch)
+        output, metro_stations, _ = process_data.get_output_dict(available_files, workers, cache, stats=stage,
+                                                                 stations=station_index)
+
+    with report.stage('enrichment') as stage:
+        output = process_data.add_location_to_stop_data(inputs_path, output, dates_in_range, reference_path)
+        output = process_data.add_location_to_metro_station_data(inputs_path, output, metro_stations, dates_in_range,
+                                                                 reference_path)
+        output = process_data.add_location_to_metrotren_station_data(inputs_path, output, dates_in_range,
+                                                                     reference_path)
+        located_stops = set(load_stop_locations(inputs_path, reference_path)) | \
+            set(load_metro_locations(inputs_path, reference_path))
+        stop_modes = get_stop_modes(inputs_path, metro_stations, reference_path)
+        stage['stops'] = len(output)
+    return output, located_stops, stop_modes
+
+
+def render_job(output_filename, sliced_output, mapbox_key, html_format):
+    outputs_path = process_data.OUTPUTS_PATH
+    rows = process_data.create_csv_data(outputs_path, output_filename, sliced_output)
+    csv_data = process_data.iter_csv_rows(sliced_output, log_invalid=False)
+    process_data.write_info_to_kepler_file(process_data.TEMPLATE_PATH, outputs_path, output_filename, mapbox_key,
+                                           csv_data, html_format)
+    logger.info('{0} successfully created!'.format(output_filename))
+    return rows
+
+
+def main(argv):
+    """
+    Create the visualizations of many date ranges from one aggregation of the days they need.
+    """
+    parser = argparse.ArgumentParser(description='create many visualizations from one aggregation of their days.',
+                                     parents=[process_data.get_days_parser()])
+    parser.add_argument('job_file', help='json list of jobs with start_date, end_date, output_filename and optional '
+                                         'comuna and mode (bus, metro or metrotren)')
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help='number of processes used to write outputs of jobs. Default: 1')
+    parser.add_argument('--html-format', choices=process_data.KEPLER_DATA_FORMATS, default='full',
+                        help='how data is embedded in the html files. Default: full')
+    parser.add_argument('--report', help='path of the json run report. Default: outputs/[job_file name].report.json')
+    args = parser.parse_args(argv[1:])
+
+    try:
+        jobs = load_jobs(args.job_file)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not jobs:
+        parser.error('{0} does not have jobs'.format(args.job_file))
+
+    data_path = process_data.DATA_PATH
+    job_name = os.path.splitext(os.path.basename(args.job_file))[0]
+    report = RunReport(job_file=args.job_file, jobs=len(jobs), workers=args.workers,
+                       render_workers=args.render_workers, html_format=args.html_format)
+    aws_session = process_data.get_aws_session(args)
+    mapbox_key = process_data.config('MAPBOX_KEY')
+    manifest = DataManifest(data_path)
+
+    # bucket is listed once for the window that covers every job
+    start_date = min(job['start'] for job in jobs)
+    end_date = max(job['end'] for job in jobs)
+    with report.stage('listing') as stage:
+        available_dates = list_days(aws_session, manifest, start_date, end_date, args.offline)
+        # days between jobs are not needed by any of them
+        dates_in_range = [date for date in available_dates if any(job['start'] <= date <= job['end'] for job in jobs)]
+        stage['days'] = len(dates_in_range)
+    if not dates_in_range:
+        logger.error('There is not data for any job between {0} and {1}'.format(start_date, end_date))
+        exit(1)
+    logger.info('{0} jobs need {1} days'.format(len(jobs), len(dates_in_range)))
+
+    cache = process_data.get_day_cache(args)
+    output, located_stops, stop_modes = load_output(dates_in_range, aws_session, manifest, report, args.workers,
+                                                    args.download_workers, args.prefetch, cache)
+
+    with report.stage('render') as stage:
+        tasks = []
+        for job in jobs:
+            dates = [date.strftime('%Y-%m-%d') for date in dates_in_range if job['start'] <= date <= job['end']]
+            if not dates:
+                logger.warning('There is not data between {0} and {1} for {2} ... skip'.format(
+                    job['start_date'], job['end_date'], job['output_filename']))
+                continue
+            sliced_output = slice_output(output, dates, located_stops, job.get('comuna'), job.get('mode'), stop_modes)
+            tasks.append((job['output_filename'], sliced_output, mapbox_key, args.html_format))
+        if args.render_workers > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(args.render_workers) as pool:
+                rows = pool.starmap(render_job, tasks)
+        else:
+            rows = [render_job(*task) for task in tasks]
+        stage['outputs'] = len(tasks)
+        stage['rows_written'] = sum(rows)
+
+    report.save(args.report or os.path.join(process_data.OUTPUTS_PATH, '{0}.report.json'.format(job_name)))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
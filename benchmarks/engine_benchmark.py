@@ -0,0 +1,53 @@
+"""
+Compare the dict and columnar aggregation engines on the same synthetic files.
+
+python -m benchmarks.engine_benchmark [--stops N] [--days N]
+"""
+import argparse
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import columnar
+import process_data
+from benchmarks.synthetic import write_transaction_file
+
+ENGINES = [('dict', process_data.get_output_dict), ('columnar', columnar.get_output_columnar)]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare aggregation engines over synthetic days.')
+    parser.add_argument('--stops', type=int, default=2000, help='stops per day file')
+    parser.add_argument('--days', type=int, default=8, help='number of day files')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.WARNING)
+    start_date = datetime(2020, 5, 1)
+    with tempfile.TemporaryDirectory() as data_path:
+        files = [write_transaction_file(data_path, start_date + timedelta(days=day), args.stops)
+                 for day in range(args.days)]
+        print('{0:>10} {1:>14} {2:>14} {3:>18}'.format('engine', 'ingest (s)', 'csv write (s)', 'peak memory (MB)'))
+        outputs = []
+        for name, get_output in ENGINES:
+            start = time.perf_counter()
+            output = get_output(files)[0]
+            ingest_time = time.perf_counter() - start
+            # memory is measured in a second run because tracing allocations slows the engines down
+            tracemalloc.start()
+            get_output(files)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            start = time.perf_counter()
+            process_data.create_csv_data(data_path, name, output)
+            csv_time = time.perf_counter() - start
+            outputs.append(output)
+            print('{0:>10} {1:>14.2f} {2:>14.2f} {3:>18.2f}'.format(name, ingest_time, csv_time, peak / 1024 / 1024))
+        if outputs[0] != outputs[1]:
+            raise ValueError('engines built different outputs')
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,44 @@
+"""
+Scaling of the location join and csv export with the number of stops.
+
+python -m benchmarks.enrichment_benchmark [--stops 1000 2000 4000 8000 12000] [--days N]
+"""
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import process_data
+from benchmarks.synthetic import write_stop_file, write_transaction_file
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='measure enrichment and csv export time over the number of stops.')
+    parser.add_argument('--stops', type=int, nargs='+', default=[1000, 2000, 4000, 8000, 12000],
+                        help='number of stops for each run')
+    parser.add_argument('--days', type=int, default=2, help='number of day files')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.WARNING)
+    start_date = datetime(2020, 5, 1)
+    dates_in_range = [start_date + timedelta(days=day) for day in range(args.days)]
+    print('{0:>8} {1:>16} {2:>16} {3:>18}'.format('stops', 'enrichment (ms)', 'csv write (ms)', 'us per stop'))
+    for stops in args.stops:
+        with tempfile.TemporaryDirectory() as data_path:
+            files = [write_transaction_file(data_path, date, stops, half_hours=2) for date in dates_in_range]
+            write_stop_file(data_path, stops)
+            output = process_data.get_output_dict(files)[0]
+            start = time.perf_counter()
+            process_data.add_location_to_stop_data(data_path, output, dates_in_range)
+            enrichment_time = time.perf_counter() - start
+            start = time.perf_counter()
+            process_data.create_csv_data(data_path, 'output', output)
+            csv_time = time.perf_counter() - start
+            print('{0:>8} {1:>16.1f} {2:>16.1f} {3:>18.1f}'.format(
+                stops, enrichment_time * 1000, csv_time * 1000, (enrichment_time + csv_time) / stops * 1000000))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
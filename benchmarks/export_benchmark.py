@@ -0,0 +1,52 @@
+"""
+Peak memory of the csv and html export when the number of days grows.
+
+python -m benchmarks.export_benchmark [--stops N] [--days 7 30 90]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+
+import process_data
+
+DIR_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def get_output(stops, days):
+    output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+    for stop in range(stops):
+        output[stop]['info'] = dict(stop_name='Parada {0}'.format(stop), user_stop_code='PC{0}'.format(stop),
+                                    auth_stop_code='T-{0}'.format(stop), area='Las Condes',
+                                    longitude=-33.4 + stop / 100000, latitude=-70.6 + stop / 100000)
+        for day in range(days):
+            output[stop]['dates']['2020-{0:02d}-{1:02d}'.format(day // 28 + 1, day % 28 + 1)] = stop * day % 300
+    return output
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='measure export peak memory over the number of days.')
+    parser.add_argument('--stops', type=int, default=12000, help='number of stops')
+    parser.add_argument('--days', type=int, nargs='+', default=[7, 30, 90], help='number of days for each run')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.WARNING)
+    print('{0:>6} {1:>14} {2:>24}'.format('days', 'html (MB)', 'export peak memory (MB)'))
+    with tempfile.TemporaryDirectory() as outputs_path:
+        for days in args.days:
+            output = get_output(args.stops, days)
+            tracemalloc.start()
+            process_data.create_csv_data(outputs_path, 'output', output)
+            process_data.write_info_to_kepler_file(os.path.join(DIR_PATH, 'template'), outputs_path, 'output',
+                                                   'mapbox_key', process_data.iter_csv_rows(output))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            html_size = os.path.getsize(os.path.join(outputs_path, 'output.html'))
+            print('{0:>6} {1:>14.1f} {2:>24.2f}'.format(days, html_size / 1024 / 1024, peak / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,72 @@
+"""
+Size of the kepler html file and time to evaluate its data for each embedding format.
+
+Evaluation time is measured with node when it is installed, as an approximation of the browser parse time.
+
+python -m benchmarks.html_benchmark [--stops N] [--days N]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import process_data
+
+DIR_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# node stand-in for the pako script loaded by the template
+NODE_PAKO = 'const zlib = require("zlib"); const pako = {inflate: function (data, options) { ' \
+            'return zlib.inflateSync(Buffer.from(data, "binary")).toString("utf8"); }};\n'
+
+
+def get_csv_data(stops, days):
+    csv_data = []
+    for stop in range(stops):
+        for day in range(days):
+            csv_data.append(['2020-05-{0:02d} 00:00:00'.format(day % 28 + 1), 'Parada {0} / Avenida'.format(stop),
+                             'PC{0}'.format(stop), 'T-{0}-{1}-OP-5'.format(stop // 100, stop % 100), 'Las Condes',
+                             -33.4 + stop / 100000, -70.6 + stop / 100000, (stop * day) % 300])
+    return csv_data
+
+
+def node_eval_time(kepler_data):
+    # the data is evaluated from a string, so the measured time includes parsing it as in the browser
+    with tempfile.TemporaryDirectory() as script_path:
+        data_path = os.path.join(script_path, 'data.js')
+        with open(data_path, 'w') as data_file:
+            data_file.write(kepler_data)
+        with open(os.path.join(script_path, 'eval.js'), 'w') as script:
+            script.write(NODE_PAKO)
+            script.write('const source = require("fs").readFileSync({0}, "utf8");\n'.format(json.dumps(data_path)))
+            script.write('const start = process.hrtime.bigint();\nconst rows = eval("(" + source + ")");\n')
+            script.write('console.log(Number(process.hrtime.bigint() - start) / 1e6);\n')
+        return float(subprocess.check_output(['node', '--max-old-space-size=8192', os.path.join(script_path, 'eval.js')]))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare html data embedding formats.')
+    parser.add_argument('--stops', type=int, default=12000, help='number of stops')
+    parser.add_argument('--days', type=int, default=30, help='number of days')
+    args = parser.parse_args(argv[1:])
+
+    csv_data = get_csv_data(args.stops, args.days)
+    use_node = shutil.which('node') is not None
+    print('{0:>8} {1:>12} {2:>16} {3:>16}'.format('format', 'size (MB)', 'write time (s)', 'node eval (ms)'))
+    with tempfile.TemporaryDirectory() as outputs_path:
+        for data_format in process_data.KEPLER_DATA_FORMATS:
+            start = time.perf_counter()
+            process_data.write_info_to_kepler_file(os.path.join(DIR_PATH, 'template'), outputs_path, data_format,
+                                                   'mapbox_key', csv_data, data_format)
+            write_time = time.perf_counter() - start
+            size = os.path.getsize(os.path.join(outputs_path, data_format + '.html'))
+            eval_time = node_eval_time(process_data.get_kepler_data(csv_data, data_format)) if use_node else None
+            print('{0:>8} {1:>12.2f} {2:>16.2f} {3:>16}'.format(data_format, size / 1024 / 1024, write_time,
+                                                                '-' if eval_time is None else
+                                                                '{0:.0f}'.format(eval_time)))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,67 @@
+"""
+Rows, embedded size, build time and node evaluation time of the stop layer and of each coarse layer.
+
+Node evaluation time approximates the time the browser needs to load the rows of a layer, it is only measured when
+node is installed.
+
+python -m benchmarks.layers_benchmark [--stops N] [--days N] [--html-format full|compact|gzip]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+
+import process_data
+import spatial
+from benchmarks.html_benchmark import node_eval_time
+
+DIR_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def get_output(stops, days):
+    # stops spread over the urban area of Santiago, latitude is kept in longitude like stop locations do
+    generator = random.Random(0)
+    output = dict()
+    for stop in range(stops):
+        info = dict(stop_name='Parada {0} / Avenida'.format(stop), user_stop_code='PC{0}'.format(stop),
+                    auth_stop_code='T-{0}-{1}-OP-5'.format(stop // 100, stop % 100), area='Las Condes',
+                    longitude=generator.uniform(-33.62, -33.33), latitude=generator.uniform(-70.82, -70.52))
+        dates = dict(('2020-05-{0:02d}'.format(day % 28 + 1), (stop * day) % 300) for day in range(days))
+        output['T-{0}'.format(stop)] = dict(info=info, dates=dates)
+    return output
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare the stop layer with coarse layers.')
+    parser.add_argument('--stops', type=int, default=12000, help='number of stops')
+    parser.add_argument('--days', type=int, default=30, help='number of days')
+    parser.add_argument('--html-format', choices=process_data.KEPLER_DATA_FORMATS, default='gzip',
+                        help='how rows are embedded. Default: gzip')
+    args = parser.parse_args(argv[1:])
+
+    output = get_output(args.stops, args.days)
+    comunas = spatial.load_comunas(os.path.join(DIR_PATH, 'inputs'))
+    tiers = [('stops', lambda: output)]
+    tiers += [('hex {0} m'.format(size), lambda size=size: spatial.aggregate_by_grid(output, size))
+              for size in [500, 1000, 2000]]
+    tiers += [('comuna', lambda: spatial.aggregate_by_comuna(output, comunas))]
+
+    use_node = shutil.which('node') is not None
+    print('{0:>12} {1:>8} {2:>10} {3:>12} {4:>14} {5:>16}'.format('tier', 'areas', 'rows', 'size (MB)',
+                                                                   'build time (s)', 'node eval (ms)'))
+    for name, build in tiers:
+        start = time.perf_counter()
+        tier_output = build()
+        build_time = time.perf_counter() - start
+        csv_data = list(process_data.iter_csv_rows(tier_output, log_invalid=False))
+        kepler_data = process_data.get_kepler_data(csv_data, args.html_format)
+        eval_time = node_eval_time(kepler_data) if use_node else None
+        print('{0:>12} {1:>8} {2:>10} {3:>12.3f} {4:>14.3f} {5:>16}'.format(
+            name, len(tier_output), len(csv_data), len(kepler_data) / 1024 / 1024, build_time,
+            '-' if eval_time is None else '{0:.0f}'.format(eval_time)))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
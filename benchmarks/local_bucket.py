@@ -0,0 +1,41 @@
+import os
+import shutil
+from datetime import datetime
+
+from manifest import get_file_checksum
+
+
+class LocalBucketSession:
+    """
+    Stand-in for AWSSession that lists and copies day files from a local directory, so runs do not need network
+    access or credentials
+    """
+
+    def __init__(self, bucket_path, max_pool_connections=10):
+        self.bucket_path = bucket_path
+        self.max_pool_connections = max_pool_connections
+
+    def get_available_dates(self, start_date=None, end_date=None):
+        days = []
+        for key in sorted(os.listdir(self.bucket_path)):
+            try:
+                date = datetime.strptime(key.split('.')[0], '%Y-%m-%d')
+            except ValueError:
+                continue
+            if (start_date is None or date >= start_date) and (end_date is None or date <= end_date):
+                days.append(date)
+        return days
+
+    def check_file_exists(self, key):
+        return os.path.exists(os.path.join(self.bucket_path, key))
+
+    def download_object_from_bucket(self, obj_key, file_path):
+        shutil.copyfile(os.path.join(self.bucket_path, obj_key), file_path)
+
+    def download_object_resumable(self, obj_key, file_path, object_info=None):
+        self.download_object_from_bucket(obj_key, file_path)
+        return file_path
+
+    def get_object_info(self, obj_key):
+        return dict(etag=get_file_checksum(os.path.join(self.bucket_path, obj_key)),
+                    size=os.path.getsize(os.path.join(self.bucket_path, obj_key)))
@@ -0,0 +1,38 @@
+"""
+Peak memory used by get_output_dict when the number of days grows.
+
+python -m benchmarks.memory_benchmark [--stops N] [--days 1 2 4 8]
+"""
+import argparse
+import logging
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+import process_data
+from benchmarks.synthetic import write_transaction_file
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='measure peak memory of get_output_dict over synthetic days.')
+    parser.add_argument('--stops', type=int, default=2000, help='stops per day file')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 2, 4, 8], help='number of days for each run')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.INFO)
+    start_date = datetime(2020, 5, 1)
+    with tempfile.TemporaryDirectory() as data_path:
+        files = [write_transaction_file(data_path, start_date + timedelta(days=day), args.stops)
+                 for day in range(max(args.days))]
+        print('{0:>6} {1:>16}'.format('days', 'peak memory (MB)'))
+        for days in args.days:
+            tracemalloc.start()
+            process_data.get_output_dict(files[:days])
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('{0:>6} {1:>16.2f}'.format(days, peak / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
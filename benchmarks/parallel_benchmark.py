@@ -0,0 +1,48 @@
+"""
+Wall time of get_output_dict with a growing number of worker processes.
+
+python -m benchmarks.parallel_benchmark [--stops N] [--days N] [--workers 1 2 4 8 16]
+"""
+import argparse
+import logging
+import multiprocessing
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import process_data
+from benchmarks.synthetic import write_transaction_file
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='measure get_output_dict speedup over worker processes.')
+    parser.add_argument('--stops', type=int, default=2000, help='stops per day file')
+    parser.add_argument('--days', type=int, default=16, help='number of day files')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='number of worker processes for each run')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.INFO)
+    start_date = datetime(2020, 5, 1)
+    with tempfile.TemporaryDirectory() as data_path:
+        files = [write_transaction_file(data_path, start_date + timedelta(days=day), args.stops)
+                 for day in range(args.days)]
+        print('cpu count: {0}'.format(multiprocessing.cpu_count()))
+        print('{0:>8} {1:>10} {2:>8}'.format('workers', 'time (s)', 'speedup'))
+        sequential_time = None
+        sequential_output = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            output = process_data.get_output_dict(files, workers)[0]
+            elapsed = time.perf_counter() - start
+            if sequential_time is None:
+                sequential_time = elapsed
+                sequential_output = output
+            elif output != sequential_output:
+                raise ValueError('output with {0} workers differs from the first run'.format(workers))
+            print('{0:>8} {1:>10.2f} {2:>8.2f}'.format(workers, elapsed, sequential_time / elapsed))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
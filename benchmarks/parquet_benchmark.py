@@ -0,0 +1,66 @@
+"""
+Write time, peak memory of the write, size and read time of the parquet dataset against the csv file.
+
+python -m benchmarks.parquet_benchmark [--stops N] [--days N]
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pyarrow.parquet as pq
+
+import process_data
+from benchmarks.export_benchmark import get_output
+
+
+def get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def read_csv(file_path):
+    # typed rows, as an analytics consumer needs them
+    with open(file_path, encoding='latin-1') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader)
+        return [[row[0], row[1], row[2], row[3], row[4], float(row[5]), float(row[6]), int(row[7])] for row in reader]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare parquet and csv exports.')
+    parser.add_argument('--stops', type=int, default=12000, help='number of stops')
+    parser.add_argument('--days', type=int, default=30, help='number of days')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.WARNING)
+    output = get_output(args.stops, args.days)
+    print('{0:>8} {1:>12} {2:>18} {3:>12} {4:>12}'.format('format', 'write (s)', 'peak memory (MB)', 'size (MB)',
+                                                           'read (s)'))
+    with tempfile.TemporaryDirectory() as outputs_path:
+        exports = [('csv', process_data.create_csv_data, 'output.csv', read_csv),
+                   ('parquet', process_data.create_parquet_data, 'output.parquet', pq.read_table)]
+        for name, create, filename, read in exports:
+            start = time.perf_counter()
+            create(outputs_path, 'output', output)
+            write_time = time.perf_counter() - start
+            # memory is measured in a second write because tracing allocations slows it down
+            tracemalloc.start()
+            create(outputs_path, 'output', output)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = os.path.join(outputs_path, filename)
+            start = time.perf_counter()
+            read(path)
+            read_time = time.perf_counter() - start
+            print('{0:>8} {1:>12.2f} {2:>18.2f} {3:>12.2f} {4:>12.2f}'.format(
+                name, write_time, peak / 1024 / 1024, get_size(path) / 1024 / 1024, read_time))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
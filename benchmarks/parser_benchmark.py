@@ -0,0 +1,89 @@
+"""
+Rows per second of the byte-level parser against the text loop it replaced, over the same synthetic files.
+
+python -m benchmarks.parser_benchmark [--stops N] [--days N] [--metro-stations N]
+"""
+import argparse
+import gzip
+import logging
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import process_data
+from benchmarks.synthetic import write_transaction_file
+
+
+def aggregate_text_lines(file_path, output, metro_stations):
+    # text loop used before the byte-level parser: every row is decoded and its stop code and area are rebuilt
+    with gzip.open(file_path, str('rt'), encoding='latin-1') as file_obj:
+        file_obj.readline()
+        for line in file_obj:
+            values = line.split(';')
+            auth_stop_code = values[2].encode('latin-1').decode('utf-8')
+
+            if auth_stop_code == "-":
+                continue
+
+            user_stop_code = values[3]
+
+            if user_stop_code == "-":
+                user_stop_code = auth_stop_code
+
+            stop_name = values[5]
+            if stop_name == "-":
+                stop_name = auth_stop_code
+
+            if values[6] == 'METRO':
+                auth_stop_code = auth_stop_code + values[7]
+                metro_stations.add(auth_stop_code)
+
+            output[auth_stop_code]['info']['stop_name'] = stop_name
+            output[auth_stop_code]['info']['user_stop_code'] = user_stop_code
+            output[auth_stop_code]['info']['auth_stop_code'] = auth_stop_code
+            output[auth_stop_code]['info']['area'] = values[4].title()
+            output[auth_stop_code]['dates'][values[0]] += int(values[10])
+    return output, metro_stations
+
+
+PARSERS = [('text', aggregate_text_lines), ('bytes', process_data.aggregate_transaction_file)]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare the text and byte-level transaction parsers.')
+    parser.add_argument('--stops', type=int, default=4000, help='bus stops per day file')
+    parser.add_argument('--days', type=int, default=4, help='number of day files')
+    parser.add_argument('--metro-stations', type=int, default=136, help='metro stations per day file')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.WARNING)
+    start_date = datetime(2020, 5, 1)
+    with tempfile.TemporaryDirectory() as data_path:
+        files = [write_transaction_file(data_path, start_date + timedelta(days=day), args.stops,
+                                        metro_stations=args.metro_stations, unknown_rows=100)
+                 for day in range(args.days)]
+        results = []
+        stats = dict()
+        for name, aggregate in PARSERS:
+            output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+            metro_stations = set()
+            start = time.perf_counter()
+            for file_path in files:
+                if name == 'bytes':
+                    aggregate(file_path, output, metro_stations, stats=stats)
+                else:
+                    aggregate(file_path, output, metro_stations)
+            results.append((name, output, metro_stations, time.perf_counter() - start))
+        if results[0][1:3] != results[1][1:3]:
+            raise ValueError('parsers built different outputs')
+
+        print('{0:>8} {1:>10} {2:>14} {3:>10}'.format('parser', 'time (s)', 'rows/s', 'speedup'))
+        for name, _, _, elapsed in results:
+            print('{0:>8} {1:>10.2f} {2:>14,.0f} {3:>9.2f}x'.format(name, elapsed, stats['rows_parsed'] / elapsed,
+                                                                   results[0][3] / elapsed))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,78 @@
+"""
+Wall time of a cold run, with no day file in local storage, when files are downloaded before they are read and when
+they are read as they are downloaded.
+
+Day files are served by a local bucket that takes the time a download at --bandwidth MB/s per connection would take.
+
+python -m benchmarks.pipeline_benchmark [--stops N] [--days N] [--workers N] [--download-workers N] [--bandwidth MB]
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import process_data
+from benchmarks.local_bucket import LocalBucketSession
+from benchmarks.synthetic import write_transaction_file
+from manifest import DataManifest
+
+
+class ThrottledBucketSession(LocalBucketSession):
+
+    def __init__(self, bucket_path, bandwidth, max_pool_connections=10):
+        super().__init__(bucket_path, max_pool_connections)
+        self.bandwidth = bandwidth
+
+    def download_object_resumable(self, obj_key, file_path, object_info=None):
+        time.sleep(os.path.getsize(os.path.join(self.bucket_path, obj_key)) / self.bandwidth)
+        return super().download_object_resumable(obj_key, file_path, object_info)
+
+
+def run(dates, bucket_session, args, mode):
+    # download only lists the files, phased reads them once all of them are downloaded
+    with tempfile.TemporaryDirectory() as data_path:
+        manifest = DataManifest(data_path)
+        start = time.perf_counter()
+        available_files = process_data.iter_available_files(dates, bucket_session, data_path, args.download_workers,
+                                                            None, manifest)
+        if mode != 'pipelined':
+            available_files = list(available_files)
+        if mode != 'download':
+            process_data.get_output_dict(available_files, args.workers)
+        return time.perf_counter() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare phased and pipelined download and aggregation.')
+    parser.add_argument('--stops', type=int, default=4000, help='stops per day file')
+    parser.add_argument('--days', type=int, default=14, help='number of day files')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes reading files')
+    parser.add_argument('--download-workers', type=int, default=2, help='concurrent downloads')
+    parser.add_argument('--bandwidth', type=float, default=1, help='MB/s of every download')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.INFO)
+    start_date = datetime(2020, 5, 1)
+    dates = [start_date + timedelta(days=day) for day in range(args.days)]
+    bucket_path = tempfile.mkdtemp()
+    try:
+        files = [write_transaction_file(bucket_path, date, args.stops) for date in dates]
+        bucket_session = ThrottledBucketSession(bucket_path, args.bandwidth * 1024 * 1024, args.download_workers)
+
+        start = time.perf_counter()
+        process_data.get_output_dict(files, args.workers)
+        times = [('parse', time.perf_counter() - start)]
+        times += [(mode, run(dates, bucket_session, args, mode)) for mode in ['download', 'phased', 'pipelined']]
+        print('{0:>10} {1:>10}'.format('stage', 'time (s)'))
+        for name, elapsed in times:
+            print('{0:>10} {1:>10.2f}'.format(name, elapsed))
+    finally:
+        shutil.rmtree(bucket_path)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,51 @@
+"""
+Time to load stop, metro and metrotren locations from the sources and from the compiled reference data.
+
+python -m benchmarks.reference_benchmark [--stops N] [--routes-per-stop N]
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import reference_data
+from benchmarks.synthetic import write_stop_file
+
+DIR_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def load_all(inputs_path, reference_path=None):
+    reference_data.load_stop_locations(inputs_path, reference_path)
+    reference_data.load_metro_locations(inputs_path, reference_path)
+    reference_data.load_metrotren_locations(inputs_path, reference_path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare source parsing with compiled reference data.')
+    parser.add_argument('--stops', type=int, default=12000, help='number of stops in stop.csv')
+    parser.add_argument('--routes-per-stop', type=int, default=10, help='rows of each stop in stop.csv')
+    parser.add_argument('--repeat', type=int, default=5, help='number of loads measured')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as inputs_path:
+        write_stop_file(inputs_path, args.stops, args.routes_per_stop)
+        for filename in ['metro.csv', 'metrotren.geojson']:
+            shutil.copy(os.path.join(DIR_PATH, 'inputs', filename), inputs_path)
+        reference_path = os.path.join(inputs_path, 'reference.sqlite3')
+
+        start = time.perf_counter()
+        reference_data.build_reference_data(inputs_path, reference_path)
+        print('compile: {0:.1f} ms'.format((time.perf_counter() - start) * 1000))
+        for name, path in [('sources', None), ('compiled', reference_path)]:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                load_all(inputs_path, path)
+            print('{0}: {1:.1f} ms per load'.format(name, (time.perf_counter() - start) / args.repeat * 1000))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
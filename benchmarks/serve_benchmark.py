@@ -0,0 +1,133 @@
+"""
+Latency of queries answered by the local server of serve.py under concurrent clients, compared with slicing the
+aggregate and writing its csv on every query, as batch.py does for each job.
+
+Queries are sent once with the response cache turned off, so they are answered from the store, and once more with
+every response in the cache.
+
+python -m benchmarks.serve_benchmark [--stops N] [--days N] [--clients N] [--requests N]
+"""
+import argparse
+import csv
+import io
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import batch
+import process_data
+import serve
+
+COMUNAS = ['Santiago', 'Maipu', 'Puente Alto', 'La Florida', 'Las Condes', 'Providencia', 'Nunoa', 'Pudahuel']
+
+
+def get_output(stops, days):
+    # one of every 20 stops is a metro station
+    generator = random.Random(0)
+    output = dict()
+    stop_modes = dict()
+    for stop in range(stops):
+        info = dict(stop_name='Parada {0} / Avenida'.format(stop), user_stop_code='PC{0}'.format(stop),
+                    auth_stop_code='T-{0}-{1}-OP-5'.format(stop // 100, stop % 100), area=COMUNAS[stop % len(COMUNAS)],
+                    longitude=generator.uniform(-33.62, -33.33), latitude=generator.uniform(-70.82, -70.52))
+        dates = dict(('2020-{0:02d}-{1:02d}'.format(5 + day // 28, day % 28 + 1), (stop * day) % 300)
+                     for day in range(days))
+        output['T-{0}'.format(stop)] = dict(info=info, dates=dates)
+        if stop % 20 == 0:
+            stop_modes['T-{0}'.format(stop)] = 'metro'
+    return output, stop_modes
+
+
+def get_queries(kind, dates, stops, requests):
+    queries = []
+    for request in range(requests):
+        if kind == 'stop':
+            queries.append(dict(stop='PC{0}'.format(request * 7919 % stops)))
+        elif kind == 'comuna week':
+            start = request % max(len(dates) - 6, 1)
+            queries.append(dict(comuna=COMUNAS[request % len(COMUNAS)], start_date=dates[start],
+                                end_date=dates[min(start + 6, len(dates) - 1)]))
+        elif kind == 'metro':
+            queries.append(dict(mode='metro', start_date=dates[request % len(dates)]))
+        else:
+            date = dates[request % len(dates)]
+            queries.append(dict(start_date=date, end_date=date))
+    return queries
+
+
+def slice_time(output, stop_modes, query, dates):
+    # csv of the query built from the aggregate, without the store
+    start = time.perf_counter()
+    query_dates = [date for date in dates if query.get('start_date', date) <= date <= query.get('end_date', date)]
+    sliced_output = batch.slice_output(output, query_dates, set(), query.get('comuna'), query.get('mode'), stop_modes)
+    if 'stop' in query:
+        sliced_output = dict((stop, data) for stop, data in sliced_output.items()
+                             if data['info']['user_stop_code'] == query['stop'])
+    csv.writer(io.StringIO()).writerows(process_data.iter_csv_rows(sliced_output, log_invalid=False))
+    return time.perf_counter() - start
+
+
+def request_time(url):
+    start = time.perf_counter()
+    with urlopen(url) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='load test the local server of serve.py.')
+    parser.add_argument('--stops', type=int, default=12000, help='number of stops')
+    parser.add_argument('--days', type=int, default=30, help='number of days')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=200, help='requests of each kind of query')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.INFO)
+    output, stop_modes = get_output(args.stops, args.days)
+    start = time.perf_counter()
+    store = serve.TransactionStore(output, set(), stop_modes)
+    print('store of {0} stops and {1} days built in {2:.2f} s'.format(len(store.stops), len(store.dates),
+                                                                       time.perf_counter() - start))
+    server = serve.StoreServer(('127.0.0.1', 0), store, serve.ResponseCache())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    base_url = 'http://127.0.0.1:{0}/transactions?'.format(server.server_address[1])
+    try:
+        print('{0:>12} {1:>6} {2:>12} {3:>10} {4:>10} {5:>10} {6:>10} {7:>12}'.format(
+            'query', 'cache', 'requests/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'max (ms)', 'slice (ms)'))
+        for kind in ['stop', 'comuna week', 'metro', 'city day']:
+            queries = get_queries(kind, store.dates, args.stops, args.requests)
+            urls = [base_url + urlencode(query) for query in queries]
+            # the aggregate is sliced for a few queries only, it takes as long for every query of the same kind
+            slice_ms = 1000 * sum(slice_time(output, stop_modes, query, store.dates) for query in queries[:5]) / 5
+            for cache in ['miss', 'hit']:
+                # misses are answered from the store, hits from a cache that already has every response
+                server.cache = serve.ResponseCache(0 if cache == 'miss' else len(urls))
+                if cache == 'hit':
+                    for url in urls:
+                        request_time(url)
+                start = time.perf_counter()
+                with ThreadPoolExecutor(args.clients) as executor:
+                    times = list(executor.map(request_time, urls))
+                elapsed = time.perf_counter() - start
+                print('{0:>12} {1:>6} {2:>12.0f} {3:>10.2f} {4:>10.2f} {5:>10.2f} {6:>10.2f} {7:>12.2f}'.format(
+                    kind, cache, len(urls) / elapsed, 1000 * percentile(times, 0.5), 1000 * percentile(times, 0.95),
+                    1000 * percentile(times, 0.99), 1000 * max(times), slice_ms))
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
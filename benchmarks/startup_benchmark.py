@@ -0,0 +1,75 @@
+"""
+Time to import process_data and to finish a short run answered from local files, each in a new interpreter.
+
+The short runs have their day file, verified by a previous run, in the data directory and a fresh dates index, or
+use --offline, so they need neither S3 nor boto3.
+
+python -m benchmarks.startup_benchmark [--repeat N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.synthetic import write_dataset
+from manifest import DataManifest, get_file_checksum
+
+DIR_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+HEAVY_MODULES = ['boto3', 'botocore', 'decouple', 'pyfiglet', 'numpy', 'pyarrow']
+REPORT_MODULES = 'import sys; print(",".join(m for m in {0} if m in sys.modules))'.format(HEAVY_MODULES)
+IMPORT_SNIPPET = 'import process_data; ' + REPORT_MODULES
+RUN_SNIPPET = '''
+import sys
+import process_data
+process_data.DATA_PATH, process_data.INPUTS_PATH, process_data.OUTPUTS_PATH = sys.argv[1:4]
+process_data.main(['process_data', '2020-05-01', '2020-05-01', 'startup', '--quiet', '--no-cache'] + sys.argv[4:])
+''' + REPORT_MODULES
+
+
+def run_python(snippet, args, env):
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', snippet] + args, cwd=DIR_PATH, env=env)
+    # last line lists the heavy modules imported by the snippet
+    return time.perf_counter() - start, (output.decode().splitlines() or [''])[-1]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='measure import and short run time of process_data.')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each case, the median is reported')
+    args = parser.parse_args(argv[1:])
+
+    env = dict(os.environ, MAPBOX_KEY='benchmark')
+    with tempfile.TemporaryDirectory() as dataset_path:
+        write_dataset(dataset_path, datetime(2020, 5, 1), 1, stops=200, metro_stations=20, metrotren_stations=0)
+        data_path = os.path.join(dataset_path, 'data')
+        outputs_path = os.path.join(dataset_path, 'outputs')
+        os.makedirs(outputs_path)
+        with open(os.path.join(data_path, 'available_dates.json'), 'w') as index_file:
+            json.dump(dict(windows=[dict(start='2020-05-01', end='2020-05-01', listed_at=time.time())],
+                           dates=['2020-05-01']), index_file)
+        # the day file was verified against S3 by a previous run
+        manifest = DataManifest(data_path)
+        file_path = os.path.join(data_path, '2020-05-01.4daytransactionbystop.gz')
+        manifest.verify(file_path, dict(etag=get_file_checksum(file_path), size=os.path.getsize(file_path)))
+        manifest.save()
+        cases = [('python startup', REPORT_MODULES, []), ('import process_data', IMPORT_SNIPPET, []),
+                 ('short cached run', RUN_SNIPPET, [data_path, os.path.join(dataset_path, 'inputs'), outputs_path]),
+                 ('short offline run', RUN_SNIPPET, [data_path, os.path.join(dataset_path, 'inputs'), outputs_path,
+                                                     '--offline'])]
+
+        print('{0:>20} {1:>10}  {2}'.format('case', 'time (s)', 'heavy modules imported'))
+        for name, snippet, snippet_args in cases:
+            times = []
+            for _ in range(args.repeat):
+                elapsed, modules = run_python(snippet, snippet_args, env)
+                times.append(elapsed)
+            print('{0:>20} {1:>10.3f}  {2}'.format(name, statistics.median(times), modules or '-'))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
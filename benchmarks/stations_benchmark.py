@@ -0,0 +1,62 @@
+"""
+Aggregation time of metro heavy day files with each engine, with metro rows keyed by code and line as before the
+station index and with the station index, and boardings of metro and metrotren rows that get a location.
+
+python -m benchmarks.stations_benchmark [--stops N] [--metro-stations N] [--metrotren-stations N] [--days N]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import process_data
+from benchmarks.synthetic import write_dataset
+from columnar import get_output_columnar
+from stations import load_station_index
+
+
+def get_located_boardings(output, metro_stations, dates_in_range, inputs_path):
+    output = process_data.add_location_to_metro_station_data(inputs_path, output, metro_stations, dates_in_range)
+    output = process_data.add_location_to_metrotren_station_data(inputs_path, output, dates_in_range)
+    return sum(row[-1] for row in process_data.iter_csv_rows(output, log_invalid=False) if not row[3].startswith('T-'))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='compare aggregation with and without the station index.')
+    parser.add_argument('--stops', type=int, default=500, help='bus stops per day file')
+    parser.add_argument('--metro-stations', type=int, default=136, help='metro stations per day file')
+    parser.add_argument('--metrotren-stations', type=int, default=10, help='metrotren stations per day file')
+    parser.add_argument('--days', type=int, default=4, help='number of day files')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.WARNING)
+    start_date = datetime(2020, 5, 1)
+    with tempfile.TemporaryDirectory() as dataset_path:
+        files = write_dataset(dataset_path, start_date, args.days, args.stops, args.metro_stations,
+                              metrotren_stations=args.metrotren_stations)
+        inputs_path = os.path.join(dataset_path, 'inputs')
+        dates_in_range = [datetime(2020, 5, 1 + day) for day in range(args.days)]
+        start = time.perf_counter()
+        station_index = load_station_index(inputs_path)
+        print('station index built in {0:.1f} ms'.format(1000 * (time.perf_counter() - start)))
+        print('{0:>10} {1:>10} {2:>10} {3:>18} {4:>20}'.format('engine', 'stations', 'time (s)', 'located boardings',
+                                                                'metrotren stations'))
+        for engine in ['dict', 'columnar']:
+            for stations in [None, station_index]:
+                start = time.perf_counter()
+                if engine == 'dict':
+                    output, metro_stations, metrotren_stations = process_data.get_output_dict(files, stations=stations)
+                else:
+                    output, metro_stations, metrotren_stations = get_output_columnar(files, stations=stations)
+                elapsed = time.perf_counter() - start
+                located_boardings = get_located_boardings(output, metro_stations, dates_in_range, inputs_path)
+                print('{0:>10} {1:>10} {2:>10.2f} {3:>18} {4:>20}'.format(
+                    engine, 'none' if stations is None else 'index', elapsed, located_boardings,
+                    len(metrotren_stations)))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,127 @@
+"""
+Run process_data end to end over synthetic datasets of several sizes and store the stage times of every run.
+
+Day files are listed and copied from a local bucket instead of S3, so the suite runs offline. Results are appended
+to a json lines file and every run is compared with the previous run of the same size.
+
+python -m benchmarks.suite [--stops N ...] [--days N ...] [--metro-stations N] [--results PATH] [--process-args ARGS]
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
+
+import process_data
+from benchmarks.local_bucket import LocalBucketSession
+from benchmarks.synthetic import HALF_HOURS, write_dataset
+
+DIR_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+RESULTS_PATH = os.path.join(DIR_PATH, 'benchmarks', 'results.jsonl')
+START_DATE = datetime(2020, 5, 1)
+METROTREN_STATIONS = 10
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIR_PATH,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous_results(results_path):
+    # last result of each dataset size
+    previous_results = dict()
+    if os.path.exists(results_path):
+        with open(results_path) as results_file:
+            for line in results_file:
+                result = json.loads(line)
+                previous_results[get_scale(result)] = result
+    return previous_results
+
+
+def get_scale(result):
+    return result['stops'], result['days'], result['metro_stations'], result['half_hours'], result['process_args']
+
+
+def run_process_data(dataset_path, days, process_args):
+    # every run starts with empty data and outputs directories, so days are copied from the local bucket and
+    # reference data is compiled as in a first run
+    with tempfile.TemporaryDirectory() as work_path:
+        data_path = os.path.join(work_path, 'data')
+        outputs_path = os.path.join(work_path, 'outputs')
+        os.makedirs(data_path)
+        os.makedirs(outputs_path)
+        report_path = os.path.join(work_path, 'report.json')
+        end_date = START_DATE + timedelta(days=days - 1)
+        aws_session = functools.partial(LocalBucketSession, os.path.join(dataset_path, 'data'))
+        with mock.patch.multiple(process_data, LazyAWSSession=aws_session, config=lambda name: 'benchmark',
+                                 DATA_PATH=data_path, INPUTS_PATH=os.path.join(dataset_path, 'inputs'),
+                                 OUTPUTS_PATH=outputs_path):
+            process_data.main(['process_data', START_DATE.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'),
+                               'benchmark', '--no-cache', '--report', report_path] + process_args)
+        with open(report_path) as report_file:
+            return json.load(report_file)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='run process_data over synthetic datasets and store results.')
+    parser.add_argument('--stops', type=int, nargs='+', default=[1000, 4000], help='bus stops per day file')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 7], help='number of day files')
+    parser.add_argument('--metro-stations', type=int, default=100, help='metro stations per day file')
+    parser.add_argument('--half-hours', type=int, default=len(HALF_HOURS), help='rows per stop and day')
+    parser.add_argument('--results', default=RESULTS_PATH, help='json lines file where results are appended')
+    parser.add_argument('--label', default='', help='free text saved with the results, e.g. a branch name')
+    parser.add_argument('--process-args', default='', help='extra process_data arguments, e.g. "--workers 4"')
+    args = parser.parse_args(argv[1:])
+
+    logging.disable(logging.WARNING)
+    process_args = shlex.split(args.process_args)
+    previous_results = load_previous_results(args.results)
+    print('{0:>7} {1:>5} {2:>10} {3:>12} {4:>12} {5:>9} {6:>9} {7:>13} {8:>13}'.format(
+        'stops', 'days', 'total (s)', 'aggreg. (s)', 'enrich. (s)', 'csv (s)', 'html (s)', 'peak rss (MB)',
+        'vs previous'))
+    for stops in args.stops:
+        with tempfile.TemporaryDirectory() as dataset_path:
+            write_dataset(dataset_path, START_DATE, max(args.days), stops, args.metro_stations, args.half_hours,
+                          metrotren_stations=METROTREN_STATIONS)
+            for days in sorted(args.days):
+                report = run_process_data(dataset_path, days, process_args)
+                stages = dict((stage['name'], stage) for stage in report['stages'])
+                expected_rows = (stops + args.metro_stations + METROTREN_STATIONS) * days
+                if stages['csv_day']['rows_written'] != expected_rows:
+                    raise ValueError('{0} csv rows were written, {1} expected'.format(
+                        stages['csv_day']['rows_written'], expected_rows))
+                # synthetic stops are inside the comunas of the dataset, so every layer has areas
+                empty_layers = [name for name, areas in stages.get('layers_day', {}).items()
+                                if name.endswith('_areas') and not areas]
+                if empty_layers:
+                    raise ValueError('{0} do not have areas'.format(', '.join(empty_layers)))
+
+                result = dict(timestamp=datetime.now().isoformat(timespec='seconds'), commit=get_commit(),
+                              label=args.label, python=platform.python_version(), machine=platform.machine(),
+                              cpus=os.cpu_count(), stops=stops, days=days, metro_stations=args.metro_stations,
+                              half_hours=args.half_hours, process_args=args.process_args,
+                              wall_time=report['wall_time'], peak_rss_mb=report['peak_rss_mb'],
+                              rows_parsed=stages['aggregation'].get('rows_parsed'),
+                              stages=dict((name, stage['wall_time']) for name, stage in stages.items()))
+                previous = previous_results.get(get_scale(result))
+                change = '{0:+.1%}'.format(result['wall_time'] / previous['wall_time'] - 1) if previous else '-'
+                print('{0:>7} {1:>5} {2:>10.2f} {3:>12.2f} {4:>12.2f} {5:>9.2f} {6:>9.2f} {7:>13} {8:>13}'.format(
+                    stops, days, result['wall_time'], result['stages']['aggregation'],
+                    result['stages']['enrichment'], result['stages']['csv_day'], result['stages']['html_day'],
+                    result['peak_rss_mb'], change))
+                with open(args.results, 'a') as results_file:
+                    results_file.write(json.dumps(result) + '\n')
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,163 @@
+"""
+Synthetic transaction files, with bus, metro and metrotren rows, the stop, metro and metrotren inputs they join with
+and comunas that cover them.
+
+python -m benchmarks.synthetic output_path [--start-date YYYY-MM-DD] [--days N] [--stops N] [--metro-stations N]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+HEADER = 'Fecha;TipoDia;CodigoTS;CodigoUsuario;Comuna;Nombre;Modo;Linea;Periodo;MediaHora;Subidas\n'
+HALF_HOURS = ['{0:02d}:{1:02d}:00'.format(minutes // 60, minutes % 60) for minutes in range(0, 24 * 60, 30)]
+AREAS = ['LAS CONDES', 'PROVIDENCIA', 'SANTIAGO', 'ÑUÑOA', 'MAIPU', 'LA FLORIDA']
+METRO_LINES = ['L1', 'L2', 'L3', 'L4', 'L4A', 'L5', 'L6']
+
+
+def stop_code(stop):
+    return 'T-{0}-{1}-OP-{2}'.format(stop // 1000, stop % 1000, stop % 97)
+
+
+def metro_station_code(station):
+    return 'ESTACION {0}'.format(station)
+
+
+def metro_line(station):
+    return METRO_LINES[station % len(METRO_LINES)]
+
+
+def metrotren_station_name(station):
+    return 'Estacion Metrotren {0}'.format(station)
+
+
+def metrotren_station_code(station):
+    # transaction files name metrotren stations without the "Estacion" of metrotren.geojson
+    return 'METROTREN {0}'.format(station)
+
+
+def transaction_filename(date):
+    return '{0}.4daytransactionbystop.gz'.format(date.strftime('%Y-%m-%d'))
+
+
+def get_period(half_hour):
+    return '04 - PUNTA MANANA' if '07:00:00' <= half_hour < '09:00:00' else '05 - TRANSICION PUNTA MANANA'
+
+
+def write_transaction_file(data_path, date, stops=1000, half_hours=len(HALF_HOURS), metro_stations=0,
+                           unknown_rows=0, metrotren_stations=0):
+    # unknown_rows adds rows with a "-" stop code, as validations without a known stop in the source files
+    file_path = os.path.join(data_path, transaction_filename(date))
+    date_str = date.strftime('%Y-%m-%d')
+    day_type = 'LABORAL' if date.weekday() < 5 else ('SABADO' if date.weekday() == 5 else 'DOMINGO')
+    with gzip.open(file_path, 'wt', encoding='latin-1') as file_obj:
+        file_obj.write(HEADER)
+        for _ in range(unknown_rows):
+            file_obj.write('{0};{1};-;-;-;-;BUS;;;00:00:00;1\n'.format(date_str, day_type))
+        for stop in range(stops):
+            auth_stop_code = stop_code(stop)
+            for half_hour in HALF_HOURS[:half_hours]:
+                file_obj.write('{0};{1};{2};PC{3};LAS CONDES;Parada {3};BUS;;{4};{5};{6}\n'.format(
+                    date_str, day_type, auth_stop_code, stop, get_period(half_hour), half_hour,
+                    (stop + len(half_hour)) % 7 + 1))
+        for station in range(metro_stations):
+            for half_hour in HALF_HOURS[:half_hours]:
+                file_obj.write('{0};{1};{2};-;{3};-;METRO;{4};{5};{6};{7}\n'.format(
+                    date_str, day_type, metro_station_code(station), AREAS[station % len(AREAS)],
+                    metro_line(station), get_period(half_hour), half_hour, (station + len(half_hour)) % 50 + 10))
+        for station in range(metrotren_stations):
+            for half_hour in HALF_HOURS[:half_hours]:
+                file_obj.write('{0};{1};{2};-;SAN BERNARDO;-;METROTREN;MT;{3};{4};{5}\n'.format(
+                    date_str, day_type, metrotren_station_code(station), get_period(half_hour), half_hour,
+                    (station + len(half_hour)) % 20 + 5))
+    return file_path
+
+
+def write_stop_file(inputs_path, stops=1000, routes_per_stop=3):
+    file_path = os.path.join(inputs_path, 'stop.csv')
+    with open(file_path, 'w', encoding='latin-1') as file_obj:
+        file_obj.write('Servicio|ServicioUsuario|Operador|Correlativo|Codigo|CodigoUsuario|Nombre|Latitud|Longitud|esZP\n')
+        for stop in range(stops):
+            for route in range(routes_per_stop):
+                file_obj.write('T{0} 00I|{0}I|1|{1}|{2}|PC{3}|Parada {3}|{4:.8f}|{5:.8f}|0\n'.format(
+                    route, stop, stop_code(stop), stop, -33.6 + stop % 500 / 1000, -70.8 + stop // 500 / 100))
+    return file_path
+
+
+def write_metro_file(inputs_path, metro_stations=100):
+    file_path = os.path.join(inputs_path, 'metro.csv')
+    with open(file_path, 'w') as file_obj:
+        file_obj.write('CODIGOTRX;COMUNA;LATITUD;LONGITUD;LINEA;ESTANDAR;TIPO;ESTANDAR_ESTACION_UNICA;CODIGO;COLOR\n')
+        for station in range(metro_stations):
+            code = metro_station_code(station)
+            file_obj.write('{0}_{1};{2};{3:.6f};{4:.6f};{1};{0} {1};NORMAL;{0};E{5};N\n'.format(
+                code, metro_line(station), AREAS[station % len(AREAS)], -33.5 + station % 100 / 1000,
+                -70.7 + station // 100 / 100, station))
+    return file_path
+
+
+def write_metrotren_file(inputs_path, stations=10):
+    file_path = os.path.join(inputs_path, 'metrotren.geojson')
+    features = [dict(type='Feature', geometry=dict(type='Point', coordinates=[-70.68, -33.45 - station / 100]),
+                     properties=dict(name=metrotren_station_name(station))) for station in range(stations)]
+    with open(file_path, 'w') as file_obj:
+        json.dump(dict(type='FeatureCollection', features=features), file_obj)
+    return file_path
+
+
+def write_comunas_file(inputs_path, stops=1000):
+    # one band of latitudes for each of AREAS, wide enough for every stop, metro and metrotren station
+    file_path = os.path.join(inputs_path, 'comunas.geojson')
+    min_longitude, max_longitude = -70.9, -70.6 + (stops - 1) // 500 / 100
+    band = 0.7 / len(AREAS)
+    features = []
+    for index, area in enumerate(AREAS):
+        min_latitude, max_latitude = -33.7 + index * band, -33.7 + (index + 1) * band
+        ring = [[min_longitude, min_latitude], [max_longitude, min_latitude], [max_longitude, max_latitude],
+                [min_longitude, max_latitude], [min_longitude, min_latitude]]
+        features.append(dict(type='Feature', geometry=dict(type='LineString', coordinates=ring),
+                             properties=dict(comuna=area, provincia='Santiago')))
+    with open(file_path, 'w', encoding='utf-8') as file_obj:
+        json.dump(dict(type='FeatureCollection', features=features), file_obj)
+    return file_path
+
+
+def write_dataset(output_path, start_date, days, stops=1000, metro_stations=100, half_hours=len(HALF_HOURS),
+                  unknown_rows=1, metrotren_stations=10):
+    """
+    Write day files at output_path/data and their stop, metro, metrotren and comuna inputs at output_path/inputs.
+    """
+    data_path = os.path.join(output_path, 'data')
+    inputs_path = os.path.join(output_path, 'inputs')
+    os.makedirs(data_path, exist_ok=True)
+    os.makedirs(inputs_path, exist_ok=True)
+    files = [write_transaction_file(data_path, start_date + timedelta(days=day), stops, half_hours, metro_stations,
+                                    unknown_rows, metrotren_stations) for day in range(days)]
+    write_stop_file(inputs_path, stops)
+    write_metro_file(inputs_path, metro_stations)
+    write_metrotren_file(inputs_path, metrotren_stations)
+    write_comunas_file(inputs_path, stops)
+    return files
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='write synthetic transaction files and their inputs.')
+    parser.add_argument('output_path', help='directory where data and inputs directories are created')
+    parser.add_argument('--start-date', default='2020-05-01', help='first day. Default: 2020-05-01')
+    parser.add_argument('--days', type=int, default=7, help='number of day files. Default: 7')
+    parser.add_argument('--stops', type=int, default=1000, help='bus stops per day file. Default: 1000')
+    parser.add_argument('--metro-stations', type=int, default=100,
+                        help='metro stations per day file. Default: 100')
+    parser.add_argument('--half-hours', type=int, default=len(HALF_HOURS),
+                        help='rows per stop and day, up to 48. Default: 48')
+    args = parser.parse_args(argv[1:])
+
+    files = write_dataset(args.output_path, datetime.strptime(args.start_date, '%Y-%m-%d'), args.days, args.stops,
+                          args.metro_stations, args.half_hours)
+    print('{0} day files written at {1}'.format(len(files), os.path.join(args.output_path, 'data')))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,250 @@
+# -*- coding: utf8 -*-
+import gzip
+import logging
+import os
+from array import array
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+
+from instrumentation import add_counters
+from stations import METRO_MODE, METROTREN_MODES, split_stations
+
+logger = logging.getLogger(__name__)
+
+INFO_FIELDS = ['stop_name', 'user_stop_code', 'auth_stop_code', 'area', 'longitude', 'latitude']
+# rows buffered before they are added to the counts array
+FLUSH_ROWS = 1000000
+
+
+class ColumnarOutput(Mapping):
+    """
+    Stop aggregate where stop codes and dates are interned into integer ids, transactions are accumulated in a
+    dense stops x dates array and stop info is stored once per stop in columns.
+
+    It behaves like the dict built by get_output_dict (output[stop]['info'] and output[stop]['dates']), so
+    enrichment and writers can use it without conversion. As with a defaultdict, reading a missing stop creates it.
+    """
+
+    def __init__(self, stop_capacity=1024, date_capacity=32):
+        self.stop_ids = dict()
+        self.stops = []
+        self.date_ids = dict()
+        self.dates = []
+        self.info = dict((field, []) for field in INFO_FIELDS)
+        self.counts = np.zeros((stop_capacity, date_capacity), dtype=np.int64)
+        # dates with at least one row for a stop, even when it has zero transactions
+        self.present = np.zeros((stop_capacity, date_capacity), dtype=bool)
+
+    def _grow(self, stops, dates):
+        rows, columns = self.counts.shape
+        if stops <= rows and dates <= columns:
+            return
+        # capacity is doubled so interning n stops costs O(n) copies overall
+        shape = (rows if stops <= rows else max(rows * 2, stops),
+                 columns if dates <= columns else max(columns * 2, dates))
+        counts = np.zeros(shape, dtype=np.int64)
+        counts[:rows, :columns] = self.counts
+        present = np.zeros(shape, dtype=bool)
+        present[:rows, :columns] = self.present
+        self.counts = counts
+        self.present = present
+
+    def intern_stop(self, stop):
+        stop_id = self.stop_ids.get(stop)
+        if stop_id is None:
+            stop_id = len(self.stops)
+            self.stop_ids[stop] = stop_id
+            self.stops.append(stop)
+            for column in self.info.values():
+                column.append(None)
+            self._grow(len(self.stops), len(self.dates))
+        return stop_id
+
+    def intern_date(self, date):
+        date_id = self.date_ids.get(date)
+        if date_id is None:
+            date_id = len(self.dates)
+            self.date_ids[date] = date_id
+            self.dates.append(date)
+            self._grow(len(self.stops), len(self.dates))
+        return date_id
+
+    def add_transactions(self, stop_ids, date_ids, transactions):
+        # stop_ids, date_ids and transactions are array('q') buffers, read by numpy without copying
+        index = (np.frombuffer(stop_ids, dtype=np.int64), np.frombuffer(date_ids, dtype=np.int64))
+        np.add.at(self.counts, index, np.frombuffer(transactions, dtype=np.int64))
+        self.present[index] = True
+
+    def __getitem__(self, stop):
+        return StopView(self, self.intern_stop(stop))
+
+    def __contains__(self, stop):
+        return stop in self.stop_ids
+
+    def get(self, stop, default=None):
+        return self[stop] if stop in self.stop_ids else default
+
+    def __iter__(self):
+        return iter(list(self.stops))
+
+    def __len__(self):
+        return len(self.stops)
+
+
+class StopView(Mapping):
+
+    def __init__(self, output, stop_id):
+        self.output = output
+        self.stop_id = stop_id
+
+    def __getitem__(self, key):
+        if key == 'info':
+            return InfoView(self.output, self.stop_id)
+        if key == 'dates':
+            return DatesView(self.output, self.stop_id)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(['info', 'dates'])
+
+    def __len__(self):
+        return 2
+
+
+class InfoView(MutableMapping):
+
+    def __init__(self, output, stop_id):
+        self.output = output
+        self.stop_id = stop_id
+
+    def __getitem__(self, field):
+        value = self.output.info[field][self.stop_id] if field in self.output.info else None
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        if field not in self.output.info:
+            self.output.info[field] = [None] * len(self.output.stops)
+        self.output.info[field][self.stop_id] = value
+
+    def __delitem__(self, field):
+        self[field]
+        self.output.info[field][self.stop_id] = None
+
+    def __iter__(self):
+        return iter([field for field, column in self.output.info.items() if column[self.stop_id] is not None])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class DatesView(MutableMapping):
+
+    def __init__(self, output, stop_id):
+        self.output = output
+        self.stop_id = stop_id
+
+    def __getitem__(self, date):
+        date_id = self.output.date_ids.get(date)
+        if date_id is None or not self.output.present[self.stop_id, date_id]:
+            raise KeyError(date)
+        return int(self.output.counts[self.stop_id, date_id])
+
+    def __setitem__(self, date, transactions):
+        date_id = self.output.intern_date(date)
+        self.output.counts[self.stop_id, date_id] = transactions
+        self.output.present[self.stop_id, date_id] = True
+
+    def __delitem__(self, date):
+        self[date]
+        date_id = self.output.date_ids[date]
+        self.output.counts[self.stop_id, date_id] = 0
+        self.output.present[self.stop_id, date_id] = False
+
+    def __iter__(self):
+        present = self.output.present[self.stop_id, :len(self.output.dates)]
+        return iter([self.output.dates[date_id] for date_id in np.flatnonzero(present)])
+
+    def __len__(self):
+        return int(self.output.present[self.stop_id].sum())
+
+
+def intern_row_stop(output, stop_columns, metro_stations, stations=None):
+    # stop id and info of the CodigoTS;CodigoUsuario;Comuna;Nombre;Modo;Linea columns of a row, None when the row
+    # does not have a stop code
+    auth_stop_code, user_stop_code, area, stop_name, mode, line = stop_columns.split(';')
+    auth_stop_code = auth_stop_code.encode('latin-1').decode('utf-8')
+    if auth_stop_code == "-":
+        return None
+
+    stop_code = auth_stop_code
+    station = None if stations is None else stations.resolve(mode, auth_stop_code, line)
+    if station is not None:
+        auth_stop_code = station
+    elif mode == METRO_MODE:
+        auth_stop_code = auth_stop_code + line
+    if mode == METRO_MODE or (stations is not None and mode in METROTREN_MODES):
+        metro_stations.add(auth_stop_code)
+
+    info = dict(stop_name=stop_code if stop_name == "-" else stop_name,
+                user_stop_code=stop_code if user_stop_code == "-" else user_stop_code,
+                auth_stop_code=auth_stop_code, area=area.title())
+    return output.intern_stop(auth_stop_code), info
+
+
+def aggregate_transaction_file(file_path, output, metro_stations, stats=None, stations=None):
+    stop_ids = array('q')
+    date_ids = array('q')
+    transactions = array('q')
+    # stop id and info of every distinct stop columns, so codes are decoded and stations resolved once per file
+    row_stops = dict()
+    last_fields = None
+    with gzip.open(file_path, str('rt'), encoding='latin-1') as file_obj:
+        # skip header
+        file_obj.readline()
+        rows = skipped_rows = 0
+        for rows, line in enumerate(file_obj, 1):
+            # lines are only split around the stop columns
+            raw_date, _, columns = line.split(';', 2)
+            stop_columns, _, _, row_transactions = columns.rsplit(';', 3)
+            fields = row_stops.get(stop_columns, False)
+            if fields is False:
+                fields = row_stops[stop_columns] = intern_row_stop(output, stop_columns, metro_stations, stations)
+
+            if fields is None:
+                skipped_rows += 1
+                continue
+
+            stop_id, info = fields
+            # info of the last row of a stop wins, as in get_output_dict, it is only written again when the stop
+            # columns change
+            if fields is not last_fields:
+                last_fields = fields
+                for field, value in info.items():
+                    output.info[field][stop_id] = value
+
+            stop_ids.append(stop_id)
+            date_ids.append(output.intern_date(raw_date))
+            transactions.append(int(row_transactions))
+            if len(transactions) >= FLUSH_ROWS:
+                output.add_transactions(stop_ids, date_ids, transactions)
+                stop_ids, date_ids, transactions = array('q'), array('q'), array('q')
+
+    if transactions:
+        output.add_transactions(stop_ids, date_ids, transactions)
+    add_counters(stats, files_parsed=1, bytes_read=os.path.getsize(file_path), rows_parsed=rows,
+                 rows_skipped=skipped_rows)
+    return output, metro_stations
+
+
+def get_output_columnar(available_files, stats=None, stations=None):
+    output = ColumnarOutput()
+    metro_stations = set()
+    for file_path in available_files:
+        logger.info('reading file "{0}" ...'.format(os.path.basename(file_path)))
+        aggregate_transaction_file(file_path, output, metro_stations, stats, stations)
+    metrotren_stations = split_stations(metro_stations, stations, stats)
+
+    return output, metro_stations, metrotren_stations
@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import zlib
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+CACHE_PATH = os.path.join(DIR_PATH, 'data', 'cache')
+# 512 MB
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+ENTRY_EXTENSION = '.agg'
+
+
+class DayAggregateCache:
+    """
+    Per-day aggregates of transaction files stored on disk, keyed by the source file name, size and checksum and by
+    a variant of the aggregation
+    """
+
+    def __init__(self, cache_path=CACHE_PATH, max_size=DEFAULT_MAX_SIZE):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.keys = dict()
+        os.makedirs(cache_path, exist_ok=True)
+
+    def get_entry_path(self, file_path, variant=''):
+        if file_path not in self.keys:
+            checksum = hashlib.md5()
+            with open(file_path, 'rb') as file_obj:
+                for chunk in iter(lambda: file_obj.read(1024 * 1024), b''):
+                    checksum.update(chunk)
+            self.keys[file_path] = '{0}-{1}-{2}'.format(os.path.basename(file_path), os.path.getsize(file_path),
+                                                        checksum.hexdigest())
+        return os.path.join(self.cache_path, '{0}{1}{2}'.format(self.keys[file_path], '-' + variant if variant else '',
+                                                                ENTRY_EXTENSION))
+
+    def contains(self, file_path, variant=''):
+        return os.path.exists(self.get_entry_path(file_path, variant))
+
+    def get(self, file_path, variant=''):
+        entry_path = self.get_entry_path(file_path, variant)
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                partial_output, metro_stations = pickle.loads(zlib.decompress(entry_file.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        # last access time drives LRU eviction
+        os.utime(entry_path)
+        return partial_output, metro_stations
+
+    def put(self, file_path, partial, variant=''):
+        entry_path = self.get_entry_path(file_path, variant)
+        # entries of previous versions of the same file will never be read again
+        prefix = os.path.basename(file_path) + '-'
+        for name in os.listdir(self.cache_path):
+            if name.startswith(prefix) and name != os.path.basename(entry_path):
+                os.remove(os.path.join(self.cache_path, name))
+        tmp_path = entry_path + '.tmp'
+        with open(tmp_path, 'wb') as entry_file:
+            entry_file.write(zlib.compress(pickle.dumps(partial, pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp_path, entry_path)
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.cache_path):
+            if name.endswith(ENTRY_EXTENSION):
+                stat = os.stat(os.path.join(self.cache_path, name))
+                entries.append((name, stat.st_size, stat.st_mtime))
+        # least recently used first
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for name, size, _ in entries:
+            if total_size <= self.max_size:
+                break
+            logger.info('removing cached aggregate {0}'.format(name))
+            os.remove(os.path.join(self.cache_path, name))
+            total_size -= size
+
+    def purge(self):
+        for name, _, _ in self.entries():
+            os.remove(os.path.join(self.cache_path, name))
+
+
+def main(argv):
+    """
+    Inspect or purge cached per-day aggregates.
+    """
+    parser = argparse.ArgumentParser(description='inspect or purge cached per-day aggregates.')
+    parser.add_argument('command', choices=['info', 'purge'], help='info lists cached days, purge removes them')
+    parser.add_argument('--cache-path', default=CACHE_PATH, help='cache directory. Default: data/cache')
+    args = parser.parse_args(argv[1:])
+
+    cache = DayAggregateCache(args.cache_path)
+    entries = cache.entries()
+    if args.command == 'info':
+        for name, size, _ in entries:
+            print('{0} {1:.1f} KB'.format(name, size / 1024))
+        print('{0} entries, {1:.1f} MB'.format(len(entries), sum(size for _, size, _ in entries) / 1024 / 1024))
+    else:
+        cache.purge()
+        logger.info('{0} cached aggregates removed'.format(len(entries)))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,84 @@
+# -*- coding: utf8 -*-
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # resource module is only available on unix
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def add_counters(counters, **values):
+    if counters is None:
+        return
+    for name, value in values.items():
+        counters[name] = counters.get(name, 0) + value
+
+
+def get_path_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def get_resource_usage():
+    # cpu seconds and peak rss in MB of this process and of its finished children, like aggregation workers
+    if resource is None:
+        return time.process_time(), None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is measured in bytes on macOS and in kilobytes elsewhere
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime,
+            round(max(usage.ru_maxrss, children.ru_maxrss) / scale, 1))
+
+
+class RunReport:
+    """
+    Wall time, cpu time, peak memory and counters of each stage of a run, saved as a json report
+    """
+
+    def __init__(self, **run_info):
+        self.run_info = run_info
+        self.stages = []
+        self.started_at = datetime.now()
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure the code run inside the context, counters added to the yielded dict are saved with the stage.
+        """
+        counters = dict()
+        cpu_time, _ = get_resource_usage()
+        start_time = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            end_cpu_time, peak_rss = get_resource_usage()
+            stage = dict(name=name, wall_time=round(time.perf_counter() - start_time, 3),
+                         cpu_time=round(end_cpu_time - cpu_time, 3), peak_rss_mb=peak_rss)
+            stage.update(counters)
+            self.stages.append(stage)
+            logger.info('stage {0} took {1:.2f} s'.format(name, stage['wall_time']))
+
+    def to_dict(self):
+        _, peak_rss = get_resource_usage()
+        return dict(run=self.run_info, started_at=self.started_at.isoformat(timespec='seconds'),
+                    wall_time=round(time.perf_counter() - self.start_time, 3), peak_rss_mb=peak_rss,
+                    stages=self.stages)
+
+    def save(self, report_path):
+        tmp_path = report_path + '.tmp'
+        with open(tmp_path, 'w') as report_file:
+            json.dump(self.to_dict(), report_file, indent=2)
+        os.replace(tmp_path, report_path)
+        logger.info('run report saved at {0}'.format(report_path))
@@ -0,0 +1,115 @@
+# -*- coding: utf8 -*-
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'manifest.json'
+# day files are named after the day they have, e.g. 2020-05-08.4daytransactionbystop.gz
+DAY_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})\.4daytransactionbystop\.gz$')
+
+
+def get_file_checksum(file_path):
+    checksum = hashlib.md5()
+    with open(file_path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(1024 * 1024), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_file_date(file_path):
+    return DAY_FILE_PATTERN.match(os.path.basename(file_path)).group(1)
+
+
+class DataManifest:
+    """
+    Index of the day files stored in the data directory with their size, checksum and the ETag of the S3 object
+    they were downloaded from, so available days can be found without listing the bucket
+    """
+
+    def __init__(self, data_path, manifest_filename=MANIFEST_FILENAME):
+        self.data_path = data_path
+        self.manifest_path = os.path.join(data_path, manifest_filename)
+        self.entries = dict()
+        self.changed = False
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as manifest_file:
+                self.entries = json.load(manifest_file)['files']
+
+    def is_current(self, file_path):
+        # a file replaced or modified after it was indexed needs a new checksum
+        entry = self.entries.get(get_file_date(file_path))
+        if entry is None or not os.path.exists(file_path):
+            return False
+        stat = os.stat(file_path)
+        return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def add(self, file_path, etag=None):
+        date = get_file_date(file_path)
+        stat = os.stat(file_path)
+        self.entries[date] = dict(filename=os.path.basename(file_path), size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                                  md5=get_file_checksum(file_path), etag=etag)
+        self.changed = True
+        return self.entries[date]
+
+    def refresh(self):
+        """
+        Index day files found in the data directory that are new or changed and forget files that were removed.
+        """
+        for date in list(self.entries):
+            if not os.path.exists(os.path.join(self.data_path, self.entries[date]['filename'])):
+                logger.info('{0} is not in local storage anymore'.format(self.entries[date]['filename']))
+                del self.entries[date]
+                self.changed = True
+        for filename in sorted(os.listdir(self.data_path)):
+            if DAY_FILE_PATTERN.match(filename):
+                self.index(os.path.join(self.data_path, filename))
+
+    def index(self, file_path):
+        """
+        Add a day file found in local storage, unless it did not change since it was indexed.
+        """
+        if self.is_current(file_path):
+            return self.entries[get_file_date(file_path)]
+        previous = self.entries.get(get_file_date(file_path), dict())
+        entry = self.add(file_path)
+        # a file that was only touched keeps its source object, files copied by hand have none
+        if entry['md5'] == previous.get('md5'):
+            entry['etag'] = previous.get('etag')
+        return entry
+
+    def verify(self, file_path, object_info):
+        """
+        Check a day file against the ETag and size of its S3 object, the ETag is recorded when they match.
+        """
+        entry = self.index(file_path)
+        # ETags of multipart uploads are not the md5 of the object, only their size can be compared
+        matches = entry['size'] == object_info['size'] and \
+            ('-' in object_info['etag'] or entry['md5'] == object_info['etag'])
+        if matches and entry['etag'] != object_info['etag']:
+            entry['etag'] = object_info['etag']
+            self.changed = True
+        return matches
+
+    def is_verified(self, file_path):
+        # files only have an ETag once they matched their S3 object, and lose it when they change
+        return self.is_current(file_path) and self.entries[get_file_date(file_path)]['etag'] is not None
+
+    def get_available_dates(self, start_date=None, end_date=None):
+        # same interface as AWSSession.get_available_dates
+        days = [datetime.strptime(date, '%Y-%m-%d') for date in sorted(self.entries)]
+        return [day for day in days if (start_date is None or start_date <= day) and
+                (end_date is None or day <= end_date)]
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(dict(files=self.entries), manifest_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+        self.changed = False
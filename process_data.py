@@ -1,18 +1,32 @@
 # -*- coding: utf8 -*-
 import argparse
+import base64
+import bisect
+import cProfile
 import csv
+import functools
 import gzip
+import io
 import json
 import logging
+import multiprocessing
 import os
+import pickle
+import shutil
 import sys
-from collections import defaultdict
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from decouple import config
-from pyfiglet import Figlet
-
-from aws import AWSSession
+from day_cache import DayAggregateCache
+from manifest import DataManifest
+from instrumentation import RunReport, add_counters, get_path_size
+from reference_data import load_metro_locations, load_metrotren_locations, load_stop_locations
+from spatial import GRID_SHAPES, LAYERS, get_layers
+from stations import METRO_MODE, METROTREN_MODES, load_station_index, split_stations
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,258 +36,958 @@ DATA_PATH = os.path.join(DIR_PATH, 'data')
 INPUTS_PATH = os.path.join(DIR_PATH, 'inputs')
 TEMPLATE_PATH = os.path.join(DIR_PATH, 'template')
 OUTPUTS_PATH = os.path.join(DIR_PATH, 'outputs')
+DATES_INDEX_FILENAME = 'available_dates.json'
+# seconds a bucket listing is reused before listing the bucket again
+DATES_INDEX_TTL = 60 * 60
+REFERENCE_DATA_FILENAME = 'reference.sqlite3'
+# bytes buffered while transaction files are decompressed
+READ_BUFFER_SIZE = 1024 * 1024
+# downloads of a file that does not match its S3 object before the run fails
+DOWNLOAD_ATTEMPTS = 2
+# stop info required to write a stop in the csv and html outputs
+CSV_INFO_FIELDS = ['longitude', 'latitude', 'area', 'user_stop_code', 'auth_stop_code', 'stop_name']
+CSV_HEADER = ['Fecha', 'Nombre', 'Código de usuario', 'Código ts', 'Comuna', 'Latitud', 'Longitud', 'Subidas']
+GRANULARITIES = ['day', 'half_hour', 'period', 'day_type']
+DEFAULT_GRANULARITIES = ['day']
+# output[stop] key of each granularity and the label columns its rows add
+GRANULARITY_FIELDS = dict(day='dates', half_hour='half_hours', period='periods', day_type='day_types')
+GRANULARITY_LABELS = dict(period=['Periodo'], day_type=['TipoDia'])
+PARQUET_STRING_COLUMNS = ['Nombre', 'Código de usuario', 'Código ts', 'Comuna']
+KEPLER_DATA_FORMATS = ['full', 'compact', 'gzip']
+# expands the payload built by compact_csv_data into the rows expected by the kepler dataset
+COMPACT_DATA_DECODER = '''(function (data) {
+        var rows = [];
+        data.rows.forEach(function (dateRows, dateId) {
+          var date = data.dates[dateId];
+          for (var i = 0; i < dateRows[0].length; i++) {
+            var stop = data.stops[dateRows[0][i]];
+            rows.push([date[0], stop[0], stop[1], stop[2], stop[3], stop[4], stop[5], dateRows[1][i]].concat(
+              date.slice(1)));
+          }
+        });
+        return rows;
+      }(<PAYLOAD>))'''
+# fields of the subidas dataset of template.html, datasets of coarse layers have the same columns
+KEPLER_FIELDS = [dict(name='Fecha', type='timestamp', format='YYYY-M-D H:m:s', analyzerType='DATETIME')] + \
+    [dict(name=name, type='string', format='', analyzerType='STRING')
+     for name in ['Nombre', 'Código Usuario', 'Código TS', 'Comuna']] + \
+    [dict(name=name, type='real', format='', analyzerType='FLOAT') for name in ['Latitud', 'Longitud']] + \
+    [dict(name='Subidas', type='integer', format='', analyzerType='INT')]
+# color and radius range in pixels of the point layer of each coarse layer
+KEPLER_LAYER_STYLES = dict(grid=dict(color=[0, 198, 191], radius_range=[10, 80]),
+                           comuna=dict(color=[255, 120, 160], radius_range=[20, 150]))
+
+
+def config(name):
+    # decouple also reads environment variables first, it is only imported when the value comes from the .env file
+    if name in os.environ:
+        return os.environ[name]
+    from decouple import config as decouple_config
+    return decouple_config(name)
+
+
+class LazyAWSSession:
+    """
+    AWSSession created on first use, so runs answered by the dates index and local files never import boto3
+    """
 
-
-def check_available_days(aws_session, start_date, end_date):
-    available_dates = aws_session.get_available_dates()
-    dates_in_range = []
-    for date in available_dates:
-        if date < start_date:
-            continue
-        if date > end_date:
-            break
-        dates_in_range.append(date)
-    return dates_in_range
+    def __init__(self, max_pool_connections=10):
+        self.max_pool_connections = max_pool_connections
+        self.aws_session = None
+        self.lock = threading.Lock()
+
+    def get_session(self):
+        # created once under a lock, the first calls can come from download threads
+        if self.aws_session is None:
+            with self.lock:
+                if self.aws_session is None:
+                    from aws import AWSSession
+                    self.aws_session = AWSSession(max_pool_connections=self.max_pool_connections)
+        return self.aws_session
+
+    def __getattr__(self, name):
+        return getattr(self.get_session(), name)
+
+
+def load_dates_index(index_path):
+    if index_path is None or not os.path.exists(index_path):
+        return dict(windows=[], dates=[])
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+
+def save_dates_index(index_path, dates_index):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w') as index_file:
+        json.dump(dates_index, index_file)
+    os.replace(tmp_path, index_path)
+
+
+def check_available_days(aws_session, start_date, end_date, index_path=None, ttl=DATES_INDEX_TTL):
+    start = start_date.strftime('%Y-%m-%d')
+    end = end_date.strftime('%Y-%m-%d')
+    now = time.time()
+    dates_index = load_dates_index(index_path)
+    # windows listed more than ttl seconds ago may miss files uploaded since then
+    dates_index['windows'] = [window for window in dates_index['windows'] if now - window['listed_at'] < ttl]
+
+    if any(window['start'] <= start and end <= window['end'] for window in dates_index['windows']):
+        logger.info('using cached bucket listing')
+        available_dates = dates_index['dates']
+    else:
+        listed_dates = [date.strftime('%Y-%m-%d') for date in
+                        aws_session.get_available_dates(start_date, end_date)]
+        available_dates = sorted(set(date for date in dates_index['dates'] if date < start or date > end) |
+                                 set(listed_dates))
+        if index_path is not None:
+            dates_index['windows'].append(dict(start=start, end=end, listed_at=now))
+            dates_index['dates'] = available_dates
+            save_dates_index(index_path, dates_index)
+
+    first = bisect.bisect_left(available_dates, start)
+    last = bisect.bisect_right(available_dates, end)
+    return [datetime.strptime(date, '%Y-%m-%d') for date in available_dates[first:last]]
+
+
+def prepare_session(aws_session):
+    # a lazy session is created by the calling thread before download threads use it, so several threads never
+    # import aws and build the session while this one writes files
+    if hasattr(aws_session, 'get_session'):
+        aws_session.get_session()
+
+
+def download_file(aws_session, key, file_path):
+    logger.info('downloading file {0}...'.format(key))
+    return aws_session.download_object_resumable(key, file_path, aws_session.get_object_info(key))
+
+
+def fetch_verified_file(aws_session, manifest, key, file_path):
+    """
+    Make file_path a copy of the S3 object key. A local file without the size and checksum of the object is
+    downloaded again, returns whether the file was downloaded.
+    """
+    object_info = aws_session.get_object_info(key)
+    if os.path.exists(file_path) and manifest.verify(file_path, object_info):
+        return False
+    for _ in range(DOWNLOAD_ATTEMPTS):
+        if os.path.exists(file_path):
+            logger.warning('file {0} does not match its S3 object ... download it again'.format(key))
+            os.remove(file_path)
+        logger.info('downloading file {0}...'.format(key))
+        aws_session.download_object_resumable(key, file_path, object_info)
+        if manifest.verify(file_path, object_info):
+            return True
+    raise ValueError('file {0} does not match its S3 object after {1} downloads'.format(key, DOWNLOAD_ATTEMPTS))
 
 
-def get_available_files(dates_in_range, aws_session, data_path):
+def iter_verified_files(dates_in_range, aws_session, data_path, manifest, download_workers=None, stats=None,
+                        prefetch=None):
+    """
+    Paths of the day files of dates_in_range in date order, each one yielded once it matches its S3 object. Files
+    verified by previous runs are yielded right away while the rest are checked and downloaded in background threads,
+    at most prefetch files ahead of the consumer.
+    """
+    download_workers = download_workers or 10
+    executor = ThreadPoolExecutor(max_workers=download_workers)
+    file_paths = []
+    pending_files = deque()
+    for date in dates_in_range:
+        filename = '{0}.4daytransactionbystop.gz'.format(date.strftime('%Y-%m-%d'))
+        file_path = os.path.join(data_path, filename)
+        if manifest.is_verified(file_path):
+            logger.info('file {0} was verified in local storage ... skip'.format(filename))
+        else:
+            pending_files.append((filename, file_path))
+        file_paths.append(file_path)
+    if pending_files:
+        prepare_session(aws_session)
+    futures = dict()
+
+    def submit_files():
+        # downloads wait while prefetch files are ready but not consumed, so a slow consumer holds back the network
+        while pending_files and len(futures) < (prefetch or 2 * download_workers):
+            filename, file_path = pending_files.popleft()
+            futures[file_path] = executor.submit(fetch_verified_file, aws_session, manifest, filename, file_path)
+
+    def iter_files():
+        try:
+            for file_path in file_paths:
+                if file_path in futures:
+                    start_time = time.perf_counter()
+                    downloaded = futures.pop(file_path).result()
+                    add_counters(stats, download_wait_time=time.perf_counter() - start_time)
+                    submit_files()
+                    if downloaded:
+                        add_counters(stats, files_downloaded=1, bytes_written=get_path_size(file_path))
+                    else:
+                        add_counters(stats, files_verified=1)
+                yield file_path
+        finally:
+            # checks of files that were verified are kept for the next run even if this one fails
+            for future in futures.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+            manifest.save()
+
+    submit_files()
+    return iter_files()
+
+
+def iter_available_files(dates_in_range, aws_session, data_path, download_workers=None, stats=None, manifest=None,
+                         prefetch=None):
+    """
+    Iterator of the day files of dates_in_range. With a manifest and S3 access files are checked against their S3
+    objects and can be read while later files are downloaded, otherwise local files are trusted.
+    """
+    if manifest is not None and aws_session is not None:
+        return iter_verified_files(dates_in_range, aws_session, data_path, manifest, download_workers, stats,
+                                   prefetch)
     available_files = []
+    missing_files = []
     for date in dates_in_range:
         filename = '{0}.4daytransactionbystop.gz'.format(date.strftime('%Y-%m-%d'))
         file_path = os.path.join(data_path, filename)
         if os.path.exists(file_path):
             logger.info('file {0} exists in local storage ... skip'.format(filename))
-            available_files.append(file_path)
+            if manifest is not None:
+                manifest.index(file_path)
         else:
-            logger.info('downloading file {0}...'.format(filename))
-            aws_session.download_object_from_bucket(filename, file_path)
-            available_files.append(file_path)
-    return available_files
-
-
-def get_output_dict(available_files):
+            missing_files.append((filename, file_path))
+        available_files.append(file_path)
+    if missing_files:
+        if aws_session is None:
+            raise ValueError('{0} are not in local storage'.format(', '.join(key for key, _ in missing_files)))
+        # files are downloaded as in iter_verified_files, through a part file that is resumed after a failure
+        prepare_session(aws_session)
+        with ThreadPoolExecutor(max_workers=download_workers or 10) as executor:
+            list(executor.map(lambda missing_file: download_file(aws_session, *missing_file), missing_files))
+        add_counters(stats, files_downloaded=len(missing_files),
+                     bytes_written=sum(get_path_size(file_path) for _, file_path in missing_files))
+    if manifest is not None:
+        manifest.save()
+    return iter(available_files)
+
+
+def get_available_files(dates_in_range, aws_session, data_path, download_workers=None, stats=None, manifest=None):
+    return list(iter_available_files(dates_in_range, aws_session, data_path, download_workers, stats, manifest))
+
+
+def get_granularity_key(granularity, date, day_type, period, half_hour):
+    # raw fields of the key, they are decoded once per distinct value by decode_granularity_key
+    if granularity == 'half_hour':
+        return date, half_hour
+    if granularity == 'period':
+        return date, period
+    return day_type
+
+
+def decode_granularity_key(granularity, raw_key):
+    if granularity == 'half_hour':
+        return raw_key[0].decode('latin-1') + ' ' + raw_key[1].decode('latin-1')
+    if granularity == 'period':
+        return raw_key[0].decode('latin-1'), raw_key[1].decode('latin-1')
+    return raw_key.decode('latin-1')
+
+
+def parse_stop_fields(stop_columns, stations=None):
+    # stop_columns has CodigoTS;CodigoUsuario;Comuna;Nombre;Modo;Linea as they are in the file
+    auth_stop_code, user_stop_code, area, stop_name, mode, line = stop_columns.split(b';')
+    # stop code is utf-8 while the rest of the file is latin-1
+    auth_stop_code = auth_stop_code.decode('utf-8')
+    if auth_stop_code == "-":
+        return None
+
+    user_stop_code = user_stop_code.decode('latin-1')
+    if user_stop_code == "-":
+        user_stop_code = auth_stop_code
+
+    stop_name = stop_name.decode('latin-1')
+    if stop_name == "-":
+        stop_name = auth_stop_code
+
+    mode = mode.decode('latin-1')
+    line = line.decode('latin-1')
+    # metro and metrotren rows are keyed by the id of their station, stations missing from the reference data are
+    # kept as stations so they can be reported
+    station = None if stations is None else stations.resolve(mode, auth_stop_code, line)
+    is_station = mode == METRO_MODE or (stations is not None and mode in METROTREN_MODES)
+    if station is not None:
+        auth_stop_code = station
+    elif mode == METRO_MODE:
+        auth_stop_code = auth_stop_code + line
+
+    info = dict(stop_name=stop_name, user_stop_code=user_stop_code, auth_stop_code=auth_stop_code,
+                area=area.decode('latin-1').title())
+    return auth_stop_code, info, is_station
+
+
+def aggregate_transaction_file(file_path, output, metro_stations, granularities=DEFAULT_GRANULARITIES, stats=None,
+                               stations=None):
+    # daily transactions are always aggregated, other granularities are optional
+    extra_granularities = [(granularity, GRANULARITY_FIELDS[granularity], dict()) for granularity in granularities
+                           if granularity != 'day']
+    # lines are split as bytes, only around the stop columns, and every distinct stop and date is decoded once per
+    # file, so a row costs two splits, a few dict lookups and one integer add
+    stop_fields = dict()
+    dates = dict()
+    # info of the last row of a stop wins, it is only copied again when the stop columns change
+    stop_info = dict()
+    last_fields = None
+    # GzipFile reads lines in small steps, a large buffer keeps iteration as fast as in text mode
+    with io.BufferedReader(gzip.open(file_path, 'rb'), READ_BUFFER_SIZE) as file_obj:
+        # skip header
+        file_obj.readline()
+        # iterate the stream line by line so memory usage depends on the number of stops, not the file size
+        rows = skipped_rows = 0
+        for rows, line in enumerate(file_obj, 1):
+            raw_date, day_type, columns = line.split(b';', 2)
+            stop_columns, period, half_hour, transactions = columns.rsplit(b';', 3)
+            fields = stop_fields.get(stop_columns, False)
+            if fields is False:
+                fields = parse_stop_fields(stop_columns, stations)
+                if fields is not None:
+                    auth_stop_code, info, is_station = fields
+                    if is_station:
+                        metro_stations.add(auth_stop_code)
+                    # output entry of the stop is kept with its fields to skip the lookup on every row
+                    fields = (auth_stop_code, info, output[auth_stop_code])
+                stop_fields[stop_columns] = fields
+
+            if fields is None:
+                skipped_rows += 1
+                continue
+
+            auth_stop_code, info, stop = fields
+            # rows of a stop are usually contiguous, so its info is checked once per run of rows
+            if fields is not last_fields:
+                last_fields = fields
+                if stop_info.get(auth_stop_code) is not info:
+                    stop_info[auth_stop_code] = info
+                    stop['info'].update(info)
+
+            date = dates.get(raw_date)
+            if date is None:
+                date = dates[raw_date] = raw_date.decode('latin-1')
+            transactions = int(transactions)
+            stop['dates'][date] += transactions
+            for granularity, field, keys in extra_granularities:
+                raw_key = get_granularity_key(granularity, raw_date, day_type, period, half_hour)
+                key = keys.get(raw_key)
+                if key is None:
+                    key = keys[raw_key] = decode_granularity_key(granularity, raw_key)
+                if field not in stop:
+                    stop[field] = defaultdict(lambda: 0)
+                stop[field][key] += transactions
+
+    add_counters(stats, files_parsed=1, bytes_read=os.path.getsize(file_path), rows_parsed=rows,
+                 rows_skipped=skipped_rows)
+    return output, metro_stations
+
+
+def read_transaction_file(file_path, granularities=DEFAULT_GRANULARITIES, with_stats=False, stations=None):
+    logger.info('reading file "{0}" ...'.format(os.path.basename(file_path)))
+    output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+    stats = dict() if with_stats else None
+    output, metro_stations = aggregate_transaction_file(file_path, output, set(), granularities, stats, stations)
+    # plain dicts can be pickled back from worker processes
+    output = {stop: {field: dict(values) for field, values in data.items()} for stop, data in output.items()}
+    if with_stats:
+        # counters of worker processes are sent back with the partial output
+        return output, metro_stations, stats
+    return output, metro_stations
+
+
+def merge_output(output, metro_stations, partial_output, partial_metro_stations):
+    for stop, data in partial_output.items():
+        output[stop]['info'].update(data['info'])
+        for field, values in data.items():
+            if field == 'info':
+                continue
+            if field not in output[stop]:
+                output[stop][field] = defaultdict(lambda: 0)
+            for key, transactions in values.items():
+                output[stop][field][key] += transactions
+    metro_stations.update(partial_metro_stations)
+    return output, metro_stations
+
+
+def iter_partial_outputs(available_files, workers=1, cache=None, granularities=DEFAULT_GRANULARITIES, stats=None,
+                         stations=None):
+    """
+    Partial outputs of available_files in the same order. available_files can be an iterator, every file is read as
+    soon as it is yielded. With a StationIndex, metro and metrotren rows are keyed by their station.
+    """
+    if cache is not None and list(granularities) != DEFAULT_GRANULARITIES:
+        # cached aggregates only have daily transactions
+        logger.info('per-day aggregate cache is not used with granularities {0}'.format(', '.join(granularities)))
+        cache = None
+    options = dict()
+    if list(granularities) != DEFAULT_GRANULARITIES:
+        options['granularities'] = granularities
+    if stats is not None:
+        options['with_stats'] = True
+    if stations is not None:
+        options['stations'] = stations
+    # aggregates cached with other station references have other keys
+    cache_variant = '' if stations is None else stations.signature
+    read_file = functools.partial(read_transaction_file, **options) if options else read_transaction_file
+    pool = None
+    # (file path, partial output or pending result of a worker, whether it comes from cache)
+    pending = deque()
+
+    def finish(file_path, partial, cached):
+        if cached:
+            return partial
+        if pool is not None:
+            partial = partial.get()
+        if stats is not None:
+            partial, file_stats = partial[:2], partial[2]
+            add_counters(stats, **file_stats)
+        if cache is not None:
+            cache.put(file_path, partial, cache_variant)
+        return partial
+
+    try:
+        for file_path in available_files:
+            partial = None
+            if cache is not None and cache.contains(file_path, cache_variant):
+                logger.info('reading cached aggregate of "{0}" ...'.format(os.path.basename(file_path)))
+                partial = cache.get(file_path, cache_variant)
+            if partial is not None:
+                add_counters(stats, files_cached=1)
+                pending.append((file_path, partial, True))
+            elif workers > 1:
+                if pool is None:
+                    pool = multiprocessing.Pool(workers)
+                pending.append((file_path, pool.apply_async(read_file, (file_path,)), False))
+            else:
+                pending.append((file_path, read_file(file_path), False))
+            # partial outputs are yielded in input order, at most one file per worker waits to be read
+            while pending and (len(pending) > workers or pending[0][2] or pool is None or pending[0][1].ready()):
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def get_output_dict(available_files, workers=1, cache=None, granularities=DEFAULT_GRANULARITIES, stats=None,
+                    stations=None):
     output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
     metro_stations = set()
-    metrotren_stations = []
-    for file_path in available_files:
-        logger.info('reading file "{0}" ...'.format(os.path.basename(file_path)))
-        with gzip.open(file_path, str('rt'), encoding='latin-1') as file_obj:
-            # skip header
-            file_obj.readline()
-            for line in file_obj.readlines():
-                values = line.split(';')
-                auth_stop_code = values[2].encode('latin-1').decode('utf-8')
-
-                if auth_stop_code == "-":
-                    continue
+    for partial_output, partial_metro_stations in iter_partial_outputs(available_files, workers, cache,
+                                                                       granularities, stats, stations):
+        merge_output(output, metro_stations, partial_output, partial_metro_stations)
+    metrotren_stations = split_stations(metro_stations, stations, stats)
 
-                user_stop_code = values[3]
+    return output, metro_stations, metrotren_stations
 
-                if user_stop_code == "-":
-                    user_stop_code = auth_stop_code
 
-                stop_name = values[5]
-                if stop_name == "-":
-                    stop_name = auth_stop_code
+def load_output_state(state_path, stations=None, granularities=DEFAULT_GRANULARITIES):
+    output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+    metro_stations = set()
+    if not os.path.exists(state_path):
+        return output, metro_stations, set()
+    with open(state_path, 'rb') as state_file:
+        state = pickle.load(state_file)
+    if state.get('stations') != (None if stations is None else stations.signature):
+        # stations of the previous run were keyed with other station references
+        logger.info('station references changed since the previous run, every day is read again')
+        return output, metro_stations, set()
+    missing_granularities = set(granularities) - set(state.get('granularities', DEFAULT_GRANULARITIES))
+    if missing_granularities:
+        # days of the previous run were not aggregated by these granularities
+        logger.info('granularities {0} are not in the previous run, every day is read again'.format(
+            ', '.join(sorted(missing_granularities))))
+        return output, metro_stations, set()
+    merge_output(output, metro_stations, state['output'], state['metro_stations'])
+    return output, metro_stations, set(state['dates'])
+
+
+def save_output_state(state_path, output, metro_stations, dates, stations=None, granularities=DEFAULT_GRANULARITIES):
+    state = dict(output={stop: {field: dict(values) for field, values in data.items()}
+                         for stop, data in output.items()},
+                 metro_stations=metro_stations, dates=sorted(dates),
+                 stations=None if stations is None else stations.signature, granularities=list(granularities))
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'wb') as state_file:
+        pickle.dump(state, state_file, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, state_path)
+
+
+def remove_dates_from_output(output, metro_stations, dates):
+    for stop in list(output):
+        stop_dates = output[stop]['dates']
+        for date in dates:
+            stop_dates.pop(date, None)
+        for field in ('half_hours', 'periods'):
+            for key in list(output[stop].get(field, [])):
+                if (key[0] if field == 'periods' else key[:10]) in dates:
+                    del output[stop][field][key]
+        # a stop only seen on removed days would not exist in a fresh run
+        if not stop_dates:
+            del output[stop]
+            metro_stations.discard(stop)
+    return output, metro_stations
+
+
+def get_incremental_output_dict(state_path, dates_in_range, aws_session, data_path, workers=1, cache=None,
+                                download_workers=None, granularities=DEFAULT_GRANULARITIES, stats=None,
+                                manifest=None, prefetch=None, stations=None):
+    """
+    Update the aggregate saved by the previous run with state_path: days out of dates_in_range are removed and only
+    new days are downloaded and read.
+    """
+    output, metro_stations, processed_dates = load_output_state(state_path, stations, granularities)
+    dates = set(date.strftime('%Y-%m-%d') for date in dates_in_range)
+    dropped_dates = processed_dates - dates
+    new_dates = [date for date in dates_in_range if date.strftime('%Y-%m-%d') not in processed_dates]
+    logger.info('incremental run: {0} new days, {1} dropped days'.format(len(new_dates), len(dropped_dates)))
+
+    remove_dates_from_output(output, metro_stations, dropped_dates)
+    available_files = iter_available_files(new_dates, aws_session, data_path, download_workers, stats, manifest,
+                                           prefetch)
+    for partial_output, partial_metro_stations in iter_partial_outputs(available_files, workers, cache,
+                                                                       granularities, stats, stations):
+        merge_output(output, metro_stations, partial_output, partial_metro_stations)
+
+    # saved before enrichment, which adds stops and dates that do not come from transactions
+    save_output_state(state_path, output, metro_stations, dates, stations, granularities)
+    metrotren_stations = split_stations(metro_stations, stations, stats)
+    return output, metro_stations, metrotren_stations
 
-                area = values[4]
-                date = values[0]
-                transactions = values[10]
 
-                if values[6] == 'METRO':
-                    auth_stop_code = auth_stop_code + values[7]
-                    metro_stations.add(auth_stop_code)
+def add_location_to_stop_data(inputs_path, output, dates_in_range, reference_path=None):
+    for auth_stop_code, location in load_stop_locations(inputs_path, reference_path).items():
+        stop = output[auth_stop_code]
+        info = stop['info']
+        info['longitude'] = location['longitude']
+        info['latitude'] = location['latitude']
+        info.setdefault('area', '-')
+        info.setdefault('user_stop_code', location['user_stop_code'])
+        info.setdefault('auth_stop_code', auth_stop_code)
+        info.setdefault('stop_name', location['stop_name'])
+        if stop['dates'] == {}:
+            for date in dates_in_range:
+                stop['dates'][date.strftime('%Y-%m-%d')] = 0
 
-                output[auth_stop_code]['info']['stop_name'] = stop_name
-                output[auth_stop_code]['info']['user_stop_code'] = user_stop_code
-                output[auth_stop_code]['info']['auth_stop_code'] = auth_stop_code
-                output[auth_stop_code]['info']['area'] = area.title()
-                output[auth_stop_code]['dates'][date] += int(transactions)
+    return output
 
-    return output, metro_stations, metrotren_stations
 
+def add_location_to_metro_station_data(inputs_path, output, metro_stations, dates_in_range, reference_path=None):
+    for station, location in load_metro_locations(inputs_path, reference_path).items():
+        stop = output[station]
+        info = stop['info']
+        for field in ('longitude', 'latitude', 'user_stop_code', 'auth_stop_code', 'stop_name'):
+            info[field] = location[field]
 
-def add_location_to_stop_data(inputs_path, output, dates_in_range):
-    with open(os.path.join(inputs_path, 'stop.csv'), encoding='latin-1') as csv_file_obj:
-        spamreader = csv.reader(csv_file_obj, delimiter='|')
-        next(spamreader)
-        for row in spamreader:
-            auth_stop_code = row[4]
-            user_stop_code = row[5]
-            stop_name = row[6]
-            stop_longitude = row[7]
-            stop_latitude = row[8]
-
-            output[auth_stop_code]['info']['longitude'] = float(stop_longitude)
-            output[auth_stop_code]['info']['latitude'] = float(stop_latitude)
-            if 'area' not in dict(output)[auth_stop_code]['info']:
-                output[auth_stop_code]['info']['area'] = '-'
-            if 'user_stop_code' not in dict(output)[auth_stop_code]['info']:
-                output[auth_stop_code]['info']['user_stop_code'] = user_stop_code
-            if 'auth_stop_code' not in dict(output)[auth_stop_code]['info']:
-                output[auth_stop_code]['info']['auth_stop_code'] = auth_stop_code
-            if 'stop_name' not in dict(output)[auth_stop_code]['info']:
-                output[auth_stop_code]['info']['stop_name'] = stop_name
-            if output[auth_stop_code]['dates'] == {}:
-                for date in dates_in_range:
-                    output[auth_stop_code]['dates'][date.strftime('%Y-%m-%d')] = 0
-
-        return output
-
-
-def add_location_to_metro_station_data(inputs_path, output, metro_stations, dates_in_range):
-    with open(os.path.join(inputs_path, 'metro.csv')) as csv_metro_data:
-        metro_data = csv.reader(csv_metro_data, delimiter=';')
-        next(metro_data)
-        for metro_station in metro_data:
-            station_name = metro_station[7]
-            line = metro_station[4]
-            output[station_name + line]['info']['longitude'] = float(metro_station[2])
-            output[station_name + line]['info']['latitude'] = float(metro_station[3])
-            output[station_name + line]['info']['user_stop_code'] = "Estación {0}".format(station_name.title())
-            output[station_name + line]['info']['auth_stop_code'] = "Estación {0} {1}".format(station_name.title(),
-                                                                                              line)
-            output[station_name + line]['info']['stop_name'] = "Estación {0} {1}".format(station_name.title(), line)
-
-            if station_name + line not in metro_stations:
-                output[station_name + line]['info']['area'] = metro_station[1].title()
-                for date in dates_in_range:
-                    output[station_name + line]['dates'][date.strftime('%Y-%m-%d')] = 0
+        if station not in metro_stations:
+            info['area'] = location['area']
+            for date in dates_in_range:
+                stop['dates'][date.strftime('%Y-%m-%d')] = 0
     return output
 
 
-def add_location_to_metrotren_station_data(inputs_path, output, dates_in_range):
-    with open(os.path.join(inputs_path, 'metrotren.geojson')) as metro:
-        data = json.load(metro)
-        for metrotren in data['features']:
-            metrotren_station = metrotren['properties']['name']
-            metrotren_latitude = metrotren['geometry']['coordinates'][0]
-            metrotren_longitude = metrotren['geometry']['coordinates'][1]
-            output[metrotren_station]['info']['longitude'] = float(metrotren_longitude)
-            output[metrotren_station]['info']['latitude'] = float(metrotren_latitude)
-            if not 'user_stop_code' in dict(output)[metrotren_station]['info']:
-                output[metrotren_station]['info']['user_stop_code'] = metrotren_station
-            if not 'stop_name' in dict(output)[metrotren_station]['info']:
-                output[metrotren_station]['info']['stop_name'] = metrotren_station
+def add_location_to_metrotren_station_data(inputs_path, output, dates_in_range, reference_path=None):
+    for metrotren_station, location in load_metrotren_locations(inputs_path, reference_path).items():
+        info = output[metrotren_station]['info']
+        info['longitude'] = location['longitude']
+        info['latitude'] = location['latitude']
+        info.setdefault('user_stop_code', metrotren_station)
+        info.setdefault('stop_name', metrotren_station)
     return output
 
 
-def create_csv_data(outputs_path, output_filename, output):
+def get_row_time(granularity, key):
+    # Fecha column and the label column added by period and day type rows
+    if granularity == 'day':
+        return key + " 00:00:00", []
+    if granularity == 'half_hour':
+        return key, []
+    if granularity == 'period':
+        return key[0] + " 00:00:00", [key[1]]
+    return '', [key]
+
+
+def iter_csv_rows(output, log_invalid=True, granularity='day'):
+    field = GRANULARITY_FIELDS[granularity]
+    for data, stop in output.items():
+        info = stop['info']
+        missing_fields = [field.replace('_', ' ') for field in CSV_INFO_FIELDS if field not in info]
+        if missing_fields:
+            if log_invalid:
+                logger.warning("%s doesn't have %s" % (data, ', '.join(missing_fields)))
+            continue
+
+        for key, transactions in stop.get(field, {}).items():
+            date, labels = get_row_time(granularity, key)
+            yield [date, info['stop_name'], info['user_stop_code'], info['auth_stop_code'], info['area'],
+                   info['longitude'], info['latitude'], transactions] + labels
+
+
+def create_csv_data(outputs_path, output_filename, output, granularity='day'):
+    # rows are written as they are generated, so the whole csv is never held in memory
+    rows = 0
     with open(os.path.join(outputs_path, output_filename + '.csv'), 'w', newline='\n', encoding='latin-1') as outfile:
-        csv_data = []
         w = csv.writer(outfile)
-        w.writerow(['Fecha', 'Nombre', 'Código de usuario', 'Código ts', 'Comuna', 'Latitud', 'Longitud', 'Subidas'])
-        for data in dict(output):
-            info = dict(output)[data]['info']
-            longitude = '-'
-            latitude = '-'
-            area = '-'
-            valid = True
-            if 'longitude' in dict(output)[data]['info']:
-                longitude = info['longitude']
-            else:
-                logger.warning("%s doesn't have longitude" % data)
-                valid = False
+        w.writerow(CSV_HEADER + GRANULARITY_LABELS.get(granularity, []))
+        for data_row in iter_csv_rows(output, granularity=granularity):
+            w.writerow(data_row)
+            rows += 1
+    return rows
+
+
+def create_parquet_data(outputs_path, output_filename, output, batch_size=100000):
+    # imported here because pyarrow is only needed for this export
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # one partition per date (Fecha=YYYY-MM-DD), the date lives in the directory name
+    schema = pa.schema([(column, pa.dictionary(pa.int32(), pa.string())) for column in PARQUET_STRING_COLUMNS] +
+                       [('Latitud', pa.float64()), ('Longitud', pa.float64()), ('Subidas', pa.int64())])
+    dataset_path = os.path.join(outputs_path, output_filename + '.parquet')
+    if os.path.exists(dataset_path):
+        shutil.rmtree(dataset_path)
+    writers = dict()
+    batches = defaultdict(list)
+
+    def write_batch(date):
+        columns = list(zip(*batches.pop(date)))
+        arrays = [pa.array(column, type=pa.string()).dictionary_encode() for column in columns[:4]]
+        arrays += [pa.array(columns[4], type=pa.float64()), pa.array(columns[5], type=pa.float64()),
+                   pa.array(columns[6], type=pa.int64())]
+        if date not in writers:
+            partition_path = os.path.join(dataset_path, 'Fecha={0}'.format(date))
+            os.makedirs(partition_path)
+            writers[date] = pq.ParquetWriter(os.path.join(partition_path, 'part-0.parquet'), schema)
+        writers[date].write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    # stops are read once per date, so every partition is written in row groups of a whole date, or of batch_size
+    # rows when a date has more, and memory only holds the rows of one of them
+    stops = [stop for stop in output.values() if all(field in stop['info'] for field in CSV_INFO_FIELDS)]
+    dates = sorted(set(date for stop in stops for date in stop['dates']))
+    rows = 0
+    try:
+        for date in dates:
+            for stop in stops:
+                transactions = stop['dates'].get(date)
+                if transactions is None:
+                    continue
+                info = stop['info']
+                batches[date].append([info['stop_name'], info['user_stop_code'], info['auth_stop_code'], info['area'],
+                                      info['longitude'], info['latitude'], transactions])
+                rows += 1
+                if len(batches[date]) >= batch_size:
+                    write_batch(date)
+            if date in batches:
+                write_batch(date)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return rows
+
+
+def compact_csv_data(csv_data):
+    # stop attributes and dates are stored once, rows become stop ids and transactions grouped by date. Labels of
+    # period and day type rows are stored with their date
+    stops = dict()
+    dates = dict()
+    rows_by_date = []
+    for row in csv_data:
+        date_id = dates.setdefault(tuple(row[:1] + row[8:]), len(dates))
+        if date_id == len(rows_by_date):
+            rows_by_date.append([[], []])
+        rows_by_date[date_id][0].append(stops.setdefault(tuple(row[1:7]), len(stops)))
+        rows_by_date[date_id][1].append(row[7])
+    return dict(dates=[list(date) for date in dates], stops=[list(stop) for stop in stops], rows=rows_by_date)
+
+
+def iter_base64_gzip(chunks):
+    compressor = zlib.compressobj(9)
+    pending = b''
+    for chunk in chunks:
+        pending += compressor.compress(chunk.encode('utf-8'))
+        # base64 encodes 3 bytes blocks, the remainder waits for the next chunk
+        cut = len(pending) - len(pending) % 3
+        if cut:
+            yield base64.b64encode(pending[:cut]).decode('ascii')
+            pending = pending[cut:]
+    yield base64.b64encode(pending + compressor.flush()).decode('ascii')
+
+
+def iter_kepler_data(csv_data, data_format='full'):
+    if data_format == 'full':
+        # same text as str(csv_data), one row at a time
+        yield '['
+        for index, row in enumerate(csv_data):
+            yield str(row) if index == 0 else ', ' + str(row)
+        yield ']'
+        return
+    decoder_start, decoder_end = COMPACT_DATA_DECODER.split('<PAYLOAD>')
+    payload = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).iterencode(compact_csv_data(csv_data))
+    yield decoder_start
+    if data_format == 'gzip':
+        yield 'JSON.parse(pako.inflate(atob("'
+        yield from iter_base64_gzip(payload)
+        yield '"), {to: "string"}))'
+    else:
+        for chunk in payload:
+            # "</" would close the script tag that holds the data
+            yield chunk.replace('</', '<\\/')
+    yield decoder_end
+
+
+def get_kepler_data(csv_data, data_format='full'):
+    return ''.join(iter_kepler_data(csv_data, data_format))
+
+
+def get_kepler_layer(layer_id, label):
+    # point layer at the center of every area, colored and sized by its transactions
+    style = KEPLER_LAYER_STYLES[layer_id]
+    color_range = dict(name='Global Warming', type='sequential', category='Uber',
+                       colors=['#5A1846', '#900C3F', '#C70039', '#E3611C', '#F1920E', '#FFC300'])
+    subidas = dict(name='Subidas', type='integer')
+    return dict(id='layer_{0}'.format(layer_id), type='point', config=dict(
+        dataId='layer_{0}'.format(layer_id), label=label, color=style['color'],
+        columns=dict(lat='Latitud', lng='Longitud', altitude=None), isVisible=True,
+        visConfig=dict(radius=10, fixedRadius=False, opacity=0.6, outline=False, thickness=1, strokeColor=None,
+                       colorRange=color_range, strokeColorRange=color_range, radiusRange=style['radius_range'],
+                       filled=True), hidden=False, textLabel=[]),
+        visualChannels=dict(colorField=subidas, colorScale='quantile', strokeColorField=None,
+                            strokeColorScale='quantile', sizeField=subidas, sizeScale='sqrt'))
+
+
+def write_info_to_kepler_file(template_path, outputs_path, output_filename, mapbox_key, csv_data, data_format='full',
+                              granularity='day', layers=()):
+    """
+    Write the html visualization of csv_data. layers are (layer id, label, rows) of coarse layers shown with the
+    stops, their rows have the same columns as csv_data.
+    """
+    if granularity == 'day_type':
+        raise ValueError('day type rows do not have dates to show in kepler, use the csv output instead')
+    extra_fields = ''.join(', {{"name": "{0}", "type": "string", "format": "", "analyzerType": "STRING"}}'.format(label)
+                           for label in GRANULARITY_LABELS.get(granularity, []))
+    fields = json.dumps(KEPLER_FIELDS + [dict(name=label, type='string', format='', analyzerType='STRING')
+                                         for label in GRANULARITY_LABELS.get(granularity, [])], ensure_ascii=False)
+    layer_ids = ['layer_{0}'.format(layer_id) for layer_id, _, _ in layers]
+    field_names = json.dumps([field['name'] for field in KEPLER_FIELDS], ensure_ascii=False)
+    with open(os.path.join(template_path, 'template.html')) as html_file:
+        html_data = html_file.read()
+    head, tail = html_data.split("<DATA>", 1)
+    tail = tail.replace("<MAPBOX_KEY>", mapbox_key).replace("<EXTRA_FIELDS>", extra_fields)
+    # the time filter of stops also filters coarse layers
+    tail = tail.replace("<EXTRA_FILTER_IDS>", ''.join(', "{0}"'.format(data_id) for data_id in layer_ids))
+    tail = tail.replace("<EXTRA_FILTER_NAMES>", ', "Fecha"' * len(layers))
+    kepler_layers = [json.dumps(get_kepler_layer(layer_id, label), ensure_ascii=False) for layer_id, label, _ in layers]
+    tail = tail.replace("<EXTRA_LAYERS>", ''.join(', ' + kepler_layer for kepler_layer in kepler_layers))
+    tail = tail.replace("<EXTRA_TOOLTIPS>", ''.join(', "{0}": {1}'.format(data_id, field_names)
+                                                    for data_id in layer_ids))
+    datasets_tail, _, layers_tail = tail.partition("<EXTRA_DATASETS>")
+    with open(os.path.join(outputs_path, f"{output_filename}.html"), 'w') as output:
+        output.write(head.replace("<MAPBOX_KEY>", mapbox_key))
+        # csv_data can be a generator, rows are written as they come
+        for chunk in iter_kepler_data(csv_data, data_format):
+            output.write(chunk)
+        output.write(datasets_tail)
+        for data_id, (layer_id, label, layer_data) in zip(layer_ids, layers):
+            output.write(', {{"version": "v1", "data": {{"id": "{0}", "label": {1}, "color": {2}, "allData": '.format(
+                data_id, json.dumps(label, ensure_ascii=False), KEPLER_LAYER_STYLES[layer_id]['color']))
+            for chunk in iter_kepler_data(layer_data, data_format):
+                output.write(chunk)
+            output.write(', "fields": {0}}}}}'.format(fields))
+        output.write(layers_tail)
 
-            if 'latitude' in dict(output)[data]['info']:
-                latitude = info['latitude']
-            else:
-                logger.warning("%s doesn't have latitude" % data)
-                valid = False
 
-            if 'area' in dict(output)[data]['info']:
-                area = info['area']
-            else:
-                logger.warning("%s doesn't have area" % data)
-                valid = False
+def get_output_name(output_filename, granularity):
+    return output_filename if granularity == 'day' else '{0}_{1}'.format(output_filename, granularity)
 
-            if 'user_stop_code' in dict(output)[data]['info']:
-                user_stop_code = info['user_stop_code']
-            else:
-                logger.warning("%s doesn't have user stop code" % data)
-                valid = False
 
-            if 'auth_stop_code' in dict(output)[data]['info']:
-                auth_stop_code = info['auth_stop_code']
-            else:
-                logger.warning("Warning: %s doesn't have auth stop code" % data)
-                valid = False
+def get_days_parser():
+    """
+    Arguments of how days are listed, downloaded, read and cached, shared by every script that aggregates days.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes used to read transaction files. Default: 1')
+    parser.add_argument('--download-workers', type=int, default=10,
+                        help='number of files downloaded concurrently from S3. Default: 10')
+    parser.add_argument('--prefetch', type=int,
+                        help='maximum number of files downloaded ahead of the files being read. Default: twice the '
+                             'download workers')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse every transaction file instead of reusing cached per-day aggregates')
+    parser.add_argument('--cache-size', type=int, default=512,
+                        help='maximum size of the per-day aggregate cache in MB. Default: 512')
+    parser.add_argument('--offline', action='store_true',
+                        help='find days in the manifest of files in data/ instead of listing the S3 bucket. Days that '
+                             'are not in local storage are not processed and nothing is downloaded')
+    return parser
 
-            if 'stop_name' in dict(output)[data]['info']:
-                stop_name = info['stop_name']
-            else:
-                logger.warning("Warning: %s doesn't have stop name" % data)
-                valid = False
-
-            for date in dict(output)[data]['dates']:
-                if valid:
-                    data_row = [date + " 00:00:00", stop_name, user_stop_code, auth_stop_code, area, longitude, latitude,
-                                dict(output)[data]['dates'][date]]
-                    w.writerow(data_row)
-                    csv_data.append(data_row)
-    return csv_data
-
-
-def write_info_to_kepler_file(template_path, outputs_path, output_filename, mapbox_key, csv_data):
-    html_file = open(os.path.join(template_path, 'template.html'))
-    html_data = html_file.read()
-    html_file.close()
-    with open(os.path.join(outputs_path, f"{output_filename}.html"), 'w') as output:
-        new_html_data = html_data.replace("<MAPBOX_KEY>", mapbox_key).replace("<DATA>", str(csv_data))
-        output.write(new_html_data)
+
+def get_aws_session(args):
+    # without network every day is read from local storage
+    return None if args.offline else LazyAWSSession(max_pool_connections=args.download_workers)
+
+
+def get_day_cache(args):
+    return None if args.no_cache else DayAggregateCache(os.path.join(DATA_PATH, 'cache'), args.cache_size * 1024 * 1024)
 
 
 def main(argv):
     """
     This script will create visualization of bip! transaction by stop for each day.
     """
-    f = Figlet()
-    logger.info(f.renderText('Welcome DTPM'))
-
     # Arguments and description
-    parser = argparse.ArgumentParser(description='create visualization of bip! transaction by stop for each day.')
+    parser = argparse.ArgumentParser(description='create visualization of bip! transaction by stop for each day.',
+                                     parents=[get_days_parser()])
 
     parser.add_argument('start_date', help='Lower bound time. For instance 2020-01-01')
     parser.add_argument('end_date', help='Upper bound time. For instance 2020-12-31')
     parser.add_argument('output_filename', help='filename of html file created by the process')
+    parser.add_argument('--engine', choices=['dict', 'columnar'], default='dict',
+                        help='aggregation engine. columnar keeps counts in a NumPy array and reads files '
+                             'sequentially without cache. Default: dict')
+    parser.add_argument('--html-format', choices=KEPLER_DATA_FORMATS, default='full',
+                        help='how data is embedded in the html file. compact stores every stop once and gzip also '
+                             'compresses it. Default: full')
+    parser.add_argument('--incremental', action='store_true',
+                        help='update the aggregate saved by the previous run with the same output filename, reading '
+                             'only days that are new in the period. It always uses the dict engine')
+    parser.add_argument('--parquet', action='store_true',
+                        help='also save data as a parquet dataset partitioned by date, it requires pyarrow')
+    parser.add_argument('--granularities', nargs='+', choices=GRANULARITIES, default=DEFAULT_GRANULARITIES,
+                        help='aggregations created in a single read of the files. Every granularity other than day '
+                             'is saved with its name appended to output_filename. Default: day')
+    parser.add_argument('--report', help='path of the json run report with time, memory and counters of each stage. '
+                                         'Default: outputs/[output_filename].report.json')
+    parser.add_argument('--profile', help='save a cProfile dump of the run at this path, it can be read with pstats')
+    parser.add_argument('--layers', nargs='+', choices=LAYERS, default=[],
+                        help='coarse layers added to the html files with transactions summed by grid cell or by '
+                             'comuna of inputs/comunas.geojson')
+    parser.add_argument('--grid-shape', choices=GRID_SHAPES, default='hex', help='shape of grid cells. Default: hex')
+    parser.add_argument('--grid-size', type=int, default=1000,
+                        help='width of grid cells in meters. Default: 1000')
+    parser.add_argument('--quiet', action='store_true', help='only log warnings and errors, without welcome banner')
 
     args = parser.parse_args(argv[1:])
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    else:
+        from pyfiglet import Figlet
+        logger.info(Figlet().renderText('Welcome DTPM'))
+    if args.engine == 'columnar' and args.granularities != DEFAULT_GRANULARITIES:
+        parser.error('columnar engine only aggregates by day')
+    if args.incremental and 'day_type' in args.granularities:
+        parser.error('day type totals can not be updated incrementally')
+    if args.parquet and 'day' not in args.granularities:
+        parser.error('the parquet dataset is partitioned by day, it needs day in --granularities')
 
     start_date = datetime.strptime(args.start_date, "%Y-%m-%d")
     end_date = datetime.strptime(args.end_date, "%Y-%m-%d")
     output_filename = args.output_filename
-
-    aws_session = AWSSession()
+    report = RunReport(start_date=args.start_date, end_date=args.end_date, output_filename=output_filename,
+                       engine=args.engine, workers=args.workers, incremental=args.incremental,
+                       granularities=args.granularities, html_format=args.html_format, layers=args.layers)
+    profiler = None
+    if args.profile:
+        # aggregation workers run in other processes, so with --workers only the main process is profiled
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    aws_session = get_aws_session(args)
     mapbox_key = config('MAPBOX_KEY')
+    manifest = DataManifest(DATA_PATH)
 
     # check available days
-    dates_in_range = check_available_days(aws_session, start_date, end_date)
+    with report.stage('listing') as stage:
+        if args.offline:
+            manifest.refresh()
+            manifest.save()
+            dates_in_range = manifest.get_available_dates(start_date, end_date)
+        else:
+            dates_in_range = check_available_days(aws_session, start_date, end_date,
+                                                  os.path.join(DATA_PATH, DATES_INDEX_FILENAME))
+        stage['days'] = len(dates_in_range)
     if not dates_in_range:
         logger.error('There is not data between {0} and {1}'.format(start_date, end_date))
         exit(1)
     logger.info('dates found in period: {0}'.format(len(dates_in_range)))
 
-    # get available files
-    available_files = get_available_files(dates_in_range, aws_session, DATA_PATH)
-
-    # create output dict
-    output, metro_stations, metrotren_stations = get_output_dict(available_files)
-
-    # add location to stop data
-    output = add_location_to_stop_data(INPUTS_PATH, output, dates_in_range)
-
-    # add location to metro data
-    output = add_location_to_metro_station_data(INPUTS_PATH, output, metro_stations, dates_in_range)
-
-    # add location to metrotren data
-    output = add_location_to_metrotren_station_data(INPUTS_PATH, output, dates_in_range)
-
-    # save csv data
-    csv_data = create_csv_data(OUTPUTS_PATH, output_filename, output)
-
-    # write mapbox_id to kepler file
-    write_info_to_kepler_file(TEMPLATE_PATH, OUTPUTS_PATH, output_filename, mapbox_key, csv_data)
-
+    cache = get_day_cache(args)
+    reference_path = os.path.join(DATA_PATH, REFERENCE_DATA_FILENAME)
+    if args.incremental:
+        # get files of new days and update output dict of previous run, downloads are measured with aggregation
+        state_path = os.path.join(OUTPUTS_PATH, '{0}.state'.format(output_filename))
+        with report.stage('aggregation') as stage:
+            station_index = load_station_index(INPUTS_PATH, reference_path)
+            output, metro_stations, metrotren_stations = get_incremental_output_dict(
+                state_path, dates_in_range, aws_session, DATA_PATH, args.workers, cache, args.download_workers,
+                args.granularities, stage, manifest, args.prefetch, station_index)
+    else:
+        # create output dict, files are checked and downloaded while verified files are read and gzip files are
+        # decompressed while they are parsed, so all of them are measured together
+        with report.stage('aggregation') as stage:
+            station_index = load_station_index(INPUTS_PATH, reference_path)
+            available_files = iter_available_files(dates_in_range, aws_session, DATA_PATH, args.download_workers,
+                                                   stage, manifest, args.prefetch)
+            if args.engine == 'columnar':
+                # numpy is only imported by the columnar engine
+                from columnar import get_output_columnar
+                output, metro_stations, metrotren_stations = get_output_columnar(available_files, stage,
+                                                                                 station_index)
+            else:
+                output, metro_stations, metrotren_stations = get_output_dict(available_files, args.workers, cache,
+                                                                             args.granularities, stage, station_index)
+
+    with report.stage('enrichment') as stage:
+        # add location to stop data
+        output = add_location_to_stop_data(INPUTS_PATH, output, dates_in_range, reference_path)
+
+        # add location to metro data
+        output = add_location_to_metro_station_data(INPUTS_PATH, output, metro_stations, dates_in_range,
+                                                    reference_path)
+
+        # add location to metrotren data
+        output = add_location_to_metrotren_station_data(INPUTS_PATH, output, dates_in_range, reference_path)
+        stage['stops'] = len(output)
+
+    for granularity in args.granularities:
+        output_name = get_output_name(output_filename, granularity)
+
+        # save csv data
+        with report.stage('csv_{0}'.format(granularity)) as stage:
+            stage['rows_written'] = create_csv_data(OUTPUTS_PATH, output_name, output, granularity)
+            stage['bytes_written'] = get_path_size(os.path.join(OUTPUTS_PATH, output_name + '.csv'))
+
+        # save parquet data
+        if args.parquet and granularity == 'day':
+            with report.stage('parquet') as stage:
+                stage['rows_written'] = create_parquet_data(OUTPUTS_PATH, output_name, output)
+                stage['bytes_written'] = get_path_size(os.path.join(OUTPUTS_PATH, output_name + '.parquet'))
+
+        # write mapbox_id to kepler file
+        if granularity != 'day_type':
+            layers = []
+            if args.layers:
+                with report.stage('layers_{0}'.format(granularity)) as stage:
+                    layers = get_layers(output, args.layers, INPUTS_PATH, args.grid_size, args.grid_shape,
+                                        GRANULARITY_FIELDS[granularity])
+                    for layer_id, _, layer_output in layers:
+                        stage['{0}_areas'.format(layer_id)] = len(layer_output)
+            with report.stage('html_{0}'.format(granularity)) as stage:
+                csv_data = iter_csv_rows(output, log_invalid=False, granularity=granularity)
+                layers_data = [(layer_id, label, iter_csv_rows(layer_output, granularity=granularity))
+                               for layer_id, label, layer_output in layers]
+                write_info_to_kepler_file(TEMPLATE_PATH, OUTPUTS_PATH, output_name, mapbox_key, csv_data,
+                                          args.html_format, granularity, layers_data)
+                stage['bytes_written'] = get_path_size(os.path.join(OUTPUTS_PATH, output_name + '.html'))
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        logger.info('profile saved at {0}'.format(args.profile))
+    report.save(args.report or os.path.join(OUTPUTS_PATH, '{0}.report.json'.format(output_filename)))
     logger.info('{0} successfully created!'.format(output_filename))
 
 
@@ -0,0 +1,143 @@
+# -*- coding: utf8 -*-
+import csv
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FILES = ['stop.csv', 'metro.csv', 'metrotren.geojson']
+STOP_FIELDS = ['user_stop_code', 'stop_name', 'longitude', 'latitude']
+METRO_FIELDS = ['longitude', 'latitude', 'user_stop_code', 'auth_stop_code', 'stop_name', 'area', 'line',
+                'station_name', 'transaction_code']
+METROTREN_FIELDS = ['longitude', 'latitude']
+# changed whenever tables or fields change, so files compiled by previous versions are rebuilt
+REFERENCE_VERSION = 2
+# mode of the compiled file, read once because os.umask can only be read by setting it, which is not thread safe
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+
+def parse_stop_locations(inputs_path):
+    # stop.csv has a row for every route that visits a stop, the index keeps one entry per auth_stop_code
+    stop_locations = dict()
+    with open(os.path.join(inputs_path, 'stop.csv'), encoding='latin-1') as csv_file_obj:
+        spamreader = csv.reader(csv_file_obj, delimiter='|')
+        next(spamreader)
+        for row in spamreader:
+            # codes and names come from the first row of a stop, coordinates from the last one
+            location = stop_locations.setdefault(row[4], dict(user_stop_code=row[5], stop_name=row[6]))
+            location['longitude'] = float(row[7])
+            location['latitude'] = float(row[8])
+    return stop_locations
+
+
+def parse_metro_locations(inputs_path):
+    # indexed by station name + line, the same key built by get_output_dict for metro transactions
+    metro_locations = dict()
+    with open(os.path.join(inputs_path, 'metro.csv')) as csv_metro_data:
+        metro_data = csv.reader(csv_metro_data, delimiter=';')
+        next(metro_data)
+        for metro_station in metro_data:
+            station_name = metro_station[7].title()
+            line = metro_station[4]
+            metro_locations[metro_station[7] + line] = dict(
+                longitude=float(metro_station[2]), latitude=float(metro_station[3]),
+                user_stop_code="Estación {0}".format(station_name),
+                auth_stop_code="Estación {0} {1}".format(station_name, line),
+                stop_name="Estación {0} {1}".format(station_name, line), area=metro_station[1].title(), line=line,
+                station_name=metro_station[7], transaction_code=metro_station[0])
+    return metro_locations
+
+
+def parse_metrotren_locations(inputs_path):
+    metrotren_locations = dict()
+    with open(os.path.join(inputs_path, 'metrotren.geojson')) as metro:
+        data = json.load(metro)
+        for metrotren in data['features']:
+            metrotren_locations[metrotren['properties']['name']] = dict(
+                longitude=float(metrotren['geometry']['coordinates'][1]),
+                latitude=float(metrotren['geometry']['coordinates'][0]))
+    return metrotren_locations
+
+
+def get_sources_signature(inputs_path):
+    signature = [REFERENCE_VERSION]
+    for filename in SOURCE_FILES:
+        stat = os.stat(os.path.join(inputs_path, filename))
+        signature.append([filename, stat.st_size, stat.st_mtime_ns])
+    return json.dumps(signature)
+
+
+def build_reference_data(inputs_path, reference_path):
+    logger.info('compiling reference data into {0} ...'.format(os.path.basename(reference_path)))
+    tables = [('stops', STOP_FIELDS, parse_stop_locations(inputs_path)),
+              ('metro', METRO_FIELDS, parse_metro_locations(inputs_path)),
+              ('metrotren', METROTREN_FIELDS, parse_metrotren_locations(inputs_path))]
+    # every run compiles into its own temporary file, so runs rebuilding the file at the same time do not write
+    # into each other's database before the rename
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(reference_path) or '.',
+                                    prefix=os.path.basename(reference_path), suffix='.tmp')
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(tmp_path)
+        with connection:
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('INSERT INTO meta VALUES (?, ?)', ('signature', get_sources_signature(inputs_path)))
+            for table, fields, locations in tables:
+                connection.execute('CREATE TABLE {0} (key TEXT PRIMARY KEY, {1})'.format(table, ', '.join(fields)))
+                connection.executemany(
+                    'INSERT INTO {0} VALUES ({1})'.format(table, ', '.join(['?'] * (len(fields) + 1))),
+                    [[key] + [location[field] for field in fields] for key, location in locations.items()])
+        connection.close()
+        # mkstemp creates the file readable by its owner only, the compiled file follows the umask
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, reference_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def open_reference_data(inputs_path, reference_path):
+    # the compiled file is rebuilt whenever a source file changes its size or modification time
+    signature = None
+    if os.path.exists(reference_path):
+        connection = sqlite3.connect(reference_path)
+        try:
+            signature = connection.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()[0]
+        except (sqlite3.DatabaseError, TypeError):
+            pass
+        connection.close()
+    if signature != get_sources_signature(inputs_path):
+        build_reference_data(inputs_path, reference_path)
+    return sqlite3.connect(reference_path)
+
+
+def read_locations(inputs_path, reference_path, table, fields):
+    connection = open_reference_data(inputs_path, reference_path)
+    try:
+        rows = connection.execute('SELECT key, {0} FROM {1} ORDER BY rowid'.format(', '.join(fields), table))
+        return dict((row[0], dict(zip(fields, row[1:]))) for row in rows)
+    finally:
+        connection.close()
+
+
+def load_stop_locations(inputs_path, reference_path=None):
+    if reference_path is None:
+        return parse_stop_locations(inputs_path)
+    return read_locations(inputs_path, reference_path, 'stops', STOP_FIELDS)
+
+
+def load_metro_locations(inputs_path, reference_path=None):
+    if reference_path is None:
+        return parse_metro_locations(inputs_path)
+    return read_locations(inputs_path, reference_path, 'metro', METRO_FIELDS)
+
+
+def load_metrotren_locations(inputs_path, reference_path=None):
+    if reference_path is None:
+        return parse_metrotren_locations(inputs_path)
+    return read_locations(inputs_path, reference_path, 'metrotren', METROTREN_FIELDS)
@@ -0,0 +1,294 @@
+# -*- coding: utf8 -*-
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sys
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import process_data
+from batch import MODES, list_days, load_output
+from instrumentation import RunReport
+from manifest import DataManifest
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_FORMATS = ['csv', 'json']
+QUERY_PARAMETERS = ['start_date', 'end_date', 'stop', 'comuna', 'mode', 'format']
+
+
+class TransactionStore:
+    """
+    Transactions of every stop by day, indexed by stop code, comuna and mode. Days of a stop are kept in a list
+    aligned to the sorted days of the store, so a date range is a slice of it, and the columns of a stop are encoded
+    as csv and json once, so responses only add the day and transactions of each row.
+    """
+
+    def __init__(self, output, located_stops=(), stop_modes=None):
+        stop_modes = stop_modes or dict()
+        self.dates = sorted(set(date for data in output.values() for date in data['dates']))
+        date_positions = dict((date, position) for position, date in enumerate(self.dates))
+        self.stops = []
+        self.codes = defaultdict(set)
+        self.comunas = defaultdict(set)
+        self.modes = defaultdict(set)
+        csv_file = io.StringIO()
+        writer = csv.writer(csv_file, lineterminator='')
+        for stop, data in output.items():
+            info = data['info']
+            if any(field not in info for field in process_data.CSV_INFO_FIELDS):
+                continue
+            transactions = [None] * len(self.dates)
+            for date, value in data['dates'].items():
+                transactions[date_positions[date]] = value
+            info_row = [info['stop_name'], info['user_stop_code'], info['auth_stop_code'], info['area'],
+                        info['longitude'], info['latitude']]
+            csv_file.seek(0)
+            csv_file.truncate()
+            writer.writerow(info_row)
+            position = len(self.stops)
+            self.stops.append((info_row, csv_file.getvalue(), json.dumps(info_row)[1:-1], transactions,
+                               stop in located_stops))
+            for code in {stop, info['user_stop_code'], info['auth_stop_code']}:
+                self.codes[str(code).lower()].add(position)
+            self.comunas[str(info['area']).lower()].add(position)
+            self.modes[stop_modes.get(stop, 'bus')].add(position)
+
+    def iter_matches(self, start_date=None, end_date=None, stops=None, comuna=None, mode=None):
+        """
+        Stop, day and transactions of days between start_date and end_date (YYYY-MM-DD, both included) of stops
+        matching every filter. stops are stop, user or ts codes. Stops with a location and without transactions in
+        those days have them with zero transactions, as batch.slice_output does.
+        """
+        first = 0 if start_date is None else bisect_left(self.dates, start_date)
+        last = len(self.dates) if end_date is None else bisect_right(self.dates, end_date)
+        dates = [date + ' 00:00:00' for date in self.dates[first:last]]
+        positions = None
+        if stops is not None:
+            positions = set().union(*[self.codes.get(stop.lower(), set()) for stop in stops])
+        if comuna is not None:
+            positions = self.intersect(positions, self.comunas.get(comuna.lower(), set()))
+        if mode is not None:
+            positions = self.intersect(positions, self.modes.get(mode, set()))
+
+        for position in range(len(self.stops)) if positions is None else sorted(positions):
+            stop = self.stops[position]
+            transactions = stop[3][first:last]
+            if stop[4] and all(value is None for value in transactions):
+                transactions = [0] * len(transactions)
+            for date, value in zip(dates, transactions):
+                if value is not None:
+                    yield stop, date, value
+
+    def query(self, *args, **kwargs):
+        """
+        Csv rows of iter_matches.
+        """
+        return [[date] + stop[0] + [value] for stop, date, value in self.iter_matches(*args, **kwargs)]
+
+    def query_csv(self, *args, **kwargs):
+        rows = ['{0},{1},{2}\n'.format(date, stop[1], value)
+                for stop, date, value in self.iter_matches(*args, **kwargs)]
+        return ','.join(process_data.CSV_HEADER) + '\n' + ''.join(rows)
+
+    def query_json(self, *args, **kwargs):
+        # fields and rows of a kepler.gl dataset
+        rows = ['["{0}",{1},{2}]'.format(date, stop[2], value)
+                for stop, date, value in self.iter_matches(*args, **kwargs)]
+        return '{{"fields": {0}, "rows": [{1}]}}'.format(json.dumps(process_data.KEPLER_FIELDS), ','.join(rows))
+
+    @staticmethod
+    def intersect(positions, matches):
+        return matches if positions is None else positions & matches
+
+
+class ResponseCache:
+    """
+    Least recently used responses of the last max_entries distinct queries, with bodies of at most max_bytes in
+    total. A body larger than max_bytes is not kept.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.responses = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            response = self.responses.get(key)
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.responses.move_to_end(key)
+            return response
+
+    def put(self, key, response):
+        # response is (content type, body)
+        if self.max_entries <= 0 or len(response[1]) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.responses:
+                self.size -= len(self.responses.pop(key)[1])
+            self.responses[key] = response
+            self.size += len(response[1])
+            while len(self.responses) > self.max_entries or self.size > self.max_bytes:
+                self.size -= len(self.responses.popitem(last=False)[1][1])
+
+
+def get_single_parameter(params, name, choices=None):
+    values = params.get(name)
+    if values is None:
+        return None
+    if len(values) > 1:
+        raise ValueError('{0} must be given once'.format(name))
+    if choices is not None and values[0] not in choices:
+        raise ValueError('{0} must be one of {1}'.format(name, ', '.join(choices)))
+    return values[0]
+
+
+def get_date_parameter(params, name):
+    value = get_single_parameter(params, name)
+    if value is not None:
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError('{0} must be a date in YYYY-MM-DD format'.format(name))
+    return value
+
+
+def get_transactions_body(store, params):
+    unknown_parameters = sorted(set(params) - set(QUERY_PARAMETERS))
+    if unknown_parameters:
+        raise ValueError('unknown parameters: {0}'.format(', '.join(unknown_parameters)))
+    response_format = get_single_parameter(params, 'format', RESPONSE_FORMATS) or 'csv'
+    query = store.query_json if response_format == 'json' else store.query_csv
+    body = query(get_date_parameter(params, 'start_date'), get_date_parameter(params, 'end_date'), params.get('stop'),
+                 get_single_parameter(params, 'comuna'), get_single_parameter(params, 'mode', MODES))
+    if response_format == 'json':
+        return 'application/json', body.encode('utf-8')
+    return 'text/csv; charset=utf-8', body.encode('utf-8')
+
+
+def get_response(store, cache, path, params):
+    """
+    Status, content type and body of a GET request. Successful responses are kept in cache.
+    """
+    if path == '/stats':
+        body = dict(dates=len(store.dates), stops=len(store.stops), cache_entries=len(cache.responses),
+                    cache_bytes=cache.size, cache_hits=cache.hits, cache_misses=cache.misses)
+        return 200, 'application/json', json.dumps(body).encode('utf-8')
+    if path not in ['/dates', '/transactions']:
+        return 404, 'text/plain; charset=utf-8', 'unknown path {0}'.format(path).encode('utf-8')
+
+    key = (path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+    response = cache.get(key)
+    if response is None:
+        try:
+            if path == '/dates':
+                response = 'application/json', json.dumps(store.dates).encode('utf-8')
+            else:
+                response = get_transactions_body(store, params)
+        except ValueError as e:
+            return 400, 'text/plain; charset=utf-8', str(e).encode('utf-8')
+        cache.put(key, response)
+    return (200,) + response
+
+
+class StoreRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        status, content_type, body = get_response(self.server.store, self.server.cache, url.path, parse_qs(url.query))
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        # kepler.gl pages served from another origin can load the data
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+class StoreServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # connections of concurrent clients wait to be accepted instead of being retried a second later
+    request_queue_size = 128
+
+    def __init__(self, address, store, cache):
+        super().__init__(address, StoreRequestHandler)
+        self.store = store
+        self.cache = cache
+
+
+def main(argv):
+    """
+    Aggregate the days between start_date and end_date once and answer queries over them from a local http server.
+    """
+    parser = argparse.ArgumentParser(description='serve transactions of a period from a local http server.',
+                                     parents=[process_data.get_days_parser()])
+    parser.add_argument('start_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'),
+                        help='first day in YYYY-MM-DD format')
+    parser.add_argument('end_date', type=lambda s: datetime.strptime(s, '%Y-%m-%d'),
+                        help='last day in YYYY-MM-DD format')
+    parser.add_argument('--host', default='127.0.0.1', help='address the server listens on. Default: 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='port the server listens on. Default: 8000')
+    parser.add_argument('--response-cache', type=int, default=256,
+                        help='number of distinct query responses kept in memory. Default: 256')
+    parser.add_argument('--response-cache-size', type=int, default=256,
+                        help='maximum size of the responses kept in memory in MB, larger responses are not kept. '
+                             'Default: 256')
+    parser.add_argument('--report', help='path of the json run report of the load. Default: outputs/serve.report.json')
+    args = parser.parse_args(argv[1:])
+
+    data_path = process_data.DATA_PATH
+    report = RunReport(start_date=args.start_date.strftime('%Y-%m-%d'), end_date=args.end_date.strftime('%Y-%m-%d'),
+                       workers=args.workers)
+    aws_session = process_data.get_aws_session(args)
+    manifest = DataManifest(data_path)
+
+    with report.stage('listing') as stage:
+        dates_in_range = list_days(aws_session, manifest, args.start_date, args.end_date, args.offline)
+        stage['days'] = len(dates_in_range)
+    if not dates_in_range:
+        logger.error('There is not data between {0} and {1}'.format(args.start_date, args.end_date))
+        exit(1)
+
+    cache = process_data.get_day_cache(args)
+    output, located_stops, stop_modes = load_output(dates_in_range, aws_session, manifest, report, args.workers,
+                                                    args.download_workers, args.prefetch, cache)
+    with report.stage('index') as stage:
+        store = TransactionStore(output, located_stops, stop_modes)
+        stage['stops'] = len(store.stops)
+        stage['dates'] = len(store.dates)
+    del output
+    report.save(args.report or os.path.join(process_data.OUTPUTS_PATH, 'serve.report.json'))
+
+    response_cache = ResponseCache(args.response_cache, args.response_cache_size * 1024 * 1024)
+    server = StoreServer((args.host, args.port), store, response_cache)
+    logger.info('Serving {0} stops of {1} days at http://{2}:{3}/transactions'.format(
+        len(store.stops), len(store.dates), args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,151 @@
+# -*- coding: utf8 -*-
+import json
+import logging
+import math
+import os
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+COMUNAS_FILENAME = 'comunas.geojson'
+LAYERS = ['grid', 'comuna']
+GRID_SHAPES = ['hex', 'square']
+# grid cells are measured in meters around Santiago, where a degree of longitude is shorter than one of latitude
+GRID_REFERENCE_LATITUDE = -33.45
+METERS_PER_DEGREE = 111320
+
+
+def load_comunas(inputs_path):
+    """
+    Read comuna boundaries of comunas.geojson as closed rings with their bounding box.
+    """
+    with open(os.path.join(inputs_path, COMUNAS_FILENAME), encoding='utf-8') as geojson_file:
+        features = json.load(geojson_file)['features']
+    comunas = []
+    for feature in features:
+        # boundaries are stored as LineString, they are used as polygons
+        ring = [tuple(point) for point in feature['geometry']['coordinates']]
+        if ring[0] != ring[-1]:
+            ring.append(ring[0])
+        longitudes, latitudes = zip(*ring)
+        comunas.append(dict(name=feature['properties']['comuna'], ring=ring,
+                            bbox=(min(longitudes), min(latitudes), max(longitudes), max(latitudes)),
+                            center=(sum(longitudes[:-1]) / (len(ring) - 1), sum(latitudes[:-1]) / (len(ring) - 1))))
+    return comunas
+
+
+def is_point_in_ring(longitude, latitude, ring):
+    # ray casting, a point is inside when a ray from it crosses the boundary an odd number of times
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > latitude) != (y2 > latitude) and longitude < (x2 - x1) * (latitude - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+def find_comuna(comunas, longitude, latitude):
+    for comuna in comunas:
+        min_longitude, min_latitude, max_longitude, max_latitude = comuna['bbox']
+        if min_longitude <= longitude <= max_longitude and min_latitude <= latitude <= max_latitude and \
+                is_point_in_ring(longitude, latitude, comuna['ring']):
+            return comuna
+    return None
+
+
+def get_grid_cell(longitude, latitude, cell_size, shape='hex'):
+    """
+    Id and center of the grid cell of a location. cell_size is the side of square cells and the distance between
+    opposite sides of hexagonal cells, in meters.
+    """
+    x_scale = METERS_PER_DEGREE * math.cos(math.radians(GRID_REFERENCE_LATITUDE))
+    x = longitude * x_scale
+    y = latitude * METERS_PER_DEGREE
+    if shape == 'square':
+        column, row = math.floor(x / cell_size), math.floor(y / cell_size)
+        center_x, center_y = (column + 0.5) * cell_size, (row + 0.5) * cell_size
+    else:
+        # pointy top hexagons in axial coordinates, rounded to the nearest hexagon in cube coordinates
+        size = cell_size / math.sqrt(3)
+        q = (math.sqrt(3) / 3 * x - y / 3) / size
+        r = 2 / 3 * y / size
+        s = -q - r
+        column, row, rounded_s = round(q), round(r), round(s)
+        q_diff, r_diff, s_diff = abs(column - q), abs(row - r), abs(rounded_s - s)
+        if q_diff > r_diff and q_diff > s_diff:
+            column = -row - rounded_s
+        elif r_diff > s_diff:
+            row = -column - rounded_s
+        center_x, center_y = size * math.sqrt(3) * (column + row / 2), size * 3 / 2 * row
+    return '{0}{1}_{2}'.format(shape[0], column, row), (center_x / x_scale, center_y / METERS_PER_DEGREE)
+
+
+def get_location(info):
+    # stop info keeps latitude in 'longitude' and longitude in 'latitude', the order of Latitud and Longitud columns
+    return float(info['latitude']), float(info['longitude'])
+
+
+def aggregate_locations(output, get_area, field='dates'):
+    """
+    Sum transactions of stops by the area returned by get_area(info), which is (area id, name, comuna, center) or
+    None for stops outside every area. Areas are returned as stops of an output dict, so they are written like stops.
+    """
+    areas = dict()
+    for stop in output.values():
+        info = stop['info']
+        if 'longitude' not in info or 'latitude' not in info or not stop.get(field):
+            continue
+        area = get_area(info)
+        if area is None:
+            continue
+        area_id, name, comuna, (longitude, latitude) = area
+        if area_id not in areas:
+            areas[area_id] = dict(info=dict(stop_name=name, user_stop_code=0, auth_stop_code=area_id, area=comuna,
+                                            longitude=latitude, latitude=longitude), **{field: defaultdict(int)})
+        areas[area_id]['info']['user_stop_code'] += 1
+        for key, transactions in stop[field].items():
+            areas[area_id][field][key] += transactions
+    for area in areas.values():
+        # number of stops of the area is shown where stops show their user code
+        area['info']['user_stop_code'] = 'Paraderos: {0}'.format(area['info']['user_stop_code'])
+    return areas
+
+
+def aggregate_by_grid(output, cell_size, shape='hex', field='dates'):
+    def get_area(info):
+        cell_id, center = get_grid_cell(*get_location(info), cell_size=cell_size, shape=shape)
+        # a cell can have stops of many comunas
+        return cell_id, 'Celda {0}'.format(cell_id), '-', center
+
+    return aggregate_locations(output, get_area, field)
+
+
+def aggregate_by_comuna(output, comunas, field='dates'):
+    # comuna of each location is found once, stops of a metro station with many lines share it
+    location_comunas = dict()
+
+    def get_area(info):
+        location = get_location(info)
+        if location not in location_comunas:
+            location_comunas[location] = find_comuna(comunas, *location)
+        comuna = location_comunas[location]
+        if comuna is None:
+            return None
+        return comuna['name'], comuna['name'], comuna['name'], comuna['center']
+
+    return aggregate_locations(output, get_area, field)
+
+
+def get_layers(output, layers, inputs_path, cell_size=1000, shape='hex', field='dates'):
+    """
+    Aggregated outputs shown as coarse layers of the visualization, as (layer id, label, output) tuples.
+    """
+    layer_outputs = []
+    for layer in layers:
+        if layer == 'grid':
+            label = 'Subidas por celda ({0} m)'.format(cell_size)
+            layer_outputs.append(('grid', label, aggregate_by_grid(output, cell_size, shape, field)))
+        else:
+            comunas = load_comunas(inputs_path)
+            layer_outputs.append(('comuna', 'Subidas por comuna', aggregate_by_comuna(output, comunas, field)))
+        logger.info('{0} layer has {1} areas'.format(layer, len(layer_outputs[-1][2])))
+    return layer_outputs
@@ -0,0 +1,98 @@
+# -*- coding: utf8 -*-
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+
+from instrumentation import add_counters
+from reference_data import load_metro_locations, load_metrotren_locations
+
+logger = logging.getLogger(__name__)
+
+METRO_MODE = 'METRO'
+# Modo of transaction rows of metrotren stations
+METROTREN_MODES = ['METROTREN', 'TREN']
+STATION_PREFIX = 'ESTACION '
+
+
+def normalize_station_name(name):
+    """
+    Station name without accents, case, punctuation and "Estación" prefix, e.g. "Estación Ñuble" is "NUBLE".
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').upper()
+    name = ' '.join(re.sub('[^A-Z0-9]+', ' ', name).split())
+    if name.startswith(STATION_PREFIX):
+        name = name[len(STATION_PREFIX):]
+    return name
+
+
+def get_metro_key(name, line):
+    # normalized name, without the line when it ends with it, and line
+    name = normalize_station_name(name)
+    line = normalize_station_name(line)
+    if name.endswith(' ' + line):
+        name = name[:-len(line) - 1]
+    return name, line
+
+
+class StationIndex:
+    """
+    Metro stations by normalized name and line and metrotren stations by normalized name, built once from the
+    reference data. Station ids are the keys of metro and metrotren locations, so resolved transactions are located
+    by the enrichment, and every distinct station of the transaction files is resolved with a single lookup.
+    """
+
+    def __init__(self, metro_locations, metrotren_locations):
+        self.metro = dict()
+        for station, location in metro_locations.items():
+            # metro.csv names a station by its unique name and by its transaction code, e.g. TOBALABA_L4
+            for name in (location['station_name'], location['transaction_code']):
+                self.metro.setdefault(get_metro_key(name, location['line']), station)
+        self.metrotren = dict((normalize_station_name(station), station) for station in metrotren_locations)
+        self.metrotren_ids = set(self.metrotren.values())
+        self.station_ids = set(self.metro.values()) | self.metrotren_ids
+        content = json.dumps([sorted(self.metro.items()), sorted(self.metrotren.items())])
+        self.signature = hashlib.md5(content.encode('utf-8')).hexdigest()[:8]
+        self.resolved = dict()
+
+    def resolve(self, mode, code, line):
+        """
+        Station id of a transaction row of mode (Modo), code (CodigoTS) and line (Linea), or None when it is not a
+        station or it is not in the reference data.
+        """
+        key = (mode, code, line)
+        station = self.resolved.get(key, False)
+        if station is False:
+            station = None
+            if mode == METRO_MODE:
+                station = self.metro.get(get_metro_key(code, line))
+            elif mode in METROTREN_MODES:
+                station = self.metrotren.get(normalize_station_name(code))
+            self.resolved[key] = station
+        return station
+
+    def get_unmatched(self, stations):
+        return sorted(set(stations) - self.station_ids)
+
+
+def split_stations(metro_stations, stations=None, stats=None):
+    """
+    Metrotren stations of the stations seen in transactions, which are removed from metro_stations. Stations that are
+    not in the reference data are reported, they are kept in metro_stations but they do not have a location.
+    """
+    if stations is None:
+        return []
+    metrotren_stations = sorted(metro_stations & stations.metrotren_ids)
+    metro_stations.difference_update(metrotren_stations)
+    unmatched_stations = stations.get_unmatched(metro_stations)
+    if unmatched_stations:
+        logger.warning('{0} stations are not in metro.csv or metrotren.geojson: {1}'.format(
+            len(unmatched_stations), ', '.join(unmatched_stations)))
+    add_counters(stats, metrotren_stations=len(metrotren_stations), stations_unmatched=len(unmatched_stations))
+    return metrotren_stations
+
+
+def load_station_index(inputs_path, reference_path=None):
+    return StationIndex(load_metro_locations(inputs_path, reference_path),
+                        load_metrotren_locations(inputs_path, reference_path))
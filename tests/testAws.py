@@ -1,3 +1,9 @@
+import hashlib
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
 import aws
 import mock
@@ -5,6 +11,33 @@ import datetime
 from botocore.exceptions import ClientError
 
 
+class FakeS3Client:
+    """
+    Stand-in for boto3 s3 client, it fails the first `failures` downloads of every key
+    """
+
+    def __init__(self, objects, failures=0):
+        self.objects = objects
+        self.failures = failures
+        self.calls = []
+
+    def head_object(self, Bucket, Key):
+        return {'ETag': '"{0}"'.format(hashlib.md5(self.objects[Key]).hexdigest()),
+                'ContentLength': len(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        self.calls.append((Key, Range))
+        if Key not in self.objects:
+            raise ClientError(error_response={'Error': {'Code': '404'}}, operation_name='GetObject')
+        if IfMatch != self.head_object(Bucket, Key)['ETag']:
+            raise ClientError(error_response={'Error': {'Code': 'PreconditionFailed'}}, operation_name='GetObject')
+        body = io.BytesIO(self.objects[Key][int(Range[len('bytes='):-1]):])
+        if len(self.calls) <= self.failures:
+            # connection is reset after the first byte
+            body = mock.Mock(read=mock.Mock(side_effect=[body.read(1), OSError('connection reset')]))
+        return {'Body': body}
+
+
 class AwsTest(TestCase):
 
     @mock.patch('aws.boto3.Session')
@@ -21,6 +54,17 @@ class AwsTest(TestCase):
         expected_date = [datetime.datetime(2020, 5, 8, 0, 0)]
         self.assertEqual(expected_date, self.aws_session.get_available_dates())
 
+    def test_get_available_days_in_window(self):
+        keys = ['2020-05-08.transaction.gz', 'index.html', '2020-05-09.transaction.gz', '2020-05-10.transaction.gz']
+        objects = [mock.Mock(key=key) for key in keys]
+        bucket = mock.MagicMock(objects=mock.MagicMock(filter=mock.Mock(return_value=objects)))
+        bucket.Bucket.return_value = bucket
+        self.aws_session.session.resource = mock.MagicMock(return_value=bucket)
+        expected_date = [datetime.datetime(2020, 5, 8, 0, 0), datetime.datetime(2020, 5, 9, 0, 0)]
+        self.assertEqual(expected_date, self.aws_session.get_available_dates(datetime.datetime(2020, 5, 8),
+                                                                             datetime.datetime(2020, 5, 9)))
+        bucket.objects.filter.assert_called_once_with(Marker='2020-05-08')
+
     def test_check_bucket_exists_true(self):
         bucket = mock.MagicMock(
             meta=mock.MagicMock(client=mock.MagicMock(head_bucket=mock.MagicMock(return_value=True))))
@@ -80,3 +124,50 @@ class AwsTest(TestCase):
         bucket.Bucket.return_value = bucket
         self.aws_session.session.resource = mock.MagicMock(return_value=bucket)
         self.aws_session.download_object_from_bucket('2020-05-08.transaction.gz', '')
+
+    def test_get_client_is_reused(self):
+        self.assertIs(self.aws_session.get_client(), self.aws_session.get_client())
+        self.aws_session.session.client.assert_called_once()
+
+    def test_get_client_is_created_once_by_threads(self):
+        # a slow client creation lets every thread see that there is no client yet
+        self.aws_session.session.client.side_effect = lambda *args, **kwargs: time.sleep(0.05) or mock.Mock()
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            clients = list(executor.map(lambda _: self.aws_session.get_client(), range(5)))
+        self.assertEqual(1, len(set(map(id, clients))))
+        self.aws_session.session.client.assert_called_once()
+
+    def test_download_object_resumable(self):
+        key = '2020-05-08.transaction.gz'
+        self.aws_session.client = FakeS3Client({key: b'content'}, failures=1)
+        object_info = self.aws_session.get_object_info(key)
+        with tempfile.TemporaryDirectory() as data_path:
+            file_path = os.path.join(data_path, key)
+            self.aws_session.download_object_resumable(key, file_path, object_info, retry_delay=0)
+            with open(file_path, 'rb') as file_obj:
+                self.assertEqual(b'content', file_obj.read())
+            # the second request only asks for bytes after the one written by the first
+            self.assertEqual([(key, 'bytes=0-'), (key, 'bytes=1-')], self.aws_session.client.calls)
+            self.assertEqual([key], os.listdir(data_path))
+
+            # bytes left by a run that was killed are kept, bytes of another version of the object are discarded
+            with open(file_path + '.part', 'wb') as file_obj:
+                file_obj.write(b'cont')
+            self.aws_session.client = FakeS3Client({key: b'content'})
+            self.aws_session.download_object_resumable(key, file_path, object_info, retry_delay=0)
+            self.assertEqual([(key, 'bytes=4-')], self.aws_session.client.calls)
+            with open(file_path + '.part', 'wb') as file_obj:
+                file_obj.write(b'old')
+            with self.assertRaises(ClientError):
+                self.aws_session.download_object_resumable(key, file_path, dict(object_info, etag='old'),
+                                                           retries=1, retry_delay=0)
+            self.assertEqual([key], os.listdir(data_path))
+
+    def test_download_object_resumable_404_error(self):
+        self.aws_session.client = FakeS3Client({})
+        with tempfile.TemporaryDirectory() as data_path:
+            file_path = os.path.join(data_path, '2020-05-08.transaction.gz')
+            with self.assertRaises(ValueError):
+                self.aws_session.download_object_resumable('2020-05-08.transaction.gz', file_path,
+                                                           dict(etag='etag', size=1), retry_delay=0)
+            self.assertEqual(1, len(self.aws_session.client.calls))
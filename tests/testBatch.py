@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+import logging
+import batch
+import process_data
+
+
+class BatchTest(TestCase):
+
+    def setUp(self):
+        self.files_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'files')
+        self.tmp_path = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.tmp_path, 'data')
+        self.outputs_path = os.path.join(self.tmp_path, 'outputs')
+        os.makedirs(self.data_path)
+        os.makedirs(self.outputs_path)
+        for filename in ['2020-05-08.4daytransactionbystop.gz', '2020-05-09.4daytransactionbystop.gz']:
+            shutil.copy(os.path.join(self.files_path, filename), self.data_path)
+        self.job_path = os.path.join(self.tmp_path, 'jobs.json')
+        logging.disable(logging.CRITICAL)
+
+    def write_jobs(self, jobs):
+        with open(self.job_path, 'w') as job_file:
+            json.dump(jobs, job_file)
+
+    def patch_paths(self):
+        return mock.patch.multiple(process_data, DATA_PATH=self.data_path, INPUTS_PATH=self.files_path,
+                                   TEMPLATE_PATH=self.files_path, OUTPUTS_PATH=self.outputs_path,
+                                   config=lambda name: 'key')
+
+    def read_output(self, output_filename):
+        with open(os.path.join(self.outputs_path, '{0}.csv'.format(output_filename)), 'rb') as csv_file:
+            # rows are in the order stops were found, which depends on the days that were read
+            header, *rows = csv_file.read().splitlines()
+            return header, sorted(rows)
+
+    def test_load_jobs(self):
+        self.write_jobs([dict(start_date='2020-05-08', end_date='2020-05-09', output_filename='a', mode='metro')])
+        jobs = batch.load_jobs(self.job_path)
+        self.assertEqual(1, len(jobs))
+        self.assertEqual('metro', jobs[0]['mode'])
+
+        self.write_jobs([dict(start_date='2020-05-08', output_filename='a')])
+        self.assertRaises(ValueError, batch.load_jobs, self.job_path)
+        self.write_jobs([dict(start_date='2020-05-08', end_date='2020-05-09', output_filename='a', mode='boat')])
+        self.assertRaises(ValueError, batch.load_jobs, self.job_path)
+        self.write_jobs([dict(start_date='2020-05-08', end_date='2020-05-08', output_filename='a'),
+                         dict(start_date='2020-05-09', end_date='2020-05-09', output_filename='a')])
+        self.assertRaises(ValueError, batch.load_jobs, self.job_path)
+
+    def test_slice_output(self):
+        output = {
+            'PA1': dict(info=dict(area='Santiago'), dates={'2020-05-08': 3, '2020-05-09': 4}),
+            'PA2': dict(info=dict(area='Maipu'), dates={'2020-05-09': 1}),
+            'PA3': dict(info=dict(area='Maipu'), dates={'2020-05-09': 2}),
+        }
+        sliced_output = batch.slice_output(output, ['2020-05-08'], {'PA2'})
+        self.assertEqual({'2020-05-08': 3}, sliced_output['PA1']['dates'])
+        self.assertEqual({'2020-05-08': 0}, sliced_output['PA2']['dates'])
+        self.assertNotIn('PA3', sliced_output)
+
+        sliced_output = batch.slice_output(output, ['2020-05-09'], set(), comuna='maipu')
+        self.assertEqual(['PA2', 'PA3'], sorted(sliced_output))
+
+        sliced_output = batch.slice_output(output, ['2020-05-09'], set(), mode='metro', stop_modes={'PA3': 'metro'})
+        self.assertEqual(['PA3'], list(sliced_output))
+
+    def test_main_matches_single_runs(self):
+        self.write_jobs([dict(start_date='2020-05-08', end_date='2020-05-08', output_filename='first'),
+                         dict(start_date='2020-05-08', end_date='2020-05-09', output_filename='both'),
+                         dict(start_date='2020-06-01', end_date='2020-06-02', output_filename='empty')])
+        with self.patch_paths():
+            batch.main(['batch', self.job_path, '--offline', '--no-cache'])
+            for output_filename, end_date in [('first', '2020-05-08'), ('both', '2020-05-09')]:
+                process_data.main(['process_data', '2020-05-08', end_date, 'single_' + output_filename, '--offline',
+                                   '--no-cache', '--quiet'])
+                self.assertEqual(self.read_output('single_' + output_filename), self.read_output(output_filename))
+                self.assertTrue(os.path.exists(os.path.join(self.outputs_path, output_filename + '.html')))
+
+        self.assertFalse(os.path.exists(os.path.join(self.outputs_path, 'empty.csv')))
+        with open(os.path.join(self.outputs_path, 'jobs.report.json')) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(2, [stage for stage in report['stages'] if stage['name'] == 'render'][0]['outputs'])
+
+    def test_main_without_days(self):
+        self.write_jobs([dict(start_date='2020-06-01', end_date='2020-06-02', output_filename='empty')])
+        with self.patch_paths():
+            with self.assertRaises(SystemExit) as cm:
+                batch.main(['batch', self.job_path, '--offline'])
+        self.assertEqual(1, cm.exception.code)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
@@ -0,0 +1,90 @@
+import gzip
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+import logging
+import columnar
+import process_data
+import stations
+
+
+class ColumnarTest(TestCase):
+
+    def setUp(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.data_path = os.path.join(dir_path, 'files')
+        self.available_files = [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz'),
+                                os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')]
+        logging.disable(logging.CRITICAL)
+
+    def test_get_output_columnar(self):
+        output, metro_stations, metrotren_stations = process_data.get_output_dict(self.available_files)
+        columnar_output, columnar_metro_stations, columnar_metrotren_stations = columnar.get_output_columnar(
+            self.available_files)
+        self.assertEqual(output, columnar_output)
+        self.assertEqual(metro_stations, columnar_metro_stations)
+        self.assertEqual(metrotren_stations, columnar_metrotren_stations)
+
+    def test_get_output_columnar_stations(self):
+        rows = ['Fecha;TipoDia;CodigoTS;CodigoUsuario;Comuna;Nombre;Modo;Linea;Periodo;MediaHora;Subidas',
+                '2020-05-09;SABADO;TOBALABA_L4;-;PROVIDENCIA;-;METRO;L4;04 - PUNTA;07:00:00;5',
+                '2020-05-09;SABADO;Nos;-;SAN BERNARDO;-;METROTREN;MT;04 - PUNTA;07:00:00;4',
+                '2020-05-09;SABADO;NUEVA;-;SANTIAGO;-;METRO;L9;04 - PUNTA;07:00:00;1']
+        station_index = stations.load_station_index(self.data_path)
+        with tempfile.TemporaryDirectory() as data_path:
+            file_path = os.path.join(data_path, '2020-05-09.4daytransactionbystop.gz')
+            with gzip.open(file_path, 'wt', encoding='latin-1') as file_obj:
+                file_obj.write('\n'.join(rows) + '\n')
+            output, metro_stations, metrotren_stations = process_data.get_output_dict([file_path],
+                                                                                      stations=station_index)
+            columnar_output, columnar_metro_stations, columnar_metrotren_stations = columnar.get_output_columnar(
+                [file_path], stations=station_index)
+        self.assertEqual(output, columnar_output)
+        self.assertEqual({'TOBALABAL4', 'NUEVAL9'}, columnar_metro_stations)
+        self.assertEqual(metro_stations, columnar_metro_stations)
+        self.assertEqual(['Estacion Nos'], columnar_metrotren_stations)
+        self.assertEqual(metrotren_stations, columnar_metrotren_stations)
+
+    def test_get_output_columnar_renamed_stop(self):
+        # info of the last row of a stop wins with both engines
+        header = 'Fecha;TipoDia;CodigoTS;CodigoUsuario;Comuna;Nombre;Modo;Linea;Periodo;MediaHora;Subidas'
+        rows = [['2020-05-08;VIERNES;T-1;PA1;MAIPU;Old name;BUS;101;04 - PUNTA;07:00:00;3'],
+                ['2020-05-09;SABADO;T-1;PA2;SANTIAGO;New name;BUS;101;04 - PUNTA;07:00:00;5',
+                 '2020-05-09;SABADO;T-2;-;SANTIAGO;-;BUS;101;04 - PUNTA;07:00:00;1']]
+        with tempfile.TemporaryDirectory() as data_path:
+            files = []
+            for day, day_rows in zip(['2020-05-08', '2020-05-09'], rows):
+                file_path = os.path.join(data_path, '{0}.4daytransactionbystop.gz'.format(day))
+                with gzip.open(file_path, 'wt', encoding='latin-1') as file_obj:
+                    file_obj.write('\n'.join([header] + day_rows) + '\n')
+                files.append(file_path)
+            output = process_data.get_output_dict(files)[0]
+            columnar_output = columnar.get_output_columnar(files)[0]
+        self.assertEqual(dict(stop_name='New name', user_stop_code='PA2', auth_stop_code='T-1', area='Santiago'),
+                         dict(columnar_output['T-1']['info']))
+        self.assertEqual(output, columnar_output)
+
+    def test_missing_stop_is_created(self):
+        output = columnar.ColumnarOutput(stop_capacity=1, date_capacity=1)
+        self.assertNotIn('T-17-140-OP-80', output)
+        self.assertEqual({}, output['T-17-140-OP-80']['dates'])
+        output['T-17-140-OP-80']['dates']['2020-05-08'] = 0
+        output['PA1']['dates']['2020-05-09'] = 5
+        output['PA1']['info']['area'] = 'Santiago'
+        self.assertEqual({'2020-05-08': 0}, output['T-17-140-OP-80']['dates'])
+        self.assertEqual({'2020-05-09': 5}, output['PA1']['dates'])
+        self.assertEqual({'area': 'Santiago'}, output['PA1']['info'])
+        self.assertEqual(['T-17-140-OP-80', 'PA1'], list(output))
+
+    def test_enrichment_and_csv_with_columnar_output(self):
+        dates_in_range = [datetime(2020, 5, 8), datetime(2020, 5, 9)]
+        expected_output, metro_stations, _ = process_data.get_output_dict(self.available_files)
+        output, _, _ = columnar.get_output_columnar(self.available_files)
+        for enriched in (expected_output, output):
+            process_data.add_location_to_stop_data(self.data_path, enriched, dates_in_range)
+            process_data.add_location_to_metro_station_data(self.data_path, enriched, metro_stations, dates_in_range)
+            process_data.add_location_to_metrotren_station_data(self.data_path, enriched, dates_in_range)
+        self.assertEqual(expected_output, output)
+        self.assertEqual(list(process_data.iter_csv_rows(expected_output)), list(process_data.iter_csv_rows(output)))
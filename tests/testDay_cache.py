@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import logging
+import day_cache
+
+
+class DayCacheTest(TestCase):
+
+    def setUp(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.tmp_path = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tmp_path, 'cache')
+        self.file_path = os.path.join(self.tmp_path, '2020-05-09.4daytransactionbystop.gz')
+        shutil.copy(os.path.join(dir_path, 'files', '2020-05-09.4daytransactionbystop.gz'), self.file_path)
+        self.partial = ({'T-17-140-OP-80': {'info': {'area': 'Las Condes'}, 'dates': {'2020-05-09': 3}}},
+                        {'TOBALABAL4'})
+        logging.disable(logging.CRITICAL)
+
+    def test_get_missing_entry(self):
+        cache = day_cache.DayAggregateCache(self.cache_path)
+        self.assertFalse(cache.contains(self.file_path))
+        self.assertIsNone(cache.get(self.file_path))
+
+    def test_put_and_get(self):
+        day_cache.DayAggregateCache(self.cache_path).put(self.file_path, self.partial)
+        cache = day_cache.DayAggregateCache(self.cache_path)
+        self.assertTrue(cache.contains(self.file_path))
+        self.assertEqual(self.partial, cache.get(self.file_path))
+
+    def test_changed_file_is_not_reused(self):
+        day_cache.DayAggregateCache(self.cache_path).put(self.file_path, self.partial)
+        with open(self.file_path, 'ab') as file_obj:
+            file_obj.write(b'changed')
+        cache = day_cache.DayAggregateCache(self.cache_path)
+        self.assertFalse(cache.contains(self.file_path))
+        cache.put(self.file_path, self.partial)
+        self.assertEqual(1, len(cache.entries()))
+
+    def test_variants(self):
+        cache = day_cache.DayAggregateCache(self.cache_path)
+        cache.put(self.file_path, self.partial, 'a1b2c3d4')
+        self.assertFalse(cache.contains(self.file_path))
+        self.assertEqual(self.partial, cache.get(self.file_path, 'a1b2c3d4'))
+        # an entry replaces entries of other variants of the same file
+        cache.put(self.file_path, self.partial)
+        self.assertFalse(cache.contains(self.file_path, 'a1b2c3d4'))
+        self.assertEqual(1, len(cache.entries()))
+
+    def test_evict_least_recently_used(self):
+        cache = day_cache.DayAggregateCache(self.cache_path)
+        other_path = os.path.join(self.tmp_path, '2020-05-10.4daytransactionbystop.gz')
+        shutil.copy(self.file_path, other_path)
+        cache.put(self.file_path, self.partial)
+        cache.put(other_path, self.partial)
+        old_time = time.time() - 60
+        os.utime(cache.get_entry_path(other_path), (old_time, old_time))
+        cache.max_size = cache.entries()[-1][1]
+        cache.evict()
+        self.assertTrue(cache.contains(self.file_path))
+        self.assertFalse(cache.contains(other_path))
+
+    def test_main(self):
+        cache = day_cache.DayAggregateCache(self.cache_path)
+        cache.put(self.file_path, self.partial)
+        day_cache.main(['day_cache', 'info', '--cache-path', self.cache_path])
+        day_cache.main(['day_cache', 'purge', '--cache-path', self.cache_path])
+        self.assertEqual([], cache.entries())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import logging
+import instrumentation
+
+
+class InstrumentationTest(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        logging.disable(logging.CRITICAL)
+
+    def test_add_counters(self):
+        counters = dict(rows_parsed=2)
+        instrumentation.add_counters(counters, rows_parsed=3, rows_skipped=1)
+        self.assertEqual(dict(rows_parsed=5, rows_skipped=1), counters)
+        instrumentation.add_counters(None, rows_parsed=3)
+
+    def test_get_path_size(self):
+        dataset_path = os.path.join(self.tmp_path, 'dataset')
+        os.makedirs(os.path.join(dataset_path, 'Fecha=2020-05-08'))
+        for name in ['part.csv', os.path.join('dataset', 'Fecha=2020-05-08', 'part-0.parquet')]:
+            with open(os.path.join(self.tmp_path, name), 'w') as file_obj:
+                file_obj.write('12345')
+        self.assertEqual(5, instrumentation.get_path_size(os.path.join(self.tmp_path, 'part.csv')))
+        self.assertEqual(5, instrumentation.get_path_size(dataset_path))
+        self.assertEqual(0, instrumentation.get_path_size(os.path.join(self.tmp_path, 'missing.csv')))
+
+    def test_run_report(self):
+        report = instrumentation.RunReport(output_filename='output')
+        with report.stage('aggregation') as stage:
+            stage['rows_parsed'] = 10
+        with self.assertRaises(ValueError):
+            with report.stage('html'):
+                raise ValueError()
+        report_path = os.path.join(self.tmp_path, 'output.report.json')
+        report.save(report_path)
+
+        with open(report_path) as report_file:
+            saved_report = json.load(report_file)
+        self.assertEqual(dict(output_filename='output'), saved_report['run'])
+        self.assertEqual(['aggregation', 'html'], [stage['name'] for stage in saved_report['stages']])
+        self.assertEqual(10, saved_report['stages'][0]['rows_parsed'])
+        for stage in saved_report['stages']:
+            self.assertGreaterEqual(stage['wall_time'], 0)
+            self.assertGreaterEqual(stage['cpu_time'], 0)
+        self.assertGreater(saved_report['peak_rss_mb'], 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+import logging
+import manifest
+
+
+class ManifestTest(TestCase):
+
+    def setUp(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.data_path = tempfile.mkdtemp()
+        for filename in ['2020-05-08.4daytransactionbystop.gz', '2020-05-09.4daytransactionbystop.gz']:
+            shutil.copy(os.path.join(dir_path, 'files', filename), self.data_path)
+        self.file_path = os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz')
+        logging.disable(logging.CRITICAL)
+
+    def test_add_and_save(self):
+        data_manifest = manifest.DataManifest(self.data_path)
+        data_manifest.add(self.file_path, 'etag')
+        data_manifest.save()
+
+        entry = manifest.DataManifest(self.data_path).entries['2020-05-08']
+        with open(self.file_path, 'rb') as file_obj:
+            self.assertEqual(hashlib.md5(file_obj.read()).hexdigest(), entry['md5'])
+        self.assertEqual(os.path.getsize(self.file_path), entry['size'])
+        self.assertEqual('etag', entry['etag'])
+        self.assertEqual('2020-05-08.4daytransactionbystop.gz', entry['filename'])
+
+    def test_refresh(self):
+        with open(os.path.join(self.data_path, 'available_dates.json'), 'w') as file_obj:
+            file_obj.write('{}')
+        data_manifest = manifest.DataManifest(self.data_path)
+        data_manifest.refresh()
+        self.assertEqual(['2020-05-08', '2020-05-09'], sorted(data_manifest.entries))
+        self.assertEqual([datetime(2020, 5, 9)], data_manifest.get_available_dates(datetime(2020, 5, 9)))
+
+        os.remove(os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz'))
+        data_manifest.refresh()
+        self.assertEqual([datetime(2020, 5, 8)], data_manifest.get_available_dates())
+
+    def test_index_keeps_source_of_touched_files(self):
+        data_manifest = manifest.DataManifest(self.data_path)
+        data_manifest.add(self.file_path, 'etag')
+        data_manifest.changed = False
+        self.assertEqual('etag', data_manifest.index(self.file_path)['etag'])
+        self.assertFalse(data_manifest.changed)
+
+        os.utime(self.file_path, ns=(0, 0))
+        self.assertFalse(data_manifest.is_current(self.file_path))
+        self.assertEqual('etag', data_manifest.index(self.file_path)['etag'])
+
+        with open(self.file_path, 'ab') as file_obj:
+            file_obj.write(b'changed')
+        self.assertIsNone(data_manifest.index(self.file_path)['etag'])
+
+    def test_verify(self):
+        data_manifest = manifest.DataManifest(self.data_path)
+        object_info = dict(etag=manifest.get_file_checksum(self.file_path), size=os.path.getsize(self.file_path))
+        self.assertFalse(data_manifest.is_verified(self.file_path))
+        self.assertFalse(data_manifest.verify(self.file_path, dict(object_info, size=1)))
+        self.assertFalse(data_manifest.is_verified(self.file_path))
+        self.assertTrue(data_manifest.verify(self.file_path, object_info))
+        self.assertTrue(data_manifest.is_verified(self.file_path))
+        # ETags of multipart uploads only have their size checked
+        self.assertTrue(data_manifest.verify(self.file_path, dict(object_info, etag='abc-2')))
+
+        with open(self.file_path, 'ab') as file_obj:
+            file_obj.write(b'changed')
+        self.assertFalse(data_manifest.is_verified(self.file_path))
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
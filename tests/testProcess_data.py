@@ -1,12 +1,23 @@
+import base64
 import filecmp
+import gzip
+import json
 import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from unittest import TestCase
 
 import mock
 import logging
 import process_data
+from day_cache import DayAggregateCache
+from manifest import DataManifest, get_file_checksum
 
 
 class ProcessDataTest(TestCase):
@@ -19,7 +30,7 @@ class ProcessDataTest(TestCase):
         logging.disable(logging.CRITICAL)
 
 
-    @mock.patch('process_data.AWSSession')
+    @mock.patch('process_data.LazyAWSSession')
     def test_check_available_days(self, aws_session):
         aws_session.get_available_dates.return_value = [datetime.strptime('2019-02-05', "%Y-%m-%d"),
                                                         datetime.strptime('2020-02-05', "%Y-%m-%d"),
@@ -29,18 +40,141 @@ class ProcessDataTest(TestCase):
         available_days = process_data.check_available_days(aws_session, start_date, end_date)
         self.assertEqual(datetime.strptime('2020-02-05', "%Y-%m-%d"), available_days[0])
 
-    @mock.patch('process_data.AWSSession')
+    @mock.patch('process_data.LazyAWSSession')
+    def test_check_available_days_with_index(self, aws_session):
+        aws_session.get_available_dates.return_value = [datetime.strptime('2020-02-05', "%Y-%m-%d"),
+                                                        datetime.strptime('2020-02-07', "%Y-%m-%d")]
+        start_date = datetime.strptime('2020-02-01', "%Y-%m-%d")
+        end_date = datetime.strptime('2020-02-28', "%Y-%m-%d")
+        with tempfile.TemporaryDirectory() as index_dir:
+            index_path = os.path.join(index_dir, 'available_dates.json')
+            available_days = process_data.check_available_days(aws_session, start_date, end_date, index_path)
+            aws_session.get_available_dates.assert_called_once_with(start_date, end_date)
+
+            # a window inside a fresh listing is answered from the index
+            cached_days = process_data.check_available_days(aws_session, datetime.strptime('2020-02-06', "%Y-%m-%d"),
+                                                            end_date, index_path)
+            self.assertEqual(1, aws_session.get_available_dates.call_count)
+            self.assertEqual(available_days[1:], cached_days)
+
+            # an expired listing is requested again
+            process_data.check_available_days(aws_session, start_date, end_date, index_path, ttl=0)
+            self.assertEqual(2, aws_session.get_available_dates.call_count)
+
+    def test_lazy_aws_session(self):
+        with mock.patch('aws.AWSSession') as aws_session:
+            session = process_data.LazyAWSSession(max_pool_connections=4)
+            aws_session.assert_not_called()
+            session.get_available_dates(None, None)
+            session.get_object_info('2020-05-08.4daytransactionbystop.gz')
+            aws_session.assert_called_once_with(max_pool_connections=4)
+            aws_session.return_value.get_available_dates.assert_called_once_with(None, None)
+
+    def test_lazy_aws_session_is_created_once_by_threads(self):
+        # a slow session creation lets every thread see that there is no session yet
+        with mock.patch('aws.AWSSession', side_effect=lambda **kwargs: time.sleep(0.05) or mock.Mock()) as aws_session:
+            session = process_data.LazyAWSSession()
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                list(executor.map(lambda key: session.get_object_info(key), range(5)))
+        aws_session.assert_called_once_with(max_pool_connections=10)
+
+    def test_iter_available_files_creates_lazy_session(self):
+        # the session is created before files are checked in download threads
+        aws_session = process_data.LazyAWSSession()
+        threads = []
+        with tempfile.TemporaryDirectory() as data_path, \
+                mock.patch('aws.AWSSession', side_effect=lambda **kwargs: threads.append(threading.current_thread())), \
+                mock.patch('process_data.fetch_verified_file', return_value=False):
+            list(process_data.iter_available_files([datetime(2020, 5, 8)], aws_session, data_path,
+                                                   manifest=DataManifest(data_path)))
+        self.assertEqual([threading.main_thread()], threads)
+
+    def test_config(self):
+        with mock.patch.dict(os.environ, MAPBOX_KEY='environment key'):
+            self.assertEqual('environment key', process_data.config('MAPBOX_KEY'))
+
+    @mock.patch('process_data.LazyAWSSession')
     def test_get_available_files_exist(self, aw_session):
         dates_in_range = [datetime.strptime('2020-05-08', "%Y-%m-%d")]
         correct_path = [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz')]
         self.assertEqual(correct_path, process_data.get_available_files(dates_in_range, aw_session, self.data_path))
 
-    @mock.patch('process_data.AWSSession')
+    def test_get_available_files_with_manifest(self):
+        dates_in_range = [datetime.strptime('2020-05-08', "%Y-%m-%d"), datetime.strptime('2020-05-09', "%Y-%m-%d")]
+        aws_session = mock.MagicMock()
+        aws_session.get_object_info.side_effect = lambda key: dict(
+            etag=get_file_checksum(os.path.join(self.data_path, key)),
+            size=os.path.getsize(os.path.join(self.data_path, key)))
+        aws_session.download_object_resumable.side_effect = lambda key, file_path, object_info: shutil.copy(
+            os.path.join(self.data_path, key), file_path)
+        with tempfile.TemporaryDirectory() as data_path:
+            shutil.copy(os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz'), data_path)
+            with self.assertRaises(ValueError):
+                process_data.get_available_files(dates_in_range, None, data_path)
+
+            # a truncated file left by a killed run is downloaded again
+            with open(os.path.join(data_path, '2020-05-09.4daytransactionbystop.gz'), 'wb') as file_obj:
+                file_obj.write(b'\x1f\x8b')
+            stats = dict()
+            process_data.get_available_files(dates_in_range, aws_session, data_path, stats=stats,
+                                             manifest=DataManifest(data_path))
+            aws_session.download_object_resumable.assert_called_once_with(
+                '2020-05-09.4daytransactionbystop.gz', os.path.join(data_path, '2020-05-09.4daytransactionbystop.gz'),
+                aws_session.get_object_info('2020-05-09.4daytransactionbystop.gz'))
+            self.assertEqual(1, stats['files_downloaded'])
+            self.assertEqual(1, stats['files_verified'])
+            entries = DataManifest(data_path).entries
+            self.assertEqual(['2020-05-08', '2020-05-09'], sorted(entries))
+            for entry in entries.values():
+                self.assertEqual(entry['md5'], entry['etag'])
+
+            # verified files are not checked again
+            aws_session.get_object_info.reset_mock()
+            process_data.get_available_files(dates_in_range, aws_session, data_path, manifest=DataManifest(data_path))
+            aws_session.get_object_info.assert_not_called()
+
+    def test_get_available_files_does_not_match(self):
+        aws_session = mock.MagicMock()
+        aws_session.get_object_info.return_value = dict(etag='etag', size=1)
+        with tempfile.TemporaryDirectory() as data_path:
+            aws_session.download_object_resumable.side_effect = lambda key, file_path, object_info: shutil.copy(
+                os.path.join(self.data_path, key), file_path)
+            with self.assertRaises(ValueError):
+                process_data.get_available_files([datetime(2020, 5, 8)], aws_session, data_path,
+                                                 manifest=DataManifest(data_path))
+            self.assertEqual(process_data.DOWNLOAD_ATTEMPTS, aws_session.download_object_resumable.call_count)
+
+    def test_iter_available_files_prefetch(self):
+        dates_in_range = [datetime(2020, 5, day) for day in range(1, 9)]
+        fetched = []
+
+        def fetch_verified_file(aws_session, manifest, key, file_path):
+            fetched.append(key)
+            return True
+
+        stats = dict()
+        with tempfile.TemporaryDirectory() as data_path, \
+                mock.patch('process_data.fetch_verified_file', side_effect=fetch_verified_file), \
+                mock.patch('process_data.get_path_size', return_value=1):
+            available_files = process_data.iter_available_files(dates_in_range, mock.MagicMock(), data_path, 1, stats,
+                                                                DataManifest(data_path), prefetch=2)
+            for index, file_path in enumerate(available_files):
+                self.assertEqual(dates_in_range[index].strftime('%Y-%m-%d.4daytransactionbystop.gz'),
+                                 os.path.basename(file_path))
+                # downloads never get more than prefetch files ahead of the consumer
+                self.assertLessEqual(len(fetched), index + 1 + 2)
+        self.assertEqual(8, len(fetched))
+        self.assertEqual(8, stats['files_downloaded'])
+        self.assertIn('download_wait_time', stats)
+
+    @mock.patch('process_data.LazyAWSSession')
     def test_get_availble_files_doesnt_exist(self, aw_session):
         dates_in_range = [datetime.strptime('2020-06-08', "%Y-%m-%d")]
         correct_path = [os.path.join(self.data_path, '2020-06-08.4daytransactionbystop.gz')]
-        aw_session.download_object_from_bucket.return_value = correct_path[0]
+        aw_session.get_object_info.return_value = dict(etag='etag', size=1)
         self.assertEqual(correct_path, process_data.get_available_files(dates_in_range, aw_session, self.data_path))
+        aw_session.download_object_resumable.assert_called_once_with(
+            '2020-06-08.4daytransactionbystop.gz', correct_path[0], dict(etag='etag', size=1))
 
     def test_get_output_dict(self):
         available_files = [os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')]
@@ -53,6 +187,207 @@ class ProcessDataTest(TestCase):
         self.assertDictEqual(expected_output['T-17-140-OP-80'],
                              process_data.get_output_dict(available_files)[0]['T-17-140-OP-80'])
 
+    def test_aggregate_transaction_file(self):
+        file_path = os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')
+        output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+        output, metro_stations = process_data.aggregate_transaction_file(file_path, output, set())
+        self.assertEqual({'TOBALABAL4'}, metro_stations)
+        self.assertNotIn('-', output)
+        self.assertEqual(146, output['TOBALABAL4']['dates']['2020-05-09'])
+        self.assertEqual(3, output['T-17-140-OP-80']['dates']['2020-05-09'])
+
+    def test_aggregate_transaction_file_encodings(self):
+        rows = ['Fecha;TipoDia;CodigoTS;CodigoUsuario;Comuna;Nombre;Modo;Linea;Periodo;MediaHora;Subidas',
+                '2020-05-09;SABADO;-;-;-;-;BUS;;;00:00:00;1',
+                '2020-05-09;SABADO;T-Ñ-1;-;ÑUÑOA;Parada Ñuñoa;BUS;;04 - PUNTA;07:00:00;2',
+                '2020-05-09;SABADO;ÑUBLE;-;ÑUÑOA;-;METRO;L6;04 - PUNTA;07:00:00;5',
+                '2020-05-09;SABADO;T-Ñ-1;PC1;ÑUÑOA;Parada Ñuñoa;BUS;;04 - PUNTA;07:30:00;3']
+        with tempfile.TemporaryDirectory() as data_path:
+            file_path = os.path.join(data_path, '2020-05-09.4daytransactionbystop.gz')
+            with gzip.open(file_path, 'wb') as file_obj:
+                for row in rows:
+                    # stop codes are utf-8 in files otherwise encoded as latin-1
+                    values = row.split(';')
+                    file_obj.write(';'.join(values[:2]).encode('latin-1') + b';' + values[2].encode('utf-8') + b';' +
+                                   ';'.join(values[3:]).encode('latin-1') + b'\r\n')
+            output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+            stats = dict()
+            output, metro_stations = process_data.aggregate_transaction_file(file_path, output, set(), stats=stats)
+        self.assertEqual({'ÑUBLEL6'}, metro_stations)
+        self.assertEqual(dict(stop_name='Parada Ñuñoa', user_stop_code='PC1', auth_stop_code='T-Ñ-1', area='Ñuñoa'),
+                         output['T-Ñ-1']['info'])
+        self.assertEqual({'2020-05-09': 5}, output['T-Ñ-1']['dates'])
+        self.assertEqual('ÑUBLE', output['ÑUBLEL6']['info']['stop_name'])
+        self.assertEqual(dict(files_parsed=1, bytes_read=stats['bytes_read'], rows_parsed=4, rows_skipped=1), stats)
+
+    def test_aggregate_transaction_file_granularities(self):
+        file_path = os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')
+        output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+        output, _ = process_data.aggregate_transaction_file(file_path, output, set(),
+                                                            ['day', 'half_hour', 'period', 'day_type'])
+        stop = output['T-17-140-OP-80']
+        self.assertEqual(3, stop['dates']['2020-05-09'])
+        self.assertEqual(2, stop['half_hours']['2020-05-09 07:30:00'])
+        self.assertEqual(sum(stop['dates'].values()), sum(stop['half_hours'].values()))
+        self.assertEqual(3, stop['periods'][('2020-05-09', '04 - PUNTA MANANA SABADO')])
+        self.assertEqual({'SABADO': 3}, stop['day_types'])
+
+    def test_get_output_dict_granularities(self):
+        available_files = [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz'),
+                           os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')]
+        output = process_data.get_output_dict(available_files, granularities=['day', 'period'])[0]
+        parallel_output = process_data.get_output_dict(available_files, workers=2, granularities=['day', 'period'])[0]
+        self.assertEqual(output, parallel_output)
+        for stop in output.values():
+            self.assertEqual(sum(stop['dates'].values()), sum(stop['periods'].values()))
+        self.assertEqual({stop: {'info': data['info'], 'dates': data['dates']} for stop, data in output.items()},
+                         process_data.get_output_dict(available_files)[0])
+
+    def test_get_output_dict_stats(self):
+        available_files = [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz'),
+                           os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')]
+        stats = dict()
+        output = process_data.get_output_dict(available_files, stats=stats)[0]
+        parallel_stats = dict()
+        self.assertEqual(output, process_data.get_output_dict(available_files, workers=2, stats=parallel_stats)[0])
+        self.assertEqual(stats, parallel_stats)
+        self.assertEqual(2, stats['files_parsed'])
+        self.assertEqual(sum(os.path.getsize(file_path) for file_path in available_files), stats['bytes_read'])
+        self.assertEqual(1, stats['rows_skipped'])
+        self.assertGreater(stats['rows_parsed'], stats['rows_skipped'])
+
+    def test_get_output_dict_stations(self):
+        rows = ['Fecha;TipoDia;CodigoTS;CodigoUsuario;Comuna;Nombre;Modo;Linea;Periodo;MediaHora;Subidas',
+                '2020-05-09;SABADO;Tobalaba;-;PROVIDENCIA;-;METRO;L4;04 - PUNTA;07:00:00;5',
+                '2020-05-09;SABADO;ESTACION NOS;-;SAN BERNARDO;-;METROTREN;MT;04 - PUNTA;07:00:00;4',
+                '2020-05-09;SABADO;ESTACION NOS;-;SAN BERNARDO;-;METROTREN;MT;04 - PUNTA;07:30:00;2',
+                '2020-05-09;SABADO;NUEVA;-;SANTIAGO;-;METRO;L9;04 - PUNTA;07:00:00;1',
+                '2020-05-09;SABADO;T-17-140-OP-80;PC1106;LAS CONDES;Parada;BUS;;04 - PUNTA;07:00:00;3']
+        with tempfile.TemporaryDirectory() as data_path:
+            file_path = os.path.join(data_path, '2020-05-09.4daytransactionbystop.gz')
+            with gzip.open(file_path, 'wt', encoding='latin-1') as file_obj:
+                file_obj.write('\n'.join(rows) + '\n')
+            station_index = process_data.load_station_index(self.data_path)
+            cache = DayAggregateCache(os.path.join(data_path, 'cache'))
+            stats = dict()
+            output, metro_stations, metrotren_stations = process_data.get_output_dict([file_path], cache=cache,
+                                                                                      stats=stats,
+                                                                                      stations=station_index)
+            self.assertEqual({'TOBALABAL4', 'NUEVAL9'}, metro_stations)
+            self.assertEqual(['Estacion Nos'], metrotren_stations)
+            self.assertEqual({'2020-05-09': 6}, output['Estacion Nos']['dates'])
+            self.assertEqual({'2020-05-09': 5}, output['TOBALABAL4']['dates'])
+            self.assertEqual(1, stats['stations_unmatched'])
+            self.assertEqual((output, metro_stations, metrotren_stations),
+                             process_data.get_output_dict([file_path], workers=2, stations=station_index))
+
+            # aggregates cached without station references do not have metrotren stations
+            legacy_output, legacy_metro_stations, legacy_metrotren_stations = process_data.get_output_dict(
+                [file_path], cache=cache)
+            self.assertEqual([], legacy_metrotren_stations)
+            self.assertNotIn('Estacion Nos', legacy_output)
+            self.assertEqual(output, process_data.get_output_dict([file_path], cache=cache,
+                                                                  stations=station_index)[0])
+
+        output = process_data.add_location_to_metrotren_station_data(self.data_path, output,
+                                                                     [datetime(2020, 5, 9)])
+        self.assertEqual([['2020-05-09 00:00:00', 'ESTACION NOS', 'ESTACION NOS', 'Estacion Nos', 'San Bernardo',
+                           -33.632758, -70.704797, 6]],
+                         [row for row in process_data.iter_csv_rows(output) if row[3] == 'Estacion Nos'])
+
+    def test_get_output_dict_with_workers(self):
+        available_files = [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz'),
+                           os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')]
+        output, metro_stations, _ = process_data.get_output_dict(available_files)
+        parallel_output, parallel_metro_stations, _ = process_data.get_output_dict(available_files, workers=2)
+        self.assertEqual(output, parallel_output)
+        self.assertEqual(list(output), list(parallel_output))
+        self.assertEqual(metro_stations, parallel_metro_stations)
+        # files can come from a generator, as they are verified
+        self.assertEqual(list(output), list(process_data.get_output_dict(iter(available_files), workers=2)[0]))
+
+    def test_get_output_dict_with_cache(self):
+        available_files = [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz'),
+                           os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')]
+        output, metro_stations, _ = process_data.get_output_dict(available_files)
+        with tempfile.TemporaryDirectory() as cache_path:
+            cache = DayAggregateCache(cache_path)
+            self.assertEqual(output, process_data.get_output_dict(available_files, cache=cache)[0])
+            with mock.patch('process_data.read_transaction_file') as read_transaction_file:
+                cached_output, cached_metro_stations, _ = process_data.get_output_dict(available_files, workers=2,
+                                                                                       cache=cache)
+                read_transaction_file.assert_not_called()
+        self.assertEqual(output, cached_output)
+        self.assertEqual(metro_stations, cached_metro_stations)
+
+    def test_load_stop_locations(self):
+        stop_locations = process_data.load_stop_locations(self.data_path)
+        self.assertEqual(2, len(stop_locations))
+        self.assertDictEqual(dict(user_stop_code='PC1106', stop_name='Parada / Municipalidad de Las Condes',
+                                  longitude=-33.41611369, latitude=-70.59369329), stop_locations['T-17-140-OP-80'])
+
+    def test_load_metro_locations(self):
+        metro_locations = process_data.load_metro_locations(self.data_path)
+        self.assertEqual('Estación Tobalaba L4', metro_locations['TOBALABAL4']['stop_name'])
+        self.assertEqual('Estación Tobalaba', metro_locations['TOBALABAL4']['user_stop_code'])
+
+    @mock.patch('process_data.LazyAWSSession')
+    def test_get_incremental_output_dict(self, aws_session):
+        first_day = datetime.strptime('2020-05-08', "%Y-%m-%d")
+        second_day = datetime.strptime('2020-05-09', "%Y-%m-%d")
+        with tempfile.TemporaryDirectory() as state_dir:
+            state_path = os.path.join(state_dir, 'output.state')
+            process_data.get_incremental_output_dict(state_path, [first_day], aws_session, self.data_path)
+
+            with mock.patch('process_data.read_transaction_file', wraps=process_data.read_transaction_file) as reader:
+                output, metro_stations, _ = process_data.get_incremental_output_dict(
+                    state_path, [first_day, second_day], aws_session, self.data_path)
+                reader.assert_called_once_with(os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz'))
+            expected_output, expected_metro_stations, _ = process_data.get_output_dict(
+                [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz'),
+                 os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.gz')])
+            self.assertEqual(expected_output, output)
+            self.assertEqual(expected_metro_stations, metro_stations)
+
+            output, metro_stations, _ = process_data.get_incremental_output_dict(state_path, [first_day],
+                                                                                 aws_session, self.data_path)
+            expected_output, expected_metro_stations, _ = process_data.get_output_dict(
+                [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz')])
+            self.assertEqual(expected_output, output)
+            self.assertEqual(expected_metro_stations, metro_stations)
+        aws_session.download_object_resumable.assert_not_called()
+
+    @mock.patch('process_data.LazyAWSSession')
+    def test_get_incremental_output_dict_stations(self, aws_session):
+        first_day = datetime.strptime('2020-05-08', "%Y-%m-%d")
+        station_index = process_data.load_station_index(self.data_path)
+        with tempfile.TemporaryDirectory() as state_dir:
+            state_path = os.path.join(state_dir, 'output.state')
+            process_data.get_incremental_output_dict(state_path, [first_day], aws_session, self.data_path)
+            # the state of a run without station references is not reused
+            self.assertEqual(set(), process_data.load_output_state(state_path, station_index)[2])
+            process_data.get_incremental_output_dict(state_path, [first_day], aws_session, self.data_path,
+                                                     stations=station_index)
+            self.assertEqual({'2020-05-08'}, process_data.load_output_state(state_path, station_index)[2])
+
+    @mock.patch('process_data.LazyAWSSession')
+    def test_get_incremental_output_dict_granularities(self, aws_session):
+        first_day = datetime.strptime('2020-05-08', "%Y-%m-%d")
+        granularities = ['day', 'half_hour']
+        with tempfile.TemporaryDirectory() as state_dir:
+            state_path = os.path.join(state_dir, 'output.state')
+            process_data.get_incremental_output_dict(state_path, [first_day], aws_session, self.data_path)
+            # days of a run without half hours are read again when half hours are requested
+            self.assertEqual(set(), process_data.load_output_state(state_path, granularities=granularities)[2])
+            output, _, _ = process_data.get_incremental_output_dict(state_path, [first_day], aws_session,
+                                                                    self.data_path, granularities=granularities)
+            expected_output, _, _ = process_data.get_output_dict(
+                [os.path.join(self.data_path, '2020-05-08.4daytransactionbystop.gz')], granularities=granularities)
+            self.assertEqual(expected_output, output)
+            self.assertEqual({'2020-05-08'},
+                             process_data.load_output_state(state_path, granularities=granularities)[2])
+            self.assertEqual({'2020-05-08'}, process_data.load_output_state(state_path)[2])
+
     def test_add_location_to_stop_data(self):
         dates_in_range = [datetime.strptime('2020-05-09', "%Y-%m-%d")]
         expected_output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
@@ -102,7 +437,32 @@ class ProcessDataTest(TestCase):
         expected_csv = [
             ['2020-05-08 00:00:00', 'Parada / Municipalidad de Las Condes', 'PC1106', 'T-17-140-OP-80', 'Las Condes',
              -33.41611369, -70.59369329, 3]]
-        self.assertEqual(expected_csv, process_data.create_csv_data(self.data_path, output_filename, expected_output))
+        self.assertEqual(expected_csv, list(process_data.iter_csv_rows(expected_output)))
+        self.assertEqual(1, process_data.create_csv_data(self.data_path, output_filename, expected_output))
+        with open(self.test_csv_path, encoding='latin-1') as csv_file:
+            self.assertEqual(['Fecha,Nombre,Código de usuario,Código ts,Comuna,Latitud,Longitud,Subidas',
+                              '2020-05-08 00:00:00,Parada / Municipalidad de Las Condes,PC1106,T-17-140-OP-80,'
+                              'Las Condes,-33.41611369,-70.59369329,3'], csv_file.read().splitlines())
+
+    def test_iter_csv_rows_granularities(self):
+        output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+        output['T-17-140-OP-80']['info'].update(auth_stop_code='T-17-140-OP-80', user_stop_code='PC1106',
+                                                stop_name='Parada 1', area='Las Condes', longitude=-33.4,
+                                                latitude=-70.5)
+        output['T-17-140-OP-80']['dates']['2020-05-08'] = 3
+        output['T-17-140-OP-80']['half_hours'] = {'2020-05-08 07:30:00': 3}
+        output['T-17-140-OP-80']['periods'] = {('2020-05-08', '04 - PUNTA MANANA'): 3}
+        output['T-17-140-OP-80']['day_types'] = {'LABORAL': 3}
+        stop_row = ['Parada 1', 'PC1106', 'T-17-140-OP-80', 'Las Condes', -33.4, -70.5, 3]
+        self.assertEqual([['2020-05-08 07:30:00'] + stop_row],
+                         list(process_data.iter_csv_rows(output, granularity='half_hour')))
+        self.assertEqual([['2020-05-08 00:00:00'] + stop_row + ['04 - PUNTA MANANA']],
+                         list(process_data.iter_csv_rows(output, granularity='period')))
+        self.assertEqual([[''] + stop_row + ['LABORAL']],
+                         list(process_data.iter_csv_rows(output, granularity='day_type')))
+
+        process_data.remove_dates_from_output(output, set(), {'2020-05-08'})
+        self.assertEqual({}, dict(output))
 
     def test_write_info_to_kepler_file(self):
         csv_data = [['2020-05-08 00:00:00', 'PC1106', 'LAS CONDES', -33.41611369, -70.59369329, 3]]
@@ -111,7 +471,86 @@ class ProcessDataTest(TestCase):
         process_data.write_info_to_kepler_file(self.data_path, self.data_path, output_filename, mapbox_key, csv_data)
         self.assertTrue(filecmp.cmp(os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.html'),
                                     os.path.join(self.data_path, 'test_base.html')))
+        process_data.write_info_to_kepler_file(self.data_path, self.data_path, output_filename, mapbox_key,
+                                               iter(csv_data))
+        self.assertTrue(filecmp.cmp(os.path.join(self.data_path, '2020-05-09.4daytransactionbystop.html'),
+                                    os.path.join(self.data_path, 'test_base.html')))
+
+    def test_write_info_to_kepler_file_with_layers(self):
+        csv_data = [['2020-05-08 00:00:00', 'Parada', 'PC1106', 'T-17-140-OP-80', 'LAS CONDES', -33.4, -70.5, 3]]
+        layer_data = [['2020-05-08 00:00:00', 'LAS CONDES', 'Paraderos: 1', 'LAS CONDES', 'LAS CONDES', -33.4, -70.5,
+                       3]]
+        with tempfile.TemporaryDirectory() as outputs_path:
+            process_data.write_info_to_kepler_file(process_data.TEMPLATE_PATH, outputs_path, 'output', 'mapbox_key',
+                                                   csv_data, layers=[('comuna', 'Subidas por comuna', layer_data)])
+            with open(os.path.join(outputs_path, 'output.html')) as html_file:
+                html_data = html_file.read()
+        self.assertNotIn('<EXTRA_', html_data)
+        self.assertIn('"id": "layer_comuna", "label": "Subidas por comuna", "color": [255, 120, 160], "allData": ' +
+                      str(layer_data), html_data)
+        self.assertIn('"dataId": ["yn7iyxfomj", "layer_comuna"]', html_data)
+        self.assertIn('"name": ["Fecha", "Fecha"]', html_data)
+        self.assertIn('"dataId": "layer_comuna"', html_data)
+
+    def test_get_kepler_data_gzip_chunks(self):
+        csv_data = [['2020-05-08 00:00:00', 'Parada {0}'.format(stop), 'PC{0}'.format(stop), 'T-{0}'.format(stop),
+                     'Ñuñoa', -33.4, -70.5, stop] for stop in range(1000)]
+        kepler_data = process_data.get_kepler_data(csv_data, 'gzip')
+        payload = kepler_data[kepler_data.index('atob("') + 6:kepler_data.index('")')]
+        self.assertEqual(process_data.compact_csv_data(csv_data),
+                         json.loads(zlib.decompress(base64.b64decode(payload)).decode('utf-8')))
+
+    def test_create_parquet_data(self):
+        import pyarrow.parquet as pq
+        output = defaultdict(lambda: dict(info=dict(), dates=defaultdict(lambda: 0)))
+        output['T-17-140-OP-80']['info'] = dict(auth_stop_code='T-17-140-OP-80', user_stop_code='PC1106',
+                                                stop_name='Parada / Municipalidad de Las Condes', area='Las Condes',
+                                                longitude=-33.41611369, latitude=-70.59369329)
+        output['T-17-140-OP-80']['dates']['2020-05-08'] = 3
+        output['T-17-140-OP-80']['dates']['2020-05-09'] = 5
+        with tempfile.TemporaryDirectory() as outputs_path:
+            self.assertEqual(2, process_data.create_parquet_data(outputs_path, 'output', output, batch_size=1))
+            dataset_path = os.path.join(outputs_path, 'output.parquet')
+            self.assertEqual(['Fecha=2020-05-08', 'Fecha=2020-05-09'], sorted(os.listdir(dataset_path)))
+            table = pq.read_table(dataset_path)
+            self.assertEqual(['Nombre', 'Código de usuario', 'Código ts', 'Comuna', 'Latitud', 'Longitud', 'Subidas'],
+                             table.schema.names[:7])
+            rows = sorted(table.to_pylist(), key=lambda row: str(row['Fecha']))
+            self.assertEqual([3, 5], [row['Subidas'] for row in rows])
+            self.assertEqual(['2020-05-08', '2020-05-09'], [str(row['Fecha']) for row in rows])
+            self.assertEqual(-33.41611369, rows[0]['Latitud'])
 
+        # a partition is written in one row group per date, split in batch_size rows when the date has more
+        output['T-1']['info'] = dict(output['T-17-140-OP-80']['info'], auth_stop_code='T-1')
+        output['T-1']['dates'].update({'2020-05-08': 1, '2020-05-09': 2})
+        for batch_size, row_groups in [(2, 1), (1, 2)]:
+            with tempfile.TemporaryDirectory() as outputs_path:
+                self.assertEqual(4, process_data.create_parquet_data(outputs_path, 'output', output, batch_size))
+                for partition in ['Fecha=2020-05-08', 'Fecha=2020-05-09']:
+                    partition_path = os.path.join(outputs_path, 'output.parquet', partition, 'part-0.parquet')
+                    self.assertEqual(row_groups, pq.ParquetFile(partition_path).num_row_groups)
+                    self.assertEqual(2, pq.ParquetFile(partition_path).metadata.num_rows)
+
+    def test_compact_csv_data(self):
+        csv_data = [['2020-05-08 00:00:00', 'Parada 1', 'PC1106', 'T-17-140-OP-80', 'Las Condes', -33.4, -70.5, 3],
+                    ['2020-05-08 00:00:00', 'Parada 2', 'PC1107', 'T-17-140-OP-81', 'Las Condes', -33.5, -70.6, 4],
+                    ['2020-05-09 00:00:00', 'Parada 1', 'PC1106', 'T-17-140-OP-80', 'Las Condes', -33.4, -70.5, 5]]
+        expected_data = dict(dates=[['2020-05-08 00:00:00'], ['2020-05-09 00:00:00']],
+                             stops=[['Parada 1', 'PC1106', 'T-17-140-OP-80', 'Las Condes', -33.4, -70.5],
+                                    ['Parada 2', 'PC1107', 'T-17-140-OP-81', 'Las Condes', -33.5, -70.6]],
+                             rows=[[[0, 1], [3, 4]], [[0], [5]]])
+        self.assertDictEqual(expected_data, process_data.compact_csv_data(csv_data))
+
+    def test_get_kepler_data(self):
+        csv_data = [['2020-05-08 00:00:00', 'Parada </script>', 'PC1106', 'T-17-140-OP-80', 'Las Condes', -33.4,
+                     -70.5, 3]]
+        self.assertEqual(str(csv_data), process_data.get_kepler_data(csv_data))
+        compact_data = process_data.get_kepler_data(csv_data, 'compact')
+        self.assertNotIn('</script>', compact_data)
+        self.assertTrue(compact_data.startswith('(function (data)'))
+        self.assertIn('pako.inflate', process_data.get_kepler_data(csv_data, 'gzip'))
+
+    @mock.patch('process_data.RunReport.save')
     @mock.patch('process_data.config')
     @mock.patch('process_data.write_info_to_kepler_file')
     @mock.patch('process_data.create_csv_data')
@@ -119,18 +558,20 @@ class ProcessDataTest(TestCase):
     @mock.patch('process_data.add_location_to_metro_station_data')
     @mock.patch('process_data.add_location_to_stop_data')
     @mock.patch('process_data.get_output_dict')
-    @mock.patch('process_data.get_available_files')
+    @mock.patch('process_data.DayAggregateCache')
+    @mock.patch('process_data.load_station_index')
+    @mock.patch('process_data.iter_available_files')
     @mock.patch('process_data.check_available_days')
-    @mock.patch('process_data.AWSSession')
+    @mock.patch('process_data.LazyAWSSession')
     @mock.patch('process_data.OUTPUTS_PATH')
     @mock.patch('process_data.TEMPLATE_PATH')
     @mock.patch('process_data.INPUTS_PATH')
     @mock.patch('process_data.DATA_PATH')
     @mock.patch('process_data.DIR_PATH')
     def test_main(self, dir_path, data_path, input_path, template_path, output_path, aws_session, check_available_days,
-                  get_available_files, output_dict, add_location_to_stop_data, add_location_to_metro_data,
-                  add_location_to_metrotren_station_data, create_csv_data,
-                  write_info_to_kepler_file, config):
+                  iter_available_files, load_station_index, day_aggregate_cache, output_dict, add_location_to_stop_data,
+                  add_location_to_metro_data, add_location_to_metrotren_station_data, create_csv_data,
+                  write_info_to_kepler_file, config, save_report):
         dir_path.return_value = self.data_path
         data_path.return_value = self.data_path
         input_path.return_value = self.data_path
@@ -138,16 +579,18 @@ class ProcessDataTest(TestCase):
         output_path.return_value = self.data_path
         check_available_days.return_value = [datetime.strptime('2020-02-05', "%Y-%m-%d")]
         output_dict.return_value = [mock.MagicMock(), mock.MagicMock(), mock.MagicMock()]
-        process_data.main(['process_data', '2020-05-08', '2020-05-08', 'output'])
+        create_csv_data.return_value = 1
+        process_data.main(['process_data', '2020-05-08', '2020-05-08', 'output', '--report', 'report.json'])
+        save_report.assert_called_once_with('report.json')
 
     @mock.patch('process_data.config')
     @mock.patch('process_data.write_info_to_kepler_file')
     @mock.patch('process_data.create_csv_data')
     @mock.patch('process_data.add_location_to_stop_data')
     @mock.patch('process_data.get_output_dict')
-    @mock.patch('process_data.get_available_files')
+    @mock.patch('process_data.iter_available_files')
     @mock.patch('process_data.check_available_days')
-    @mock.patch('process_data.AWSSession')
+    @mock.patch('process_data.LazyAWSSession')
     @mock.patch('process_data.OUTPUTS_PATH')
     @mock.patch('process_data.TEMPLATE_PATH')
     @mock.patch('process_data.INPUTS_PATH')
@@ -155,7 +598,7 @@ class ProcessDataTest(TestCase):
     @mock.patch('process_data.DIR_PATH')
     def test_main_without_days(self, dir_path, data_path, input_path, template_path, output_path, aws_session,
                                check_available_days,
-                               get_available_files, output_dict, add_location_to_stop_data, create_csv_data,
+                               iter_available_files, output_dict, add_location_to_stop_data, create_csv_data,
                                write_info_to_kepler_file, config):
         dir_path.return_value = self.data_path
         data_path.return_value = self.data_path
@@ -169,6 +612,24 @@ class ProcessDataTest(TestCase):
 
             self.assertEqual(cm.exception.code, 1)
 
+    def test_main_parquet_without_day(self):
+        with self.assertRaises(SystemExit) as context:
+            process_data.main(['process_data', '2020-05-08', '2020-05-08', 'output', '--parquet', '--granularities',
+                               'half_hour', '--quiet'])
+        self.assertEqual(2, context.exception.code)
+
+    @mock.patch('process_data.DayAggregateCache')
+    @mock.patch('process_data.LazyAWSSession')
+    def test_get_days_parser(self, aws_session, day_aggregate_cache):
+        args = process_data.get_days_parser().parse_args(['--download-workers', '4', '--cache-size', '2'])
+        self.assertEqual((1, None), (args.workers, args.prefetch))
+        self.assertEqual(aws_session.return_value, process_data.get_aws_session(args))
+        aws_session.assert_called_once_with(max_pool_connections=4)
+        self.assertEqual(day_aggregate_cache.return_value, process_data.get_day_cache(args))
+        day_aggregate_cache.assert_called_once_with(mock.ANY, 2 * 1024 * 1024)
+        args = process_data.get_days_parser().parse_args(['--offline', '--no-cache'])
+        self.assertEqual((None, None), (process_data.get_aws_session(args), process_data.get_day_cache(args)))
+
     def tearDown(self):
         if os.path.exists(self.test_csv_path):
             os.remove(self.test_csv_path)
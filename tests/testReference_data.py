@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import logging
+import mock
+import reference_data
+
+
+class ReferenceDataTest(TestCase):
+
+    def setUp(self):
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.inputs_path = tempfile.mkdtemp()
+        for filename in reference_data.SOURCE_FILES:
+            shutil.copy(os.path.join(dir_path, 'files', filename), self.inputs_path)
+        self.reference_path = os.path.join(self.inputs_path, 'reference.sqlite3')
+        logging.disable(logging.CRITICAL)
+
+    def test_compiled_data_matches_sources(self):
+        self.assertEqual(reference_data.load_stop_locations(self.inputs_path),
+                         reference_data.load_stop_locations(self.inputs_path, self.reference_path))
+        self.assertEqual(list(reference_data.load_metro_locations(self.inputs_path).items()),
+                         list(reference_data.load_metro_locations(self.inputs_path, self.reference_path).items()))
+        self.assertEqual(reference_data.load_metrotren_locations(self.inputs_path),
+                         reference_data.load_metrotren_locations(self.inputs_path, self.reference_path))
+
+    @mock.patch('reference_data.build_reference_data', wraps=reference_data.build_reference_data)
+    def test_compiled_data_is_reused(self, build_reference_data):
+        reference_data.load_stop_locations(self.inputs_path, self.reference_path)
+        reference_data.load_metro_locations(self.inputs_path, self.reference_path)
+        build_reference_data.assert_called_once()
+
+    def test_compiled_data_is_rebuilt_when_a_source_changes(self):
+        reference_data.load_stop_locations(self.inputs_path, self.reference_path)
+        with open(os.path.join(self.inputs_path, 'stop.csv'), 'a', encoding='latin-1') as stop_file:
+            stop_file.write('T101 00I|101I|1|1|PA1|PA1|Nueva parada|-33.1|-70.1|0\n')
+        stop_locations = reference_data.load_stop_locations(self.inputs_path, self.reference_path)
+        self.assertEqual('Nueva parada', stop_locations['PA1']['stop_name'])
+
+    def test_compiled_data_is_built_in_a_temporary_file(self):
+        reference_data.build_reference_data(self.inputs_path, self.reference_path)
+        self.assertEqual(sorted(reference_data.SOURCE_FILES + ['reference.sqlite3']),
+                         sorted(os.listdir(self.inputs_path)))
+        self.assertEqual(reference_data.FILE_MODE, os.stat(self.reference_path).st_mode & 0o777)
+        # a temporary file left by another run is not used
+        with open(self.reference_path + '.tmp', 'w') as tmp_file:
+            tmp_file.write('partial')
+        reference_data.build_reference_data(self.inputs_path, self.reference_path)
+        self.assertEqual(2, len(reference_data.load_stop_locations(self.inputs_path, self.reference_path)))
+
+    def tearDown(self):
+        shutil.rmtree(self.inputs_path)
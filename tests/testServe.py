@@ -0,0 +1,130 @@
+import csv
+import io
+import json
+import threading
+from unittest import TestCase, mock
+from urllib.request import urlopen
+
+import logging
+import batch
+import process_data
+import serve
+
+
+class ServeTest(TestCase):
+
+    def setUp(self):
+        def info(name, user_code, auth_code, area):
+            return dict(stop_name=name, user_stop_code=user_code, auth_stop_code=auth_code, area=area,
+                        longitude=-33.45, latitude=-70.65)
+
+        self.output = {
+            'T-1': dict(info=info('Parada 1', 'PA1', 'T-1', 'MAIPU'), dates={'2020-05-08': 3, '2020-05-09': 5}),
+            'T-2': dict(info=info('Parada 2, "Maipu"', 'PA2', 'T-2', 'Maipu'), dates={'2020-05-10': 1}),
+            'ALL1': dict(info=info('Los Heroes', 'ALL1', 'ALL1', 'SANTIAGO'), dates={'2020-05-09': 7}),
+            'T-3': dict(info=dict(area='-'), dates={'2020-05-08': 2}),
+        }
+        self.located_stops = {'T-1', 'T-2', 'ALL1'}
+        self.stop_modes = {'ALL1': 'metro'}
+        self.store = serve.TransactionStore(self.output, self.located_stops, self.stop_modes)
+        logging.disable(logging.CRITICAL)
+
+    def test_query(self):
+        self.assertEqual(['2020-05-08', '2020-05-09', '2020-05-10'], self.store.dates)
+        self.assertEqual(3, len(self.store.stops))
+        rows = self.store.query('2020-05-09', '2020-05-09', stops=['pa1'])
+        self.assertEqual([['2020-05-09 00:00:00', 'Parada 1', 'PA1', 'T-1', 'MAIPU', -33.45, -70.65, 5]], rows)
+        rows = self.store.query(comuna='maipu', mode='bus')
+        self.assertEqual([3, 5, 1], [row[-1] for row in rows])
+        self.assertEqual([7], [row[-1] for row in self.store.query(mode='metro')])
+        self.assertEqual([], self.store.query(stops=['ALL1'], comuna='maipu'))
+        self.assertEqual([], self.store.query(stops=['unknown']))
+        # located stops without transactions in the range have them with zero transactions
+        rows = self.store.query('2020-05-08', '2020-05-08', comuna='maipu')
+        self.assertEqual([('T-1', 3), ('T-2', 0)], [(row[3], row[-1]) for row in rows])
+
+    def test_query_matches_slice_output(self):
+        dates = ['2020-05-09', '2020-05-10']
+        for comuna, mode in [(None, None), ('Maipu', None), (None, 'metro'), ('santiago', 'bus')]:
+            sliced_output = batch.slice_output(self.output, dates, self.located_stops, comuna, mode, self.stop_modes)
+            expected_rows = list(process_data.iter_csv_rows(sliced_output, log_invalid=False))
+            self.assertEqual(sorted(expected_rows), sorted(self.store.query(dates[0], dates[-1], None, comuna, mode)))
+
+    def test_query_formats(self):
+        rows = self.store.query(comuna='maipu')
+        with io.StringIO() as csv_file:
+            csv.writer(csv_file, lineterminator='\n').writerows([process_data.CSV_HEADER] + rows)
+            self.assertEqual(csv_file.getvalue(), self.store.query_csv(comuna='maipu'))
+        self.assertEqual(rows, json.loads(self.store.query_json(comuna='maipu'))['rows'])
+
+    def test_get_response(self):
+        cache = serve.ResponseCache(max_entries=1)
+        status, content_type, body = serve.get_response(self.store, cache, '/transactions',
+                                                        dict(stop=['PA1'], end_date=['2020-05-08']))
+        self.assertEqual(200, status)
+        self.assertEqual('text/csv; charset=utf-8', content_type)
+        self.assertEqual(['Fecha,Nombre,Código de usuario,Código ts,Comuna,Latitud,Longitud,Subidas',
+                          '2020-05-08 00:00:00,Parada 1,PA1,T-1,MAIPU,-33.45,-70.65,3'],
+                         body.decode('utf-8').splitlines())
+
+        status, _, body = serve.get_response(self.store, cache, '/transactions', dict(mode=['metro'], format=['json']))
+        data = json.loads(body.decode('utf-8'))
+        self.assertEqual(200, status)
+        self.assertEqual('Subidas', data['fields'][-1]['name'])
+        self.assertEqual([['2020-05-09 00:00:00', 'Los Heroes', 'ALL1', 'ALL1', 'SANTIAGO', -33.45, -70.65, 7]],
+                         data['rows'])
+        self.assertEqual(self.store.dates, json.loads(serve.get_response(self.store, cache, '/dates', {})[2]))
+
+        for params in [dict(mode=['train']), dict(start_date=['2020-5-32']), dict(format=['xml']),
+                       dict(comuna=['a', 'b']), dict(stops=['PA1'])]:
+            self.assertEqual(400, serve.get_response(self.store, cache, '/transactions', params)[0])
+        self.assertEqual(404, serve.get_response(self.store, cache, '/stops', {})[0])
+
+    def test_response_cache(self):
+        cache = serve.ResponseCache(max_entries=2)
+        with mock.patch.object(self.store, 'iter_matches', wraps=self.store.iter_matches) as query_mock:
+            for params in [dict(stop=['PA1']), dict(stop=['PA1']), dict(stop=['PA2']), dict(stop=['ALL1']),
+                           dict(stop=['PA1'])]:
+                serve.get_response(self.store, cache, '/transactions', params)
+        # the first PA1 response was dropped when ALL1 was added
+        self.assertEqual(4, query_mock.call_count)
+        self.assertEqual((1, 4), (cache.hits, cache.misses))
+        stats = json.loads(serve.get_response(self.store, cache, '/stats', {})[2])
+        self.assertEqual(dict(dates=3, stops=3, cache_entries=2, cache_bytes=cache.size, cache_hits=1, cache_misses=4),
+                         stats)
+
+    def test_response_cache_size(self):
+        cache = serve.ResponseCache(max_entries=10, max_bytes=10)
+        cache.put('a', ('text/csv', b'1234'))
+        cache.put('b', ('text/csv', b'1234'))
+        cache.put('a', ('text/csv', b'12345'))
+        self.assertEqual(9, cache.size)
+        # least recently used responses are dropped until bodies fit in max_bytes
+        cache.put('c', ('text/csv', b'12'))
+        self.assertEqual(['a', 'c'], list(cache.responses))
+        self.assertEqual(7, cache.size)
+        # a body larger than max_bytes is not kept
+        cache.put('d', ('text/csv', b'12345678901'))
+        self.assertEqual(['a', 'c'], list(cache.responses))
+
+    def test_server(self):
+        server = serve.StoreServer(('127.0.0.1', 0), self.store, serve.ResponseCache())
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{0}/transactions?comuna=SANTIAGO&format=json'.format(server.server_address[1])
+            with urlopen(url) as response:
+                self.assertEqual('*', response.headers['Access-Control-Allow-Origin'])
+                self.assertEqual(1, len(json.loads(response.read().decode('utf-8'))['rows']))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_main_without_days(self):
+        with mock.patch('serve.list_days', return_value=[]), mock.patch('serve.DataManifest'), \
+                mock.patch('serve.load_output') as load_output_mock:
+            with self.assertRaises(SystemExit) as context:
+                serve.main(['serve.py', '2020-05-08', '2020-05-09', '--offline'])
+        self.assertEqual(1, context.exception.code)
+        load_output_mock.assert_not_called()
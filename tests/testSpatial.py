@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import logging
+import spatial
+
+
+class SpatialTest(TestCase):
+
+    def setUp(self):
+        self.inputs_path = tempfile.mkdtemp()
+        # square comuna drawn as an open LineString, like the boundaries of comunas.geojson
+        features = [dict(type='Feature', properties=dict(comuna='CENTRO', provincia='Santiago'),
+                         geometry=dict(type='LineString', coordinates=[[-70.7, -33.5], [-70.6, -33.5], [-70.6, -33.4],
+                                                                       [-70.7, -33.4]]))]
+        with open(os.path.join(self.inputs_path, 'comunas.geojson'), 'w') as geojson_file:
+            json.dump(dict(type='FeatureCollection', features=features), geojson_file)
+        # stop info keeps latitude in longitude and longitude in latitude
+        self.output = {
+            'PA1': dict(info=dict(longitude=-33.45, latitude=-70.65, area='CENTRO'), dates={'2020-05-08': 3}),
+            'PA2': dict(info=dict(longitude=-33.4501, latitude=-70.6501, area='CENTRO'),
+                        dates={'2020-05-08': 2, '2020-05-09': 1}),
+            'PA3': dict(info=dict(longitude=-33.2, latitude=-70.65, area='NORTE'), dates={'2020-05-08': 7}),
+            'PA4': dict(info=dict(area='-'), dates={'2020-05-08': 1}),
+        }
+        logging.disable(logging.CRITICAL)
+
+    def test_load_comunas(self):
+        comunas = spatial.load_comunas(self.inputs_path)
+        self.assertEqual(1, len(comunas))
+        self.assertEqual(comunas[0]['ring'][0], comunas[0]['ring'][-1])
+        self.assertEqual((-70.7, -33.5, -70.6, -33.4), comunas[0]['bbox'])
+        self.assertEqual('CENTRO', spatial.find_comuna(comunas, -70.65, -33.45)['name'])
+        self.assertIsNone(spatial.find_comuna(comunas, -70.65, -33.2))
+        self.assertIsNone(spatial.find_comuna(comunas, -70.75, -33.45))
+
+    def test_get_grid_cell(self):
+        for shape in spatial.GRID_SHAPES:
+            cell_id, (longitude, latitude) = spatial.get_grid_cell(-70.65, -33.45, 1000, shape)
+            self.assertEqual(cell_id, spatial.get_grid_cell(-70.6501, -33.4501, 1000, shape)[0])
+            self.assertNotEqual(cell_id, spatial.get_grid_cell(-70.65, -33.44, 1000, shape)[0])
+            # the center of a cell is in the cell
+            self.assertEqual(cell_id, spatial.get_grid_cell(longitude, latitude, 1000, shape)[0])
+            self.assertAlmostEqual(-70.65, longitude, delta=0.01)
+            self.assertAlmostEqual(-33.45, latitude, delta=0.01)
+
+    def test_aggregate_by_grid(self):
+        areas = spatial.aggregate_by_grid(self.output, 1000)
+        self.assertEqual(2, len(areas))
+        cell_id = spatial.get_grid_cell(-70.65, -33.45, 1000)[0]
+        self.assertEqual({'2020-05-08': 5, '2020-05-09': 1}, areas[cell_id]['dates'])
+        self.assertEqual('Paraderos: 2', areas[cell_id]['info']['user_stop_code'])
+        self.assertAlmostEqual(-33.45, areas[cell_id]['info']['longitude'], delta=0.01)
+
+    def test_aggregate_by_comuna(self):
+        areas = spatial.aggregate_by_comuna(self.output, spatial.load_comunas(self.inputs_path))
+        self.assertEqual(['CENTRO'], list(areas))
+        self.assertEqual({'2020-05-08': 5, '2020-05-09': 1}, areas['CENTRO']['dates'])
+        self.assertEqual('CENTRO', areas['CENTRO']['info']['area'])
+
+    def test_get_layers(self):
+        layers = spatial.get_layers(self.output, ['comuna', 'grid'], self.inputs_path, 500, 'square')
+        self.assertEqual(['comuna', 'grid'], [layer_id for layer_id, _, _ in layers])
+        self.assertEqual('Subidas por celda (500 m)', layers[1][1])
+
+    def tearDown(self):
+        shutil.rmtree(self.inputs_path)
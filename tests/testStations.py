@@ -0,0 +1,41 @@
+import os
+from unittest import TestCase
+
+import logging
+import stations
+
+
+class StationsTest(TestCase):
+
+    def setUp(self):
+        self.inputs_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'files')
+        self.index = stations.load_station_index(self.inputs_path)
+        logging.disable(logging.CRITICAL)
+
+    def test_normalize_station_name(self):
+        self.assertEqual('NUBLE', stations.normalize_station_name('Estación Ñuble'))
+        self.assertEqual('TOBALABA L4', stations.normalize_station_name('TOBALABA_L4'))
+        self.assertEqual('PEDRO AGUIRRE CERDA', stations.normalize_station_name('  Pedro  Aguirre-Cerda '))
+
+    def test_resolve(self):
+        for code, line in [('TOBALABA', 'L4'), ('Tobalaba', 'L4'), ('TOBALABA_L4', 'L4'), ('Tobalabá', 'l4')]:
+            self.assertEqual('TOBALABAL4', self.index.resolve('METRO', code, line))
+        self.assertEqual('VILLA FREIL3', self.index.resolve('METRO', 'Villa Frei', 'L3'))
+        self.assertIsNone(self.index.resolve('METRO', 'TOBALABA', 'L1'))
+        for mode, code in [('METROTREN', 'NOS'), ('METROTREN', 'Estacion Nos'), ('TREN', 'ESTACIÓN NOS')]:
+            self.assertEqual('Estacion Nos', self.index.resolve(mode, code, ''))
+        self.assertIsNone(self.index.resolve('BUS', 'NOS', ''))
+        self.assertIsNone(self.index.resolve('BUS', 'T-17-140-OP-80', ''))
+
+    def test_split_stations(self):
+        metro_stations = {'TOBALABAL4', 'Estacion Nos', 'UNKNOWNL1'}
+        stats = dict()
+        self.assertEqual(['Estacion Nos'], stations.split_stations(metro_stations, self.index, stats))
+        self.assertEqual({'TOBALABAL4', 'UNKNOWNL1'}, metro_stations)
+        self.assertEqual(dict(metrotren_stations=1, stations_unmatched=1), stats)
+        self.assertEqual([], stations.split_stations({'TOBALABAL4'}))
+
+    def test_signature(self):
+        self.assertEqual(self.index.signature, stations.load_station_index(self.inputs_path).signature)
+        other_index = stations.StationIndex(dict(), dict(Nos=dict(longitude=-33.4, latitude=-70.6)))
+        self.assertNotEqual(self.index.signature, other_index.signature)
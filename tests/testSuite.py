@@ -0,0 +1,25 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import logging
+from benchmarks import suite
+
+
+class SuiteTest(TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def test_main_with_layers(self):
+        # smoke run over a tiny dataset, comuna and grid layers are built from the synthetic comunas
+        with tempfile.TemporaryDirectory() as results_path:
+            results_path = os.path.join(results_path, 'results.jsonl')
+            with mock.patch('builtins.print'):
+                suite.main(['suite', '--stops', '600', '--days', '1', '--metro-stations', '10', '--half-hours', '2',
+                            '--results', results_path, '--process-args', '--layers comuna grid --quiet'])
+            with open(results_path) as results_file:
+                results = [json.loads(line) for line in results_file]
+        self.assertEqual(1, len(results))
+        self.assertIn('layers_day', results[0]['stages'])